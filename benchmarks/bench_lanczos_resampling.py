@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the cached Lanczos resampling operators of the tf_phase_misfit
+against resampling every trace with obspy.
+
+The event has 1000 stations with 3 components each, all sampled the same
+way. The first part times the resampling the tf_phase_misfit does for every
+trace: observed and synthetic data to the internal sampling interval and
+the adjoint source back. The second part times the complete
+tf_phase_misfit for some of the stations and extrapolates to the event.
+
+Usage::
+
+    python benchmarks/bench_lanczos_resampling.py [n_stations_misfit]
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import sys
+import time
+from unittest import mock
+
+import numpy as np
+from obspy.signal.interpolation import lanczos_interpolation
+
+from lasif.tools.adjoint import utils
+from lasif.tools.adjoint.adjoint_source import calculate_adjoint_source_array
+
+N_STATIONS = 1000
+MIN_PERIOD = 20.0
+MAX_PERIOD = 100.0
+
+
+def _obspy_resample(data, old_start, old_dt, new_start, new_dt, new_npts, a):
+    return lanczos_interpolation(
+        data=data,
+        old_start=old_start,
+        old_dt=old_dt,
+        new_start=new_start,
+        new_dt=new_dt,
+        new_npts=new_npts,
+        a=a,
+    )
+
+
+def get_event():
+    """
+    Observed and synthetic data of all stations and components, the example
+    data with a different amplitude at every station.
+    """
+    observed, synthetic = utils.get_example_data()
+    rng = np.random.RandomState(12345)
+    event = []
+    for amplitude in rng.uniform(0.5, 2.0, N_STATIONS):
+        for obs, syn in zip(observed, synthetic):
+            event.append((amplitude * obs.data, syn.data, obs.stats))
+    return event
+
+
+def resample_event(event, resample):
+    """
+    The resampling of the tf_phase_misfit for all traces of the event.
+    """
+    for obs, syn, stats in event:
+        dt = stats.delta
+        t_end = (stats.npts - 1) * dt
+        dt_new = max(float(int(MIN_PERIOD / 4.0)), dt)
+        new_npts = len(utils.matlab_range(0.0, t_end, dt_new))
+        if not new_npts % 2:
+            new_npts -= 1
+        for data in (obs, syn):
+            resample(data, 0.0, dt, 0.0, dt_new, new_npts, a=8)
+        # The adjoint source is padded with 100 zeros before resampling it
+        # back.
+        resample(
+            np.zeros(new_npts + 100), 0.0, dt_new, 0.0, dt, stats.npts, a=8
+        )
+
+
+def bench_resampling(event):
+    print(
+        f"Resampling of {N_STATIONS} stations x 3 components, "
+        f"{len(event) * 3} resamplings:"
+    )
+    utils.get_lanczos_operator.cache_clear()
+    timings = {}
+    for name, resample in [
+        ("obspy", _obspy_resample),
+        ("cached operators", utils.lanczos_resample),
+    ]:
+        t = time.perf_counter()
+        resample_event(event, resample)
+        timings[name] = time.perf_counter() - t
+        print(f"{name:<18} {timings[name]:>8.2f} s")
+    info = utils.get_lanczos_operator.cache_info()
+    print(
+        f"speedup {timings['obspy'] / timings['cached operators']:.1f}x, "
+        f"{info.misses} operators built, {info.hits} reused"
+    )
+
+
+def bench_misfit(event, n_stations):
+    traces = event[: 3 * n_stations]
+    start = traces[0][2].starttime
+    windows = [
+        (start + _w[0], start + _w[1])
+        for _w in [utils.EXAMPLE_DATA_PDIFF, utils.EXAMPLE_DATA_SDIFF]
+    ]
+
+    def run():
+        return [
+            calculate_adjoint_source_array(
+                "tf_phase_misfit",
+                obs,
+                syn,
+                stats,
+                windows,
+                min_period=MIN_PERIOD,
+                max_period=MAX_PERIOD,
+            )
+            for obs, syn, stats in traces
+        ]
+
+    print(
+        f"\ntf_phase_misfit with adjoint sources, {n_stations} stations, "
+        f"extrapolated to {N_STATIONS} stations:"
+    )
+    timings = {}
+    results = {}
+    for name in ["obspy", "cached operators"]:
+        if name == "obspy":
+            patch = mock.patch.object(
+                utils, "lanczos_resample", _obspy_resample
+            )
+        else:
+            patch = mock.patch.object(
+                utils, "lanczos_resample", utils.lanczos_resample
+            )
+        with patch:
+            t = time.perf_counter()
+            results[name] = run()
+            timings[name] = time.perf_counter() - t
+        print(
+            f"{name:<18} {timings[name] * N_STATIONS / n_stations:>8.2f} s"
+        )
+
+    diff = max(
+        abs(_a.misfit - _b.misfit) / abs(_a.misfit)
+        for _a, _b in zip(results["obspy"], results["cached operators"])
+    )
+    print(
+        f"speedup {timings['obspy'] / timings['cached operators']:.2f}x, "
+        f"max relative misfit diff {diff:.2e}"
+    )
+
+
+def main():
+    np.seterr(all="ignore")
+    n_stations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    event = get_event()
+    bench_resampling(event)
+    bench_misfit(event, n_stations)
+
+
+if __name__ == "__main__":
+    main()
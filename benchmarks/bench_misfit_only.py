@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the misfit-only mode used for line searches against the full
+adjoint source calculation.
+
+The first part times the misfit functions on their own, with and without
+computing the adjoint source, for every misfit type. The second part runs
+both modes end to end on a copy of the example project of the test suite,
+which includes reading the data, the pool and all file I/O.
+
+Usage::
+
+    python benchmarks/bench_misfit_only.py
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import contextlib
+import glob
+import io
+import os
+import shutil
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+from lasif import api
+from lasif.tools.adjoint import utils
+from lasif.tools.adjoint.adjoint_source import calculate_adjoint_source_array
+
+EXAMPLE_PROJECT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "lasif",
+    "tests",
+    "data",
+    "example_project",
+)
+
+
+def _best_of(fct, repeat=5):
+    return min(timeit.repeat(fct, number=1, repeat=repeat))
+
+
+def bench_misfit_functions():
+    observed, synthetic = utils.get_example_data()
+    observed = observed.select(component="Z")[0]
+    synthetic = synthetic.select(component="Z")[0]
+    start = observed.stats.starttime
+    windows = [
+        (start + _w[0], start + _w[1])
+        for _w in [utils.EXAMPLE_DATA_PDIFF, utils.EXAMPLE_DATA_SDIFF]
+    ]
+
+    print(
+        f"{'misfit type':<22} {'adjoint [ms]':>13} {'misfit only [ms]':>17} "
+        f"{'speedup':>8} {'misfit diff':>12}"
+    )
+    for adj_src_type in [
+        "waveform_misfit",
+        "cc_traveltime_misfit",
+        "envelope_misfit",
+        "tf_phase_misfit",
+    ]:
+
+        def run(adjoint_src):
+            return calculate_adjoint_source_array(
+                adj_src_type,
+                observed.data,
+                synthetic.data,
+                observed.stats,
+                windows,
+                min_period=20.0,
+                max_period=100.0,
+                adjoint_src=adjoint_src,
+            )
+
+        diff = abs(run(True).misfit - run(False).misfit)
+        t_full = _best_of(lambda: run(True))
+        t_misfit = _best_of(lambda: run(False))
+        print(
+            f"{adj_src_type:<22} {t_full * 1e3:>13.2f} "
+            f"{t_misfit * 1e3:>17.2f} {t_full / t_misfit:>7.1f}x "
+            f"{diff:>12.2e}"
+        )
+
+
+def bench_project(num_processes=2):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        project = os.path.join(tmpdir, "proj")
+        shutil.copytree(EXAMPLE_PROJECT, project)
+        # The example project does not ship raw data, which is what makes
+        # events known to LASIF. The processed data serves as a stand in.
+        raw_folder = os.path.join(project, "DATA", "EARTHQUAKES")
+        os.makedirs(raw_folder, exist_ok=True)
+        processed = os.path.join(project, "PROCESSED_DATA", "EARTHQUAKES")
+        for filename in glob.glob(os.path.join(processed, "*", "*.h5")):
+            event = os.path.basename(os.path.dirname(filename))
+            shutil.copy(filename, os.path.join(raw_folder, event + ".h5"))
+        comm = api.find_project_comm(project)
+
+        timings = {}
+        misfits = {}
+        for name in ["adjoint", "misfit only"]:
+            t = time.perf_counter()
+            with contextlib.redirect_stdout(
+                io.StringIO()
+            ), contextlib.redirect_stderr(io.StringIO()):
+                if name == "adjoint":
+                    api.calculate_adjoint_sources_multiprocessing(
+                        comm, "1", "A", num_processes=num_processes
+                    )
+                    misfits[name] = {
+                        _e: comm.adj_sources.get_misfit_for_event(_e, "1")
+                        for _e in comm.events.list(iteration="1")
+                    }
+                else:
+                    misfits[name] = api.calculate_misfits_multiprocessing(
+                        comm, "1", "A", num_processes=num_processes
+                    )
+            timings[name] = time.perf_counter() - t
+
+    diff = max(
+        abs(misfits["adjoint"][_e] - misfits["misfit only"][_e])
+        for _e in misfits["adjoint"]
+    )
+    print(
+        f"\nExample project, {len(misfits['adjoint'])} events, "
+        f"{num_processes} processes:"
+    )
+    for name, t in timings.items():
+        print(f"{name:<12} {t:>8.2f} s")
+    print(
+        f"speedup {timings['adjoint'] / timings['misfit only']:.1f}x, "
+        f"max misfit diff {diff:.2e}"
+    )
+
+
+def main():
+    np.seterr(all="ignore")
+    bench_misfit_functions()
+    bench_project()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the batched time frequency transforms and their inverse
+against the loops over all time shifts they replace.
+
+The tf_phase_misfit resamples traces to a quarter of the minimum period, so
+typical transforms have a few hundred to a few thousand samples.
+
+Usage::
+
+    python benchmarks/bench_time_frequency.py
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import timeit
+
+import numpy as np
+
+from lasif.tools.adjoint import time_frequency, utils
+
+
+def _best_of(fct, repeat=5):
+    return min(timeit.repeat(fct, number=1, repeat=repeat))
+
+
+def _compare(name, reference, batched, args, result_index):
+    ref = reference(*args)[result_index]
+    new = batched(*args)[result_index]
+    diff = np.abs(new - ref).max() / np.abs(ref).max()
+
+    t_loop = _best_of(lambda: reference(*args))
+    t_new = _best_of(lambda: batched(*args))
+    t_threads = _best_of(lambda: batched(*args, workers=-1))
+    print(
+        f"{name:<14} {len(args[0]):>6} {t_loop * 1e3:>11.2f} "
+        f"{t_new * 1e3:>13.2f} {t_threads * 1e3:>13.2f} "
+        f"{t_loop / t_new:>7.1f}x {diff:>13.2e}"
+    )
+
+
+def main():
+    print(
+        f"{'function':<14} {'npts':>6} {'loop [ms]':>11} "
+        f"{'batched [ms]':>13} {'threads [ms]':>13} {'speedup':>8} "
+        f"{'max rel diff':>13}"
+    )
+    for npts in [251, 501, 1001, 2001]:
+        t, u = utils.get_dispersed_wavetrain(
+            dt=5.0, t_max=5.0 * (npts - 1)
+        )
+        _, u0 = utils.get_dispersed_wavetrain(
+            dt=5.0,
+            t_max=5.0 * (npts - 1),
+            a=3.91,
+            b=0.87,
+            c=0.8,
+            body_wave_factor=0.015,
+            body_wave_freq_scale=1.0 / 2.2,
+        )
+        width = 2.0 * 20.0
+        _, _, tfs = time_frequency.time_frequency_transform(t, u, width)
+
+        _compare(
+            "tf_transform",
+            time_frequency._time_frequency_transform_loop,
+            time_frequency.time_frequency_transform,
+            (t, u, width),
+            2,
+        )
+        _compare(
+            "tf_cc_diff",
+            time_frequency._time_frequency_cc_difference_loop,
+            time_frequency.time_frequency_cc_difference,
+            (t, u, u0, width),
+            2,
+        )
+        _compare(
+            "itfa",
+            time_frequency._itfa_loop,
+            time_frequency.itfa,
+            (t, tfs, width),
+            0,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the FFT based sliding window cross correlations of the window
+selection against correlating every window with ``np.correlate``.
+
+The window selection runs on the data and synthetics of the test suite,
+also resampled to shorter sampling intervals, which makes the traces and
+the sliding windows longer. Both ways must select the same windows. The
+table shows the time of the cross correlation stage and of the complete
+window selection of a trace.
+
+Usage::
+
+    python benchmarks/bench_window_cross_correlation.py [repeats]
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+import sys
+import time
+from unittest import mock
+
+import numpy as np
+import obspy
+
+from lasif import window_selection
+from lasif.function_templates.source_time_function import (
+    source_time_function,
+)
+
+DATA = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "lasif",
+    "tests",
+    "data",
+    "window_selection_test_files",
+)
+MINIMUM_PERIOD = 40.0
+MAXIMUM_PERIOD = 100.0
+
+
+def _correlate_every_window(data_windows, synthetic_windows, chunk_size=256):
+    """
+    The cross correlations as they were computed before, one window at a
+    time.
+    """
+    time_shifts = []
+    max_cc = []
+    for data_window, synthetic_window in zip(
+        data_windows, synthetic_windows
+    ):
+        cc = np.correlate(data_window, synthetic_window, mode="full")
+        time_shifts.append(cc.argmax() - len(data_window) + 1)
+        max_cc.append(
+            cc.max()
+            / np.sqrt(
+                (synthetic_window ** 2).sum() * (data_window ** 2).sum()
+            )
+        )
+    return np.array(time_shifts), np.array(max_cc)
+
+
+def get_traces(factor):
+    data = obspy.read(os.path.join(DATA, "LA.AA10..BHZ.mseed"))[0]
+    synth = obspy.read(os.path.join(DATA, "LA.AA10_.___.z.mseed"))[0]
+    synth.interpolate(sampling_rate=data.stats.sampling_rate)
+    synth.trim(endtime=data.stats.endtime)
+    data.trim(endtime=synth.stats.endtime)
+    if factor > 1:
+        for tr in (data, synth):
+            tr.interpolate(sampling_rate=tr.stats.sampling_rate * factor)
+    return data, synth
+
+
+def pick(data, synth):
+    stf = source_time_function(
+        npts=data.stats.npts,
+        delta=data.stats.delta,
+        freqmin=1.0 / MAXIMUM_PERIOD,
+        freqmax=1.0 / MINIMUM_PERIOD,
+    )
+    return window_selection.select_windows(
+        data_trace=data.copy(),
+        synthetic_trace=synth.copy(),
+        stf_trace=stf,
+        event_latitude=44.87,
+        event_longitude=8.48,
+        event_depth_in_km=15.0,
+        station_latitude=41.3317000452,
+        station_longitude=2.00073761549,
+        minimum_period=MINIMUM_PERIOD,
+        maximum_period=MAXIMUM_PERIOD,
+        min_cc=0.10,
+        max_noise=0.10,
+        max_noise_window=0.4,
+        min_velocity=2.4,
+        threshold_shift=0.30,
+        threshold_correlation=0.75,
+        min_length_period=1.5,
+        min_peaks_troughs=2,
+        max_energy_ratio=2.0,
+    )
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(
+        f"{'dt [s]':>8}{'npts':>8}{'window':>8}{'stage':>8}"
+        f"{'np.correlate [s]':>18}{'FFT [s]':>10}{'speedup':>9}"
+    )
+    for factor in [1, 2, 4, 8]:
+        data, synth = get_traces(factor)
+        window_length = int(round(2 * MINIMUM_PERIOD / data.stats.delta))
+        timings = {}
+        stage_timings = {}
+        windows = {}
+        for name, fct in [
+            ("np.correlate", _correlate_every_window),
+            ("fft", window_selection._max_cross_correlation),
+        ]:
+            stage_timings[name] = 0.0
+
+            def timed_fct(*args, _fct=fct, _name=name):
+                t = time.perf_counter()
+                result = _fct(*args)
+                stage_timings[_name] += time.perf_counter() - t
+                return result
+
+            with mock.patch.object(
+                window_selection, "_max_cross_correlation", timed_fct
+            ):
+                t = time.perf_counter()
+                for _ in range(repeats):
+                    windows[name] = pick(data, synth)
+                timings[name] = (time.perf_counter() - t) / repeats
+            stage_timings[name] /= repeats
+        assert windows["np.correlate"] == windows["fft"], windows
+        for label, t in [("cc", stage_timings), ("total", timings)]:
+            print(
+                f"{data.stats.delta:>8.3f}{data.stats.npts:>8}"
+                f"{window_length:>8}{label:>8}{t['np.correlate']:>18.3f}"
+                f"{t['fft']:>10.3f}{t['np.correlate'] / t['fft']:>8.1f}x"
+            )
+        print(f"{len(windows['fft'])} identical windows")
+
+
+if __name__ == "__main__":
+    main()
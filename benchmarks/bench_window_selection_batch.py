@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the batched window selection against selecting the windows of
+one pair of traces at a time.
+
+The batch consists of three components of many stations, made from the data
+and synthetics of the test suite with some noise and time shifts. Both ways
+must select the same windows. The best of several runs is shown.
+
+Usage::
+
+    python benchmarks/bench_window_selection_batch.py [stations] [repeats]
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import sys
+import time
+
+import numpy as np
+
+from lasif import window_selection
+from lasif.function_templates.source_time_function import (
+    source_time_function,
+)
+from bench_window_cross_correlation import (
+    MAXIMUM_PERIOD,
+    MINIMUM_PERIOD,
+    get_traces,
+)
+
+PARAMETERS = {
+    "event_latitude": 44.87,
+    "event_longitude": 8.48,
+    "event_depth_in_km": 15.0,
+    "minimum_period": MINIMUM_PERIOD,
+    "maximum_period": MAXIMUM_PERIOD,
+    "max_energy_ratio": 2.0,
+}
+
+
+def make_batch(n_stations):
+    data_trace, synthetic_trace = get_traces(1)
+    rng = np.random.RandomState(12345)
+    data = []
+    synthetics = []
+    latitudes = []
+    longitudes = []
+    for i in range(n_stations):
+        latitude = 41.3317 + rng.uniform(-1.0, 1.0)
+        longitude = 2.0007 + rng.uniform(-1.0, 1.0)
+        for _ in range(3):
+            noise = rng.uniform(0.0, 0.03) * np.abs(data_trace.data).max()
+            data.append(
+                data_trace.data + noise * rng.randn(data_trace.stats.npts)
+            )
+            synthetics.append(
+                np.roll(synthetic_trace.data, rng.randint(-20, 20))
+            )
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+    return (
+        data_trace,
+        synthetic_trace,
+        np.array(data),
+        np.array(synthetics),
+        latitudes,
+        longitudes,
+    )
+
+
+def main():
+    n_stations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    (
+        data_trace,
+        synthetic_trace,
+        data,
+        synthetics,
+        latitudes,
+        longitudes,
+    ) = make_batch(n_stations)
+    stf_trace = source_time_function(
+        npts=data_trace.stats.npts,
+        delta=data_trace.stats.delta,
+        freqmin=1.0 / MAXIMUM_PERIOD,
+        freqmax=1.0 / MINIMUM_PERIOD,
+    )
+
+    single_time = batch_time = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        single = []
+        for i in range(len(data)):
+            data_trace.data = data[i]
+            synthetic_trace.data = synthetics[i]
+            single.append(
+                window_selection.select_windows(
+                    data_trace=data_trace,
+                    synthetic_trace=synthetic_trace,
+                    stf_trace=stf_trace,
+                    station_latitude=latitudes[i],
+                    station_longitude=longitudes[i],
+                    **PARAMETERS,
+                )
+            )
+        single_time = min(single_time, time.perf_counter() - start)
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        batch = window_selection.select_windows_batch(
+            data=data,
+            synthetics=synthetics,
+            starttimes=data_trace.stats.starttime,
+            delta=data_trace.stats.delta,
+            stf_trace=stf_trace,
+            station_latitudes=latitudes,
+            station_longitudes=longitudes,
+            **PARAMETERS,
+        )
+        batch_time = min(batch_time, time.perf_counter() - start)
+
+    assert single == batch
+    print(
+        f"{len(data)} traces, {sum(len(_w) for _w in batch)} identical "
+        f"windows\n"
+        f"one trace at a time: {single_time:.3f} s "
+        f"({single_time / len(data) * 1e3:.2f} ms per trace)\n"
+        f"batched:             {batch_time:.3f} s "
+        f"({batch_time / len(data) * 1e3:.2f} ms per trace), "
+        f"{single_time / batch_time:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the numpy implementations of the extrema, peak and trough
+marching and masking stages of the window selection against the loops they
+replace.
+
+Every stage is timed within the window selection of the test suite traces,
+also resampled to shorter sampling intervals, once with the loops and once
+with the numpy implementations. Both must select the same windows. The
+stages are also timed on their own with the inputs of a long, noisy trace,
+which has many more extrema, time shift jumps and short windows.
+
+Usage::
+
+    python benchmarks/bench_window_selection_stages.py [repeats]
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import itertools
+import sys
+import time
+from unittest import mock
+
+import numpy as np
+from scipy.signal import argrelextrema
+
+from lasif import window_selection
+from bench_window_cross_correlation import get_traces, pick
+
+
+def _find_local_extrema_loop(data):
+    """
+    The extrema search as it was before, walking from every flat value to
+    the next slope on both sides.
+    """
+    length = len(data) - 1
+    diff = np.diff(data)
+    flats = np.argwhere(diff == 0)
+
+    new_flats = list(flats[0:1])
+    for i, j in zip(flats[:-1], flats[1:]):
+        if j - i == 1:
+            continue
+        new_flats.append(j)
+    flats = new_flats
+
+    maxima = []
+    minima = []
+    for idx in flats:
+        l_type = "left"
+        r_type = "right"
+        for i in itertools.count():
+            this_idx = idx - i - 1
+            if diff[this_idx] < 0:
+                l_type = "minima"
+                break
+            elif diff[this_idx] > 0:
+                l_type = "maxima"
+                break
+        for i in itertools.count():
+            this_idx = idx + i + 1
+            if this_idx >= len(diff):
+                break
+            if diff[this_idx] < 0:
+                r_type = "maxima"
+                break
+            elif diff[this_idx] > 0:
+                r_type = "minima"
+                break
+        if r_type != l_type:
+            continue
+        if r_type == "maxima":
+            maxima.append(int(idx))
+        else:
+            minima.append(int(idx))
+
+    maxs = set(list(argrelextrema(data, np.greater)[0]))
+    mins = set(list(argrelextrema(data, np.less)[0]))
+    peaks, troughs = (
+        sorted(list(maxs.union(set(maxima)))),
+        sorted(list(mins.union(set(minima)))),
+    )
+
+    if not peaks and not troughs:
+        return np.array([], dtype=np.int32), np.array([], dtype=np.int32)
+    elif not peaks:
+        if 0 not in troughs:
+            peaks.insert(0, 0)
+        if length not in troughs:
+            peaks.append(length)
+        return (
+            np.array(peaks, dtype=np.int32),
+            np.array(troughs, dtype=np.int32),
+        )
+    elif not troughs:
+        if 0 not in peaks:
+            troughs.insert(0, 0)
+        if length not in peaks:
+            troughs.append(length)
+        return (
+            np.array(peaks, dtype=np.int32),
+            np.array(troughs, dtype=np.int32),
+        )
+
+    if 0 not in peaks and 0 not in troughs:
+        if peaks[0] < troughs[0]:
+            troughs.insert(0, 0)
+        else:
+            peaks.insert(0, 0)
+    if length not in peaks and length not in troughs:
+        if peaks[-1] < troughs[-1]:
+            peaks.append(length)
+        else:
+            troughs.append(length)
+
+    return (np.array(peaks, dtype=np.int32), np.array(troughs, dtype=np.int32))
+
+
+def _mask_around_loop(time_windows, indices, sample_buffer):
+    for index in indices:
+        time_windows.mask[index - sample_buffer : index + sample_buffer] = True
+
+
+def _mask_short_windows_loop(time_windows, min_length):
+    for i in window_selection.flatnotmasked_contiguous(time_windows):
+        if (i.stop - i.start) < min_length:
+            time_windows.mask[i.start : i.stop] = True
+
+
+def _marching_ranges_loop(closest, extrema, npts):
+    window_mask = np.ones(npts, dtype="bool")
+    for idx in np.where(np.diff(closest) == 1)[0]:
+        if idx > 0:
+            start = extrema[idx - 1]
+        else:
+            start = 0
+        if idx < (len(extrema) - 1):
+            end = extrema[idx + 1]
+        else:
+            end = -1
+        window_mask[start:end] = False
+    return ~window_mask
+
+
+STAGES = [
+    ("extrema", "find_local_extrema", _find_local_extrema_loop),
+    ("buffer masking", "_mask_around", _mask_around_loop),
+    ("minimum length", "_mask_short_windows", _mask_short_windows_loop),
+    ("marching", "_marching_ranges", _marching_ranges_loop),
+]
+
+
+def _time_stages(data, synth, repeats, use_loops):
+    """
+    Time every stage and the complete window selection of a trace.
+    """
+    timings = {_s[0]: 0.0 for _s in STAGES}
+    patches = []
+    for label, name, loop in STAGES:
+        fct = loop if use_loops else getattr(window_selection, name)
+
+        def timed_fct(*args, _fct=fct, _label=label):
+            t = time.perf_counter()
+            result = _fct(*args)
+            timings[_label] += time.perf_counter() - t
+            return result
+
+        patches.append(mock.patch.object(window_selection, name, timed_fct))
+
+    for p in patches:
+        p.start()
+    try:
+        t = time.perf_counter()
+        for _ in range(repeats):
+            windows = pick(data, synth)
+        timings["total"] = time.perf_counter() - t
+    finally:
+        for p in patches:
+            p.stop()
+    return {_k: _v / repeats for _k, _v in timings.items()}, windows
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(
+        f"{'dt [s]':>8}{'npts':>8}  {'stage':<16}"
+        f"{'loops [ms]':>12}{'numpy [ms]':>12}{'speedup':>9}"
+    )
+    for factor in [1, 2, 4, 8]:
+        data, synth = get_traces(factor)
+        loops, loop_windows = _time_stages(data, synth, repeats, True)
+        vectorized, windows = _time_stages(data, synth, repeats, False)
+        assert loop_windows == windows, (loop_windows, windows)
+        for label in [_s[0] for _s in STAGES] + ["total"]:
+            speedup = (
+                loops[label] / vectorized[label] if vectorized[label] else 0.0
+            )
+            print(
+                f"{data.stats.delta:>8.3f}{data.stats.npts:>8}  {label:<16}"
+                f"{loops[label] * 1e3:>12.2f}{vectorized[label] * 1e3:>12.2f}"
+                f"{speedup:>8.1f}x"
+            )
+        print(f"{len(windows)} identical windows")
+
+    print()
+    print(
+        f"{'isolated stage':<24}{'loops [ms]':>12}{'numpy [ms]':>12}"
+        f"{'speedup':>9}"
+    )
+    for label, loop, fct, make_args, compare in _isolated_stages():
+        timings = {}
+        results = {}
+        for name, f in [("loops", loop), ("numpy", fct)]:
+            timings[name] = 0.0
+            for _ in range(repeats):
+                args = make_args()
+                start = time.perf_counter()
+                results[name] = f(*args)
+                timings[name] += time.perf_counter() - start
+            if results[name] is None:
+                results[name] = args[0]
+            timings[name] /= repeats
+        compare(results["loops"], results["numpy"])
+        print(
+            f"{label:<24}{timings['loops'] * 1e3:>12.2f}"
+            f"{timings['numpy'] * 1e3:>12.2f}"
+            f"{timings['loops'] / timings['numpy']:>8.1f}x"
+        )
+
+
+def _isolated_stages():
+    """
+    The stages with the inputs of a long, noisy trace: many flat extrema,
+    as in quantized data, many jumps of the time shifts and many short
+    windows.
+    """
+    npts = 200000
+    rng = np.random.RandomState(12345)
+    t = np.linspace(0, 200 * np.pi, npts)
+    trace = np.round(20 * np.sin(t) + rng.randn(npts))
+    other = np.round(20 * np.sin(t - 0.01) + rng.randn(npts))
+    jumps = np.sort(rng.choice(npts, 5000, replace=False))
+    mask = rng.rand(npts) < 0.3
+
+    def time_windows():
+        tw = np.ma.ones(npts)
+        tw.mask = mask.copy()
+        return tw
+
+    synth_p = window_selection.find_local_extrema(trace)[0]
+    data_p = window_selection.find_local_extrema(other)[0]
+    closest = window_selection.find_closest(data_p, synth_p)
+
+    def same_extrema(a, b):
+        for x, y in zip(a, b):
+            np.testing.assert_array_equal(x, y)
+
+    def same_mask(a, b):
+        np.testing.assert_array_equal(np.ma.getmaskarray(a), b.mask)
+
+    return [
+        (
+            "extrema",
+            _find_local_extrema_loop,
+            window_selection.find_local_extrema,
+            lambda: (trace,),
+            same_extrema,
+        ),
+        (
+            "buffer masking",
+            _mask_around_loop,
+            window_selection._mask_around,
+            lambda: (time_windows(), jumps, 10),
+            same_mask,
+        ),
+        (
+            "minimum length",
+            _mask_short_windows_loop,
+            window_selection._mask_short_windows,
+            lambda: (time_windows(), 5),
+            same_mask,
+        ),
+        (
+            "marching",
+            _marching_ranges_loop,
+            window_selection._marching_ranges,
+            lambda: (closest, synth_p, npts),
+            np.testing.assert_array_equal,
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    main()
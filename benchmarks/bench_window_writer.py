@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the bulk window writer against writing the windows one at a
+time, each with its own overlap deletion and insert.
+
+The windows of an event with many stations, three components each, are
+written into an empty window set and once more into the filled window
+set, which replaces all of them. Both ways must produce the same window
+set. The best of several runs is shown.
+
+Usage::
+
+    python benchmarks/bench_window_writer.py [stations] [repeats]
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from obspy import UTCDateTime
+
+from lasif.window_manager_sql import (
+    WindowGroupManager,
+    _split_id,
+    _to_timestamp,
+)
+
+
+def _write_windows_per_window(manager, event_name, results):
+    """
+    The bulk writer as it was before, one overlap deletion and insert per
+    window.
+    """
+    with manager.sqlite_cursor(write=True) as c:
+        c.execute(
+            "SELECT EXISTS(SELECT event_id FROM events "
+            "WHERE event_name = ?)",
+            (event_name,),
+        )
+        if not bool(c.fetchone()[0]):
+            c.execute("INSERT INTO events VALUES (NULL, ? )", (event_name,))
+        c.execute(
+            "SELECT event_id FROM events WHERE event_name = ?", (event_name,)
+        )
+        event_id = c.fetchone()[0]
+
+        for station, channels in results.items():
+            if channels is None:
+                continue
+            for channel, windows in channels.items():
+                c.execute(
+                    "SELECT EXISTS(SELECT 1 FROM traces "
+                    "WHERE channel_name=? AND event_id=? LIMIT 1)",
+                    (channel, event_id),
+                )
+                if not bool(c.fetchone()[0]):
+                    c.execute(
+                        " INSERT INTO traces VALUES (NULL, ?, ?, ?, ?)",
+                        (event_id, *_split_id(channel), channel),
+                    )
+                c.execute(
+                    "SELECT trace_id FROM traces "
+                    "WHERE channel_name=? AND event_id=?",
+                    (channel, event_id),
+                )
+                trace_id = c.fetchone()[0]
+                for window in windows:
+                    start_time = _to_timestamp(window[0])
+                    end_time = _to_timestamp(window[1])
+                    c.execute(
+                        """
+                        DELETE FROM windows WHERE trace_id=?
+                        AND ((start_time BETWEEN ? AND ?)
+                        OR (end_time BETWEEN ? AND ?)
+                        OR (start_time >= ? AND end_time <= ?)
+                        OR (start_time <= ? AND end_time >= ?))
+                        """,
+                        (trace_id,) + (start_time, end_time) * 4,
+                    )
+                    c.execute(
+                        "INSERT INTO windows VALUES (NULL, ?, ?, ?, ?)",
+                        (trace_id, start_time, end_time, 1.0),
+                    )
+
+
+def make_results(n_stations):
+    rng = np.random.RandomState(12345)
+    starttime = UTCDateTime(2010, 3, 24, 14, 11, 31)
+    results = {}
+    for i in range(n_stations):
+        station = f"XX.S{i:04d}"
+        results[station] = {}
+        for component in "ENZ":
+            windows = []
+            for _ in range(rng.randint(0, 6)):
+                start = starttime + rng.uniform(0.0, 3000.0)
+                windows.append(
+                    (start, start + rng.uniform(20.0, 200.0), False)
+                )
+            results[station][f"{station}.00.BH{component}"] = windows
+    return results
+
+
+def _contents(filename):
+    with WindowGroupManager(filename, read_only=True) as manager:
+        return manager.get_all_windows_for_event("event")
+
+
+def main():
+    n_stations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    results = make_results(n_stations)
+    n_windows = sum(
+        len(_w) for _c in results.values() for _w in _c.values()
+    )
+
+    timings = {}
+    contents = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for name, write in [
+            ("one window at a time", _write_windows_per_window),
+            ("bulk", WindowGroupManager.write_windows_bulk),
+        ]:
+            timings[name] = [float("inf"), float("inf")]
+            for _ in range(repeats):
+                filename = os.path.join(directory, "windows.sqlite")
+                for f in os.listdir(directory):
+                    os.remove(os.path.join(directory, f))
+                with WindowGroupManager(filename) as manager:
+                    for i in range(2):
+                        start = time.perf_counter()
+                        write(manager, "event", results)
+                        timings[name][i] = min(
+                            timings[name][i], time.perf_counter() - start
+                        )
+                contents[name] = _contents(filename)
+    finally:
+        shutil.rmtree(directory)
+
+    assert contents["one window at a time"] == contents["bulk"]
+    n_written = sum(
+        len(_w) for _c in contents["bulk"].values() for _w in _c.values()
+    )
+    print(
+        f"{n_stations} stations, {n_windows} windows, {n_written} without "
+        f"overlaps, identical window sets"
+    )
+    print(f"{'':<22}{'empty [s]':>12}{'filled [s]':>12}")
+    for name, (empty, filled) in timings.items():
+        print(f"{name:<22}{empty:>12.3f}{filled:>12.3f}")
+    reference = timings["one window at a time"]
+    print(
+        f"{'speedup':<22}{reference[0] / timings['bulk'][0]:>11.1f}x"
+        f"{reference[1] / timings['bulk'][1]:>11.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -53,6 +53,27 @@ def find_project_comm(folder):
     raise LASIFCommandLineException(msg)
 
 
+def _stage_timing(comm, timing: bool, command: str):
+    """
+    Context manager that times the stages of a command if ``timing`` is
+    set, see :mod:`lasif.tools.stage_timing`. The JSON summary is written
+    to the TIMING folder of the logs.
+
+    :param comm: The communicator of the project
+    :param timing: Time the stages
+    :type timing: bool
+    :param command: Name of the command, used for the file name
+    :type command: str
+    """
+    from lasif.tools.stage_timing import report
+
+    filename = None
+    if timing:
+        log_file = comm.project.get_log_file("TIMING", command)
+        filename = os.path.splitext(log_file)[0] + ".json"
+    return report(filename, enabled=timing)
+
+
 def plot_domain(lasif_root, save=False, inner_boundary=False):
     """
     Plot the studied domain specified in config file
@@ -570,6 +591,9 @@ def calculate_adjoint_sources_multiprocessing(
     weight_set: str = None,
     events: Union[str, List[str]] = None,
     num_processes: int = 16,
+    incremental: bool = False,
+    resume: bool = False,
+    timing: bool = False,
 ):
     """
     Calculate adjoint sources for a given iteration
@@ -588,6 +612,18 @@ def calculate_adjoint_sources_multiprocessing(
     :type events: Union[str, List[str]]
     :param num_processes: The number of processes used in multiprocessing
     :type num_processes: int
+    :param incremental: Keep the adjoint sources of the last incremental
+        calculation and only recompute the stations whose processed data,
+        synthetics, windows or misfit configuration changed, defaults to
+        False
+    :type incremental: bool, optional
+    :param resume: Resume an interrupted calculation. Completed events are
+        skipped and the stations that have already been written keep their
+        adjoint sources, defaults to False
+    :type resume: bool, optional
+    :param timing: Time the stages of the calculation and write a summary
+        to the logs, defaults to False
+    :type timing: bool, optional
     """
 
     comm = find_project_comm(lasif_root)
@@ -604,44 +640,246 @@ def calculate_adjoint_sources_multiprocessing(
     if isinstance(events, str):
         events = [events]
 
-    for _i, event in enumerate(events):
+    known_events = []
+    for event in events:
         if not comm.events.has_event(event):
             print(
                 f"Event {event} not known to LASIF. No adjoint sources for "
                 f"this event will be calculated. "
             )
             continue
+        known_events.append(event)
+        if incremental or resume:
+            continue
+
+        # remove adjoint sources if they already exist
+        comm.adj_sources.remove_adjoint_sources(event=event, iteration=iteration)
 
+    if not known_events:
+        return
+
+    print(
+        "\n{green}"
+        "==========================================================="
+        "{reset}".format(green=colorama.Fore.GREEN, reset=colorama.Style.RESET_ALL)
+    )
+    if len(known_events) > 1:
         print(
-            "\n{green}"
-            "==========================================================="
-            "{reset}".format(green=colorama.Fore.GREEN, reset=colorama.Style.RESET_ALL)
+            "Starting adjoint source calculation for %i events..."
+            % len(known_events)
         )
-        if len(events) > 1:
-            print(
-                "Starting adjoint source calculation for event %i of "
-                "%i..." % (_i + 1, len(events))
+    else:
+        print(f"Starting adjoint source calculation for event: {known_events[0]}")
+    print(
+        "{green}"
+        "==========================================================="
+        "{reset}\n".format(
+            green=colorama.Fore.GREEN, reset=colorama.Style.RESET_ALL
+        )
+    )
+
+    with _stage_timing(comm, timing, "calculate_adjoint_sources"):
+        if incremental or resume:
+            # Only the changed or missing stations of every event are
+            # computed, all events share one pool.
+            comm.adj_sources.calculate_adjoint_sources_for_events(
+                known_events,
+                iteration,
+                window_set,
+                num_processes,
+                weight_set_name=weight_set,
+                incremental=incremental,
+                resume=resume,
+            )
+        elif len(known_events) == 1:
+            comm.adj_sources.calculate_adjoint_sources_multiprocessing(
+                known_events[0], iteration, window_set, num_processes
+            )
+            comm.adj_sources.finalize_adjoint_sources(
+                iteration, known_events[0], weight_set
             )
         else:
-            print(f"Starting adjoint source calculation for event: {event}")
-        print(
-            "{green}"
-            "==========================================================="
-            "{reset}\n".format(
-                green=colorama.Fore.GREEN, reset=colorama.Style.RESET_ALL
+            # One pool for the stations of all events, every event is
+            # finalized as soon as its last station is done.
+            comm.adj_sources.calculate_adjoint_sources_for_events(
+                known_events,
+                iteration,
+                window_set,
+                num_processes,
+                weight_set_name=weight_set,
             )
-        )
 
-        # remove adjoint sources if they already exist
-        filename = comm.adj_sources.get_filename(event=event, iteration=iteration)
-        if os.path.exists(filename):
-            os.remove(filename)
 
-        comm.adj_sources.calculate_adjoint_sources_multiprocessing(
-            event, iteration, window_set, num_processes
+def calculate_misfits_multiprocessing(
+    lasif_root,
+    iteration: str,
+    window_set: str,
+    weight_set: str = None,
+    events: Union[str, List[str]] = None,
+    stations: Union[str, List[str]] = None,
+    num_processes: int = 16,
+    timing: bool = False,
+):
+    """
+    Calculate only the misfits for a given iteration, without computing or
+    writing any adjoint sources. Meant for line searches, where only the
+    misfit of each event is needed.
+    This function uses multiprocessing for parallelization
+
+    The misfits are weighted like the ones of
+    :func:`calculate_adjoint_sources_multiprocessing` and can be
+    retrieved in the same way afterwards.
+
+    :param lasif_root: path to lasif root directory
+    :type lasif_root: Union[str, pathlib.Path, object]
+    :param iteration: name of iteration
+    :type iteration: str
+    :param window_set: name of window set
+    :type window_set: str
+    :param weight_set: name of station weight set, defaults to None
+    :type weight_set: str, optional
+    :param events: Name of event or list of events. To get all events for
+        the iteration, pass None, defaults to None
+    :type events: Union[str, List[str]]
+    :param stations: Name of station or list of stations, e.g. "NET.STA", to
+        restrict the misfit to. To use all stations, pass None, defaults to
+        None
+    :type stations: Union[str, List[str]]
+    :param num_processes: The number of processes used in multiprocessing
+    :type num_processes: int
+    :param timing: Time the stages of the calculation and write a summary
+        to the logs, defaults to False
+    :type timing: bool, optional
+    :return: Dictionary with the misfit of every event
+    """
+    comm = find_project_comm(lasif_root)
+
+    # some basic checks
+    if not comm.windows.has_window_set(window_set):
+        raise LASIFNotFoundError("Window set {} not known to LASIF".format(window_set))
+
+    if not comm.iterations.has_iteration(iteration):
+        raise LASIFNotFoundError("Iteration {} not known to LASIF".format(iteration))
+
+    if events is None:
+        events = comm.events.list(iteration=iteration)
+    if isinstance(events, str):
+        events = [events]
+    if isinstance(stations, str):
+        stations = [stations]
+
+    known_events = []
+    for event in events:
+        if not comm.events.has_event(event):
+            print(
+                f"Event {event} not known to LASIF. No misfit for "
+                f"this event will be calculated. "
+            )
+            continue
+        known_events.append(event)
+
+    if not known_events:
+        return {}
+
+    with _stage_timing(comm, timing, "calculate_misfits"):
+        return comm.adj_sources.calculate_misfits_multiprocessing(
+            known_events,
+            iteration,
+            window_set,
+            num_processes,
+            weight_set_name=weight_set,
+            stations=stations,
         )
 
-        comm.adj_sources.finalize_adjoint_sources(iteration, event, weight_set)
+
+def calculate_validation_and_adjoint_sources(
+    lasif_root,
+    iteration: str,
+    window_set: str,
+    weight_set: str = None,
+    reference_iteration: str = None,
+    events: Union[str, List[str]] = None,
+    num_processes: int = 16,
+    min_sn_ratio: float = 0.1,
+    timing: bool = False,
+):
+    """
+    Calculate the L2 validation misfits and the adjoint sources of an
+    iteration in a single pass. Every station is read and processed only
+    once for both.
+    This function uses multiprocessing for parallelization
+
+    The adjoint sources are the same as the ones of
+    :func:`calculate_adjoint_sources_multiprocessing` and the validation
+    misfits the same as the ones of :func:`calculate_validation_data_misfit`.
+
+    :param lasif_root: path to lasif root directory
+    :type lasif_root: Union[str, pathlib.Path, object]
+    :param iteration: name of iteration
+    :type iteration: str
+    :param window_set: name of window set
+    :type window_set: str
+    :param weight_set: name of station weight set, defaults to None
+    :type weight_set: str, optional
+    :param reference_iteration: name of reference iteration. This
+        is used to make sure the same seismograms are selected when
+        comparing iterations, defaults to None
+    :type reference_iteration: str, optional
+    :param events: Name of event or list of events. To get all events for
+        the iteration, pass None, defaults to None
+    :type events: Union[str, List[str]]
+    :param num_processes: The number of processes used in multiprocessing
+    :type num_processes: int
+    :param min_sn_ratio: Minimum signal to noise ratio of the validation
+        misfit, defaults to 0.1
+    :type min_sn_ratio: float
+    :param timing: Time the stages of the calculation and write a summary
+        to the logs, defaults to False
+    :type timing: bool, optional
+    :return: Dictionary with the windowed ``misfit`` and the
+        ``validation_misfit`` of every event
+    """
+    comm = find_project_comm(lasif_root)
+
+    # some basic checks
+    if not comm.windows.has_window_set(window_set):
+        raise LASIFNotFoundError("Window set {} not known to LASIF".format(window_set))
+
+    if not comm.iterations.has_iteration(iteration):
+        raise LASIFNotFoundError("Iteration {} not known to LASIF".format(iteration))
+
+    if events is None:
+        events = comm.events.list(iteration=iteration)
+    if isinstance(events, str):
+        events = [events]
+
+    known_events = []
+    for event in events:
+        if not comm.events.has_event(event):
+            print(
+                f"Event {event} not known to LASIF. No misfits or adjoint "
+                f"sources for this event will be calculated. "
+            )
+            continue
+        known_events.append(event)
+
+        # remove adjoint sources if they already exist
+        comm.adj_sources.remove_adjoint_sources(event=event, iteration=iteration)
+
+    if not known_events:
+        return {}
+
+    command = "calculate_validation_and_adjoint_sources"
+    with _stage_timing(comm, timing, command):
+        return comm.adj_sources.calculate_validation_and_adjoint_sources(
+            known_events,
+            iteration,
+            window_set,
+            num_processes,
+            weight_set_name=weight_set,
+            reference_iteration=reference_iteration,
+            min_sn_ratio=min_sn_ratio,
+        )
 
 
 def plot_stf(lasif_root):
@@ -712,6 +950,7 @@ def select_windows_multiprocessing(
     window_set: str,
     events: Union[str, List[str]] = None,
     num_processes: int = 16,
+    timing: bool = False,
 ):
     """
     Autoselect windows for a given iteration and event combination
@@ -728,6 +967,9 @@ def select_windows_multiprocessing(
     :type events: Union[str, List[str]], optional
     :param num_processes: The number of processes used in multiprocessing
     :type num_processes: int
+    :param timing: Time the stages of the window selection and write a summary
+        to the logs, defaults to False
+    :type timing: bool, optional
     """
 
     comm = find_project_comm(lasif_root)
@@ -737,11 +979,12 @@ def select_windows_multiprocessing(
     if isinstance(events, str):
         events = [events]
 
-    for event in events:
-        print(f"Selecting windows for event: {event}")
-        comm.windows.select_windows_multiprocessing(
-            event, iteration, window_set, num_processes
-        )
+    with _stage_timing(comm, timing, "select_windows"):
+        for event in events:
+            print(f"Selecting windows for event: {event}")
+            comm.windows.select_windows_multiprocessing(
+                event, iteration, window_set, num_processes
+            )
 
 
 def open_gui(lasif_root):
@@ -858,6 +1101,7 @@ def calculate_validation_data_misfit(
     events: Union[str, List[str]] = None,
     num_processes: int = 12,
     min_sn_ratio: float = 0.1,
+    timing: bool = False,
 ):
     """
     Calculates L2 full trace misfits for either a full iteration or
@@ -880,6 +1124,9 @@ def calculate_validation_data_misfit(
     :type num_processes: int
     :param min_sn_ratio: Minimum signal to noise ratio
     :type min_sn_ratio: float
+    :param timing: Time the stages of the calculation and write a summary
+        to the logs, defaults to False
+    :type timing: bool, optional
     """
     comm = find_project_comm(lasif_root)
 
@@ -892,16 +1139,19 @@ def calculate_validation_data_misfit(
         events = [events]
 
     misfit_dict = {}
-    for event in events:
-        print(f"Computing L2 validation misfit for event {event}.")
-        event_misfit = comm.adj_sources.calculate_validation_misfits_multiprocessing(
-            event=event,
-            iteration=iteration,
-            reference_iteration=reference_iteration,
-            min_sn_ratio=min_sn_ratio,
-            num_processes=num_processes,
-        )
-        misfit_dict[event] = event_misfit
+    with _stage_timing(comm, timing, "calculate_validation_data_misfit"):
+        for event in events:
+            print(f"Computing L2 validation misfit for event {event}.")
+            event_misfit = (
+                comm.adj_sources.calculate_validation_misfits_multiprocessing(
+                    event=event,
+                    iteration=iteration,
+                    reference_iteration=reference_iteration,
+                    min_sn_ratio=min_sn_ratio,
+                    num_processes=num_processes,
+                )
+            )
+            misfit_dict[event] = event_misfit
 
     return misfit_dict
 
@@ -1016,6 +1266,29 @@ def write_misfit(
     return total_misfit
 
 
+def export_misfits(lasif_root, iteration: str, filename: str = None):
+    """
+    Export the event and station misfits of an iteration to a TOML file,
+    using the layout of the misfits.toml files of earlier LASIF versions.
+
+    :param lasif_root: path to lasif root directory
+    :type lasif_root: Union[str, pathlib.Path, object]
+    :param iteration: name of iteration
+    :type iteration: str
+    :param filename: Output file, defaults to misfits_export.toml in the
+        iteration folder
+    :type filename: str, optional
+    """
+    comm = find_project_comm(lasif_root)
+
+    if not comm.iterations.has_iteration(iteration):
+        raise LASIFNotFoundError(f"Iteration {iteration} not known to LASIF")
+
+    filename = comm.adj_sources.export_misfits(iteration, filename)
+    print(f"Misfits of iteration {iteration} written to {filename}")
+    return filename
+
+
 def list_iterations(lasif_root, output: bool = True, verbose: bool = True):
     """
     List iterations in project
@@ -1101,20 +1374,17 @@ def compare_misfits(
     from_it_misfit = 0.0
     to_it_misfit = 0.0
     for event in events:
-        from_it_misfit += float(
+        # Look up every misfit once and reuse it for the event output.
+        from_it_misfit_event = float(
             comm.adj_sources.get_misfit_for_event(event, from_it, weight_set)
         )
-        to_it_misfit += float(
+        to_it_misfit_event = float(
             comm.adj_sources.get_misfit_for_event(event, to_it, weight_set)
         )
+        from_it_misfit += from_it_misfit_event
+        to_it_misfit += to_it_misfit_event
         if print_events:
             # Print information about every event.
-            from_it_misfit_event = float(
-                comm.adj_sources.get_misfit_for_event(event, from_it, weight_set)
-            )
-            to_it_misfit_event = float(
-                comm.adj_sources.get_misfit_for_event(event, to_it, weight_set)
-            )
             print(
                 f"{event}: \n"
                 f"\t iteration {from_it} has misfit: "
@@ -1360,7 +1630,9 @@ def get_simulation_mesh(lasif_root, event: str, iteration: str) -> str:
         comm, output=True
     ), f"Iteration {iteration} not in project"
 
-    events_in_iteration = toml.load(os.path.join(iteration_path, "events_used.toml"))
+    events_in_iteration = comm.project.load_toml(
+        os.path.join(iteration_path, "events_used.toml")
+    )
     assert (
         event in events_in_iteration["events"]["events_used"]
     ), f"Event {event} not in iteration: {iteration}"
@@ -5,11 +5,25 @@ from __future__ import absolute_import
 import pyasdf
 import os
 import numpy as np
-import toml
 
 from lasif.exceptions import LASIFNotFoundError, LASIFError
 from .component import Component
-from lasif.tools.adjoint.adjoint_source import calculate_adjoint_source
+from lasif.tools.adjoint.adjoint_source import (
+    calculate_adjoint_source,
+    calculate_adjoint_source_array,
+    calculate_adjoint_source_batch,
+)
+from lasif.tools.adjoint_source_writer import (
+    AdjointSourceWriter,
+    BackPressure,
+    mark_ledger_complete,
+    read_ledger,
+)
+from lasif.tools.asdf_handle_pool import (
+    init_worker_datasets,
+    get_worker_dataset,
+)
+from lasif.tools.stage_timing import add_bytes_read, collect, stage, timed
 from lasif.utils import select_component_from_stream
 
 TAUPY_MODEL_CACHE = {}
@@ -49,24 +63,107 @@ class AdjointSourcesComponent(Component):
 
         return os.path.join(folder, "adjoint_source_auxiliary.h5")
 
-    def get_misfit_file(self, iteration: str):
+    def get_input_hashes_filename(self, event: str, iteration: str):
         """
-        Get path to the iteration misfit file
+        Gets the filename of the hashes of the station inputs used by
+        incremental adjoint source calculations. It is next to the adjoint
+        sources.
+
+        :param event: The event.
+        :type event: str
+        :param iteration: The iteration name.
+        :type iteration: str
+        """
+        return os.path.join(
+            os.path.dirname(self.get_filename(event, iteration)),
+            "adjoint_source_inputs.json",
+        )
+
+    def get_ledger_filename(self, event: str, iteration: str):
+        """
+        Gets the filename of the ledger of the stations whose adjoint
+        sources have been written, see
+        :mod:`lasif.tools.adjoint_source_writer`. It is next to the adjoint
+        sources.
+
+        :param event: The event.
+        :type event: str
+        :param iteration: The iteration name.
+        :type iteration: str
+        """
+        return os.path.join(
+            os.path.dirname(self.get_filename(event, iteration)),
+            "adjoint_source_ledger.jsonl",
+        )
+
+    def remove_adjoint_sources(self, event: str, iteration: str):
+        """
+        Removes the adjoint sources of an event together with the hashes
+        of the station inputs and the ledger, so that all adjoint sources
+        are calculated again.
+
+        :param event: The event.
+        :type event: str
+        :param iteration: The iteration name.
+        :type iteration: str
+        """
+        for filename in [
+            self.get_filename(event, iteration),
+            self.get_input_hashes_filename(event, iteration),
+            self.get_ledger_filename(event, iteration),
+        ]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def get_misfit_store(self, iteration: str):
+        """
+        Get the misfit store of an iteration. The misfits of an existing
+        misfits.toml file are migrated to the store when it is created.
 
         :param iteration: Name of iteration
         :type iteration: str
         """
+        from lasif.misfit_store_sql import MisfitStore
+
         iteration_name = self.comm.iterations.get_long_iteration_name(
             iteration
         )
-        file = (
-            self.comm.project.paths["iterations"]
-            / iteration_name
-            / "misfits.toml"
-        )
-        if not os.path.exists(file):
-            raise LASIFNotFoundError(f"File {file} does not exist")
-        return file
+        folder = self.comm.project.paths["iterations"] / iteration_name
+        store = MisfitStore(folder / "misfits.sqlite")
+        if not os.path.exists(store.filename):
+            toml_file = folder / "misfits.toml"
+            if os.path.exists(toml_file):
+                events = store.import_toml(toml_file)
+                if events:
+                    print(
+                        f"Migrated the misfits of {len(events)} events from "
+                        f"{toml_file} to {store.filename}."
+                    )
+        return store
+
+    def export_misfits(self, iteration: str, filename: str = None):
+        """
+        Export the misfits of an iteration to a TOML file with the layout
+        of the misfits.toml files of earlier LASIF versions.
+
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param filename: Output file, defaults to misfits_export.toml in the
+            iteration folder
+        :type filename: str, optional
+        """
+        store = self.get_misfit_store(iteration)
+        if filename is None:
+            iteration_name = self.comm.iterations.get_long_iteration_name(
+                iteration
+            )
+            filename = (
+                self.comm.project.paths["iterations"]
+                / iteration_name
+                / "misfits_export.toml"
+            )
+        store.export_toml(filename)
+        return filename
 
     def get_misfit_for_event(
         self,
@@ -88,18 +185,16 @@ class AdjointSourcesComponent(Component):
             should be written down or not, defaults to False
         :type include_station_misfit: bool, optional
         """
-        misfit_file = self.get_misfit_file(iteration)
-        misfits = toml.load(misfit_file)
-        if event not in misfits.keys():
+        store = self.get_misfit_store(iteration)
+        try:
+            return store.get_event(
+                event, include_station_misfit=include_station_misfit
+            )
+        except LASIFNotFoundError:
             raise LASIFError(
                 f"Misfit has not been computed for event {event}, "
                 f"iteration: {iteration}. "
             )
-        event_misfit = misfits[event]["event_misfit"]
-        if include_station_misfit:
-            return misfits[event]
-        else:
-            return event_misfit
 
     def calculate_validation_misfits(self,
                                      event: str,
@@ -258,8 +353,6 @@ class AdjointSourcesComponent(Component):
         :type min_sn_ratio: float
 
         """
-        from scipy.integrate import simps
-        from lasif.utils import select_component_from_stream
         from tqdm import tqdm
         import multiprocessing
         import warnings
@@ -273,168 +366,163 @@ class AdjointSourcesComponent(Component):
             data_type="processed",
             tag_or_iteration=self.comm.waveforms.preprocessing_tag,
         )
-        synthetic_filename = self.comm.waveforms.get_asdf_filename(
-            event_name=event["event_name"],
-            data_type="synthetic",
-            tag_or_iteration=iteration,
-        )
+        # Generate task list
+        with pyasdf.ASDFDataSet(processed_filename, mode="r", mpi=False) as ds:
+            task_list = ds.waveforms.list()
 
+        # The synthetics are read from the cache of processed synthetics.
+        synthetics = self.comm.waveforms.build_processed_synthetics_cache(
+            event["event_name"], iteration, num_processes, stations=task_list
+        )
         if reference_iteration:
-            ref_synthetic_filename = self.comm.waveforms.get_asdf_filename(
-                event_name=event["event_name"],
-                data_type="synthetic",
-                tag_or_iteration=reference_iteration,
+            ref_synthetics = (
+                self.comm.waveforms.build_processed_synthetics_cache(
+                    event["event_name"],
+                    reference_iteration,
+                    num_processes,
+                    stations=task_list,
+                )
             )
+        else:
+            ref_synthetics = None
 
         def _process(station):
-            ds = pyasdf.ASDFDataSet(processed_filename, mode="r", mpi=False)
-            ds_synth = pyasdf.ASDFDataSet(synthetic_filename, mode="r",
-                                          mpi=False)
-
-            observed_station = ds.waveforms[station]
-            synthetic_station = ds_synth.waveforms[station]
+            streams = self._read_station_streams(
+                event["event_name"], station, iteration, reference_iteration
+            )
+            if streams is None:
+                return {station: {}}
+            misfits = self._validation_misfits_from_streams(
+                *streams, min_sn_ratio=min_sn_ratio
+            )
+            return {station: misfits}
 
-            # print(observed_station, synthetic_station)
-            obs_tag = observed_station.get_waveform_tags()
-            syn_tag = synthetic_station.get_waveform_tags()
+        # Use at most num_processes
+        number_processes = min(num_processes, multiprocessing.cpu_count())
 
-            misfits = {}
-            if reference_iteration:
-                ds_synth_ref = pyasdf.ASDFDataSet(ref_synthetic_filename, mode="r",
-                                   mpi=False)
-                ref_synthetic_station = ds_synth_ref.waveforms[station]
-                ref_syn_tag = ref_synthetic_station.get_waveform_tags()
-                try:
-                    assert len(syn_tag) == 1, (
-                            "Station: %s - Requires 1 synthetic waveform tag. Has %i."
-                            % (observed_station._station_name, len(syn_tag))
-                    )
-                except AssertionError:
-                    return {station: misfits}
-                ref_syn_tag = ref_syn_tag[0]
-                st_ref_syn = ref_synthetic_station[ref_syn_tag]
-                st_ref_syn = self.comm.waveforms.process_synthetics(
-                    st=st_ref_syn.copy(),
-                    event_name=event["event_name"],
-                    iteration=reference_iteration,
-                )
+        # Every worker opens the files once and reuses them for all stations.
+        filenames = {
+            f"processed/{event['event_name']}": processed_filename,
+            f"synthetic/{event['event_name']}": synthetics,
+            f"reference_synthetic/{event['event_name']}": ref_synthetics,
+        }
+        with multiprocessing.Pool(
+            number_processes,
+            initializer=init_worker_datasets,
+            initargs=(filenames,),
+        ) as pool:
+            results = {}
+            with tqdm(total=len(task_list)) as pbar:
+                for i, r in enumerate(
+                    collect(pool.imap_unordered(timed(_process), task_list))
+                ):
+                    pbar.update()
+                    k, v = r.popitem()
+                    results[k] = v
 
-            try:
-                # Make sure both have length 1.
-                assert len(obs_tag) == 1, (
-                        "Station: %s - Requires 1 observed waveform tag. Has %i."
-                        % (observed_station._station_name, len(obs_tag))
-                )
-                assert len(syn_tag) == 1, (
-                        "Station: %s - Requires 1 synthetic waveform tag. Has %i."
-                        % (observed_station._station_name, len(syn_tag))
-                )
-            except AssertionError:
-                return {station: misfits}
+            pool.close()
+            pool.join()
 
-            obs_tag = obs_tag[0]
-            syn_tag = syn_tag[0]
+        misfit = 0.0
+        for station in results.keys():
+            for trace in results[station].keys():
+                misfit += results[station][trace]["misfit"]
 
-            # Finally get the data.
-            st_obs = observed_station[obs_tag]
-            st_syn = synthetic_station[syn_tag]
+        print("\nTotal event misfit: ", misfit)
+        return misfit
 
-            # Process the synthetics. This makes sure the starttime is the same
-            st_syn = self.comm.waveforms.process_synthetics(
-                st=st_syn.copy(),
-                event_name=event["event_name"],
-                iteration=iteration,
-            )
+    def _validation_misfits_from_streams(
+        self, st_obs, st_syn, st_ref_syn=None, min_sn_ratio: float = 0.1
+    ):
+        """
+        Compute the L2 validation misfits of all components of a station
+        from its observed and processed synthetic streams, see
+        :meth:`calculate_validation_misfits_multiprocessing`. The traces of
+        the streams are modified.
+
+        Returns a dictionary with the misfit of every channel.
+
+        :param st_obs: Observed data of the station
+        :type st_obs: :class:`obspy.core.stream.Stream`
+        :param st_syn: Processed synthetics of the station
+        :type st_syn: :class:`obspy.core.stream.Stream`
+        :param st_ref_syn: Processed synthetics of the reference iteration,
+            used to estimate the first arrival, defaults to None
+        :type st_ref_syn: :class:`obspy.core.stream.Stream`, optional
+        :param min_sn_ratio: Minimum signal to noise ratio
+        :type min_sn_ratio: float
+        """
+        from scipy.integrate import simps
 
-            for component in ["E", "N", "Z"]:
-                try:
-                    data_tr = select_component_from_stream(st_obs, component)
-                    synth_tr = select_component_from_stream(st_syn, component)
-                    synth_tr.interpolate(sampling_rate=data_tr.stats.sampling_rate,
-                                         method="linear")
+        misfits = {}
+        for component in ["E", "N", "Z"]:
+            try:
+                data_tr = select_component_from_stream(st_obs, component)
+                synth_tr = select_component_from_stream(st_syn, component)
+                with stage("interpolate"):
+                    synth_tr.interpolate(
+                        sampling_rate=data_tr.stats.sampling_rate,
+                        method="linear",
+                    )
                     data_tr.trim(endtime=synth_tr.stats.endtime)
                     synth_tr.trim(endtime=data_tr.stats.endtime)
 
-                    if np.isnan(data_tr.data).any():
-                        continue
+                if np.isnan(data_tr.data).any():
+                    continue
 
-                    if reference_iteration:
-                        ref_synth_tr = select_component_from_stream(st_ref_syn,
-                                                                component)
-                        ref_synth_tr.interpolate(sampling_rate=data_tr.stats.sampling_rate,
-                                                 method="linear")
+                if st_ref_syn is not None:
+                    ref_synth_tr = select_component_from_stream(st_ref_syn,
+                                                            component)
+                    with stage("interpolate"):
+                        ref_synth_tr.interpolate(
+                            sampling_rate=data_tr.stats.sampling_rate,
+                            method="linear",
+                        )
                         ref_synth_tr.trim(endtime=data_tr.stats.endtime)
-                except LASIFNotFoundError:
-                    continue
+            except LASIFNotFoundError:
+                continue
 
-                # Skip to skip case, where this explodes
-                if data_tr.data.ptp() == 0 or synth_tr.data.ptp() == 0:
-                    continue
+            # Skip to skip case, where this explodes
+            if data_tr.data.ptp() == 0 or synth_tr.data.ptp() == 0:
+                continue
 
-                # Normalize amplitudes to avoid strong influences by amplitudes
-                # due to source or propagation distance.
-                data_tr.data /= data_tr.data.ptp()
-                synth_tr.data /= synth_tr.data.ptp()
+            # Normalize amplitudes to avoid strong influences by amplitudes
+            # due to source or propagation distance.
+            data_tr.data /= data_tr.data.ptp()
+            synth_tr.data /= synth_tr.data.ptp()
 
-                if reference_iteration:
-                    first_tt_arrival = np.argmax(np.abs(ref_synth_tr.data) >
-                                            5e-3 * np.max(np.abs(ref_synth_tr.data)))
-                else:
-                    first_tt_arrival = np.argmax(np.abs(synth_tr.data) >
-                                                5e-3 * np.max(np.abs(synth_tr.data)))
-                idx_end = int(0.8 * first_tt_arrival)
-                idx_end = max(idx_end, 1)  # ensure at least 1 sample is available
-                idx_start = 0
+            if st_ref_syn is not None:
+                first_tt_arrival = np.argmax(np.abs(ref_synth_tr.data) >
+                                        5e-3 * np.max(np.abs(ref_synth_tr.data)))
+            else:
+                first_tt_arrival = np.argmax(np.abs(synth_tr.data) >
+                                            5e-3 * np.max(np.abs(synth_tr.data)))
+            idx_end = int(0.8 * first_tt_arrival)
+            idx_end = max(idx_end, 1)  # ensure at least 1 sample is available
+            idx_start = 0
 
-                if idx_start >= idx_end:
-                    idx_start = max(0, idx_end - 10)
+            if idx_start >= idx_end:
+                idx_start = max(0, idx_end - 10)
 
-                abs_data = np.abs(data_tr.data)
+            abs_data = np.abs(data_tr.data)
 
-                # Return empty window when no data is available
-                if np.max(abs_data) == 0.0 or np.max(np.abs(synth_tr.data)) == 0.0:
-                    continue
+            # Return empty window when no data is available
+            if np.max(abs_data) == 0.0 or np.max(np.abs(synth_tr.data)) == 0.0:
+                continue
 
-                noise_absolute = abs_data[idx_start:idx_end].max()
-                noise_relative = noise_absolute / abs_data.max()
+            noise_absolute = abs_data[idx_start:idx_end].max()
+            noise_relative = noise_absolute / abs_data.max()
 
-                if noise_relative > min_sn_ratio:
-                    continue
+            if noise_relative > min_sn_ratio:
+                continue
 
+            with stage("validation_misfit"):
                 diff = data_tr.data - synth_tr.data
                 misfit = 0.5 * simps(y=diff ** 2, dx=data_tr.stats.delta)
-                misfits[data_tr.id] = {
-                    "misfit": misfit,
-                }
-
-            misfit_dict = {station: misfits}
-            return misfit_dict
-
-        ds = pyasdf.ASDFDataSet(processed_filename, mode="r", mpi=False)
-
-        # Generate task list
-        task_list = ds.waveforms.list()
-
-        # Use at most num_processes
-        number_processes = min(num_processes, multiprocessing.cpu_count())
-
-        with multiprocessing.Pool(number_processes) as pool:
-            results = {}
-            with tqdm(total=len(task_list)) as pbar:
-                for i, r in enumerate(pool.imap_unordered(_process, task_list)):
-                    pbar.update()
-                    k, v = r.popitem()
-                    results[k] = v
-
-            pool.close()
-
-        misfit = 0.0
-        for station in results.keys():
-            for trace in results[station].keys():
-                misfit += results[station][trace]["misfit"]
-
-        print("\nTotal event misfit: ", misfit)
-        return misfit
+            misfits[data_tr.id] = {
+                "misfit": misfit,
+            }
+        return misfits
 
     def calculate_adjoint_sources_multiprocessing(
             self,
@@ -449,7 +537,7 @@ class AdjointSourcesComponent(Component):
         Calculate adjoint sources based on the type of misfit defined in
         the lasif config file.
         The computed misfit for each station is also written down into
-        a misfit toml file.
+        the misfit store of the iteration.
         This function uses multiprocessing for parallelization
 
         :param event: Name of event
@@ -463,7 +551,6 @@ class AdjointSourcesComponent(Component):
         :param plot: Should the adjoint source be plotted?, defaults to False
         :type plot: bool, optional
         """
-        from lasif.utils import select_component_from_stream
         from tqdm import tqdm
         import multiprocessing
         import warnings
@@ -474,239 +561,1085 @@ class AdjointSourcesComponent(Component):
         # can be found that does not utilize a function within a function.
         global _process
         event = self.comm.events.get(event)
-
-        # Get the ASDF filenames.
-        processed_filename = self.comm.waveforms.get_asdf_filename(
-            event_name=event["event_name"],
-            data_type="processed",
-            tag_or_iteration=self.comm.waveforms.preprocessing_tag,
-        )
-        synthetic_filename = self.comm.waveforms.get_asdf_filename(
-            event_name=event["event_name"],
-            data_type="synthetic",
-            tag_or_iteration=iteration,
-        )
-
-        if not os.path.exists(processed_filename):
-            msg = "File '%s' does not exists." % processed_filename
-            raise LASIFNotFoundError(msg)
-
-        if not os.path.exists(synthetic_filename):
-            msg = "File '%s' does not exists." % synthetic_filename
-            raise LASIFNotFoundError(msg)
-
-        all_windows = self.comm.windows.read_all_windows(
-            event=event["event_name"], window_set_name=window_set_name
+        context = self._get_adjoint_source_context(
+            event["event_name"],
+            iteration,
+            window_set_name,
+            num_processes=num_processes,
         )
 
-        if len(all_windows.keys()) == 0:
-            raise Exception(f"No windows where found for event "
-                            f"{event['event_name']} in window set "
-                            f"{window_set_name}.")
-
-        process_params = self.comm.project.simulation_settings
-
         def _process(station):
-            ds = pyasdf.ASDFDataSet(processed_filename, mode="r", mpi=False)
-            ds_synth = pyasdf.ASDFDataSet(synthetic_filename, mode="r",
-                                          mpi=False)
-            observed_station = ds.waveforms[station]
-            synthetic_station = ds_synth.waveforms[station]
-
-            # print(observed_station, synthetic_station)
-            obs_tag = observed_station.get_waveform_tags()
-            syn_tag = synthetic_station.get_waveform_tags()
-
-            adjoint_sources = {}
-            try:
-                # Make sure both have length 1.
-                assert len(obs_tag) == 1, (
-                        "Station: %s - Requires 1 observed waveform tag. Has %i."
-                        % (observed_station._station_name, len(obs_tag))
-                )
-                assert len(syn_tag) == 1, (
-                        "Station: %s - Requires 1 synthetic waveform tag. Has %i."
-                        % (observed_station._station_name, len(syn_tag))
-                )
-            except AssertionError:
-                return {station: adjoint_sources}
-
-            obs_tag = obs_tag[0]
-            syn_tag = syn_tag[0]
-
-            # Finally get the data.
-            st_obs = observed_station[obs_tag]
-            st_syn = synthetic_station[syn_tag]
-
-            # Process the synthetics.
-            st_syn = self.comm.waveforms.process_synthetics(
-                st=st_syn.copy(),
-                event_name=event["event_name"],
-                iteration=iteration,
+            return self._calculate_station_adjoint_sources(
+                context, station, iteration, window_set_name, plot
             )
 
-            ad_src_type = self.comm.project.optimization_settings[
-                "misfit_type"
-            ]
-            if ad_src_type == "weighted_waveform_misfit":
-                env_scaling = True
-                ad_src_type = "waveform_misfit"
-            else:
-                env_scaling = False
-
-            for component in ["E", "N", "Z"]:
-                try:
-                    data_tr = select_component_from_stream(st_obs, component)
-                    synth_tr = select_component_from_stream(st_syn, component)
-                    synth_tr.interpolate(sampling_rate=data_tr.stats.sampling_rate)
-                    synth_tr.trim(endtime=data_tr.stats.endtime)
-                    data_tr.trim(endtime=synth_tr.stats.endtime)
-                except LASIFNotFoundError:
-                    continue
-
-                if self.comm.project.simulation_settings[
-                        "scale_data_to_synthetics"]:
-                    if (not self.comm.project.optimization_settings[
-                                "misfit_type"] == "envelope_misfit"):
-                        scaling_factor = (
-                                synth_tr.data.ptp() / data_tr.data.ptp()
-                        )
-                        # Store and apply the scaling.
-                        data_tr.stats.scaling_factor = scaling_factor
-                        data_tr.data *= scaling_factor
-
-                net, sta, cha = data_tr.id.split(".", 2)
-                station = net + "." + sta
-
-                if station not in all_windows:
-                    continue
-                if data_tr.id not in all_windows[station]:
-                    continue
-                # Collect all.
-                windows = all_windows[station][data_tr.id]
-                try:
-                    # for window in windows:
-                    asrc = calculate_adjoint_source(
-                        observed=data_tr,
-                        synthetic=synth_tr,
-                        window=windows,
-                        min_period=process_params["minimum_period_in_s"],
-                        max_period=process_params["maximum_period_in_s"],
-                        adj_src_type=ad_src_type,
-                        window_set=window_set_name,
-                        taper_ratio=0.15,
-                        taper_type="cosine",
-                        plot=plot,
-                        envelope_scaling=env_scaling,
-                    )
-                except:
-                    # Either pass or fail for the whole component.
-                    continue
-
-                if not asrc:
-                    continue
-                # Sum up both misfit, and adjoint source.
-                misfit = asrc.misfit
-                adj_source = asrc.adjoint_source.data
-
-                adjoint_sources[data_tr.id] = {
-                    "misfit": misfit,
-                    "adj_source": adj_source,
-                }
-            adj_dict = {station: adjoint_sources}
-            return adj_dict
-
-        ds = pyasdf.ASDFDataSet(processed_filename, mode="r", mpi=False)
-
         # Generate task list
-        task_list = ds.waveforms.list()
+        task_list = context["stations"]
 
         # Use at most num_processes
         number_processes = min(num_processes, multiprocessing.cpu_count())
 
-        with multiprocessing.Pool(number_processes) as pool:
-            results = {}
-            with tqdm(total=len(task_list)) as pbar:
-                for i, r in enumerate(pool.imap_unordered(_process, task_list)):
-                    pbar.update()
-                    k, v = r.popitem()
-                    results[k] = v
-
-            pool.close()
-            pool.join()
-
-        # Write adjoint sources
-        filename = self.get_filename(
-            event=event["event_name"], iteration=iteration
+        # The results are written while the workers carry on. At most a few
+        # results per worker wait to be written.
+        writer = self._open_adjoint_source_writer(
+            event["event_name"], iteration
         )
-        long_iter_name = self.comm.iterations.get_long_iteration_name(
-            iteration
+        feed = BackPressure(task_list, max_pending=4 * number_processes)
+
+        # Every worker opens the files once and reuses them for all stations.
+        with writer:
+            with multiprocessing.Pool(
+                number_processes,
+                initializer=init_worker_datasets,
+                initargs=(context["filenames"],),
+            ) as pool, feed:
+                with tqdm(total=len(task_list)) as pbar:
+                    for r in collect(
+                        pool.imap_unordered(timed(_process), feed)
+                    ):
+                        pbar.update()
+                        writer.add(*r.popitem())
+                        feed.done()
+
+                pool.close()
+                pool.join()
+
+        self._close_adjoint_source_writer(
+            event["event_name"], iteration, writer
         )
-        misfit_toml = self.comm.project.paths["iterations"]
-        toml_filename = misfit_toml / long_iter_name / "misfits.toml"
-
-        ad_src_counter = 0
-        if os.path.exists(toml_filename):
-            iteration_misfits = toml.load(toml_filename)
-            if event["event_name"] in iteration_misfits.keys():
-                iteration_misfits[event["event_name"]][
-                    "event_misfit"
-                ] = 0.0
-            with open(toml_filename, "w") as fh:
-                toml.dump(iteration_misfits, fh)
 
-        print("Writing adjoint sources...")
-        with pyasdf.ASDFDataSet(filename=filename, mpi=False, mode="a") as bs:
-            if toml_filename.exists():
-                iteration_misfits = toml.load(toml_filename)
-                if event["event_name"] in iteration_misfits.keys():
-                    total_misfit = iteration_misfits[
-                        event["event_name"]
-                    ]["event_misfit"]
-                else:
-                    iteration_misfits[event["event_name"]] = {}
-                    iteration_misfits[event["event_name"]][
-                        "stations"
-                    ] = {}
-                    total_misfit = 0.0
-            else:
-                iteration_misfits = {}
-                iteration_misfits[event["event_name"]] = {}
-                iteration_misfits[event["event_name"]]["stations"] = {}
-                total_misfit = 0.0
-            for value in results.values():
-                if not value:
-                    continue
-                station_misfit = 0.0
-                for c_id, adj_source in value.items():
-                    net, sta, loc, cha = c_id.split(".")
-
-                    bs.add_auxiliary_data(
-                        data=adj_source["adj_source"],
-                        data_type="AdjointSources",
-                        path="%s_%s/Channel_%s_%s"
-                             % (net, sta, loc, cha),
-                        parameters={"misfit": adj_source["misfit"]},
-                    )
-                    station_misfit += adj_source["misfit"]
-                    station_name = f"{net}.{sta}"
-                iteration_misfits[event["event_name"]]["stations"][
-                    station_name
-                ] = float(station_misfit)
-                ad_src_counter += 1
-                total_misfit += station_misfit
-            iteration_misfits[event["event_name"]][
-                "event_misfit"
-            ] = float(total_misfit)
-            with open(toml_filename, "w") as fh:
-                toml.dump(iteration_misfits, fh)
-
-        with pyasdf.ASDFDataSet(
-                filename=filename, mpi=False, mode="a"
-        ) as ds:
-            length = len(ds.auxiliary_data.AdjointSources.list())
+    def calculate_adjoint_sources_for_events(
+        self,
+        events: list,
+        iteration: str,
+        window_set_name: str,
+        num_processes: int,
+        weight_set_name: str = None,
+        finalize: bool = True,
+        adjoint_src: bool = True,
+        stations: list = None,
+        incremental: bool = False,
+        resume: bool = False,
+    ):
+        """
+        Calculate the adjoint sources of multiple events with a single
+        pool of workers.
+
+        The stations of all events are fed to the pool as one queue of
+        (event, station) tasks, so the workers neither wait for the slowest
+        station of an event nor idle on events with few stations. An event
+        is written, and finalized if requested, as soon as its last station
+        is done while the workers carry on with the other events.
+
+        :param events: Names of the events
+        :type events: list
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param window_set_name: Name of window set
+        :type window_set_name: str
+        :param num_processes: The number of processes used in multiprocessing
+        :type num_processes: int
+        :param weight_set_name: Name of station weights used when
+            finalizing, defaults to None
+        :type weight_set_name: str, optional
+        :param finalize: Finalize the adjoint sources of every event with
+            :meth:`finalize_adjoint_sources`, defaults to True
+        :type finalize: bool, optional
+        :param adjoint_src: Calculate the adjoint sources. If False only
+            the misfits are calculated and written to the misfit store, with
+            the station weights applied. No adjoint source files are
+            written, defaults to True
+        :type adjoint_src: bool, optional
+        :param stations: Only use these stations, e.g. ``["NET.STA"]``,
+            defaults to all stations with windows
+        :type stations: list, optional
+        :param incremental: Only recompute the stations whose processed
+            data, synthetics, windows or misfit configuration changed since
+            the last incremental calculation, and keep the adjoint sources
+            of all others. Requires ``adjoint_src``, defaults to False
+        :type incremental: bool, optional
+        :param resume: Resume an interrupted calculation. Events that have
+            been completed are skipped and the stations recorded in the
+            ledger of an event keep their adjoint sources. Requires
+            ``adjoint_src``, defaults to False
+        :type resume: bool, optional
+        :return: Dictionary with the misfit of every event
+        """
+        event_misfits, _ = self._calculate_for_events(
+            events,
+            iteration,
+            window_set_name,
+            num_processes,
+            weight_set_name=weight_set_name,
+            finalize=finalize,
+            adjoint_src=adjoint_src,
+            stations=stations,
+            incremental=incremental,
+            resume=resume,
+        )
+        return event_misfits
+
+    def calculate_misfits_multiprocessing(
+        self,
+        events: list,
+        iteration: str,
+        window_set_name: str,
+        num_processes: int,
+        weight_set_name: str = None,
+        stations: list = None,
+    ):
+        """
+        Calculate only the misfits of events, e.g. for a line search.
+
+        The misfit functions are called without computing adjoint sources
+        and nothing but the misfits is written. The station misfits are
+        multiplied by the station and event weights, as they would be when
+        finalizing the adjoint sources, and stored in the misfit store.
+        With ``stations`` only the misfits of these stations are replaced,
+        the misfits of the other stations of an event are kept and the
+        event misfit is the sum over all of them.
+
+        :param events: Names of the events
+        :type events: list
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param window_set_name: Name of window set
+        :type window_set_name: str
+        :param num_processes: The number of processes used in multiprocessing
+        :type num_processes: int
+        :param weight_set_name: Name of station weights, defaults to None
+        :type weight_set_name: str, optional
+        :param stations: Only use these stations, e.g. ``["NET.STA"]``,
+            defaults to all stations with windows
+        :type stations: list, optional
+        :return: Dictionary with the misfit of every event
+        """
+        return self.calculate_adjoint_sources_for_events(
+            events,
+            iteration,
+            window_set_name,
+            num_processes,
+            weight_set_name=weight_set_name,
+            adjoint_src=False,
+            stations=stations,
+        )
+
+    def calculate_validation_and_adjoint_sources(
+        self,
+        events: list,
+        iteration: str,
+        window_set_name: str,
+        num_processes: int,
+        weight_set_name: str = None,
+        reference_iteration: str = None,
+        min_sn_ratio: float = 0.1,
+    ):
+        """
+        Calculate the validation misfits and the adjoint sources of events
+        in a single pass over the data.
+
+        Every station is read and its synthetics are processed once. The
+        same data is used for the validation misfit of
+        :meth:`calculate_validation_misfits_multiprocessing` and for the
+        windowed misfit and adjoint sources of
+        :meth:`calculate_adjoint_sources_for_events`. The adjoint sources
+        are written and finalized as usual.
+
+        :param events: Names of the events
+        :type events: list
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param window_set_name: Name of window set
+        :type window_set_name: str
+        :param num_processes: The number of processes used in multiprocessing
+        :type num_processes: int
+        :param weight_set_name: Name of station weights used when
+            finalizing, defaults to None
+        :type weight_set_name: str, optional
+        :param reference_iteration: name of reference iteration. This
+            is used to make sure the same seismograms are selected when
+            comparing iterations, defaults to None
+        :type reference_iteration: str, optional
+        :param min_sn_ratio: Minimum signal to noise ratio of the validation
+            misfit, defaults to 0.1
+        :type min_sn_ratio: float, optional
+        :return: Dictionary with the (windowed) ``misfit`` and the
+            ``validation_misfit`` of every event
+        """
+        event_misfits, validation_misfits = self._calculate_for_events(
+            events,
+            iteration,
+            window_set_name,
+            num_processes,
+            weight_set_name=weight_set_name,
+            validation=True,
+            reference_iteration=reference_iteration,
+            min_sn_ratio=min_sn_ratio,
+        )
+        return {
+            event_name: {
+                "misfit": event_misfits[event_name],
+                "validation_misfit": validation_misfits[event_name],
+            }
+            for event_name in event_misfits
+        }
+
+    def _calculate_for_events(
+        self,
+        events: list,
+        iteration: str,
+        window_set_name: str,
+        num_processes: int,
+        weight_set_name: str = None,
+        finalize: bool = True,
+        adjoint_src: bool = True,
+        stations: list = None,
+        validation: bool = False,
+        reference_iteration: str = None,
+        min_sn_ratio: float = 0.1,
+        incremental: bool = False,
+        resume: bool = False,
+    ):
+        """
+        Work queue behind :meth:`calculate_adjoint_sources_for_events`,
+        :meth:`calculate_misfits_multiprocessing` and
+        :meth:`calculate_validation_and_adjoint_sources`.
+
+        With ``validation``, all stations are read, not only the ones with
+        windows, and the validation misfit is computed from the same data.
+        With ``incremental``, stations with unchanged inputs are not
+        computed again, see :meth:`_find_reusable_stations`. With
+        ``resume``, completed events and the stations in the ledger of an
+        event are not computed again, see
+        :mod:`lasif.tools.adjoint_source_writer`.
+
+        The adjoint sources are written while the workers carry on and the
+        workers are only fed as many tasks as can be written, so the
+        results never pile up in memory.
+
+        Returns a dictionary with the misfit of every event and one with
+        the validation misfit of every event, which is empty without
+        ``validation``.
+        """
+        from tqdm import tqdm
+        import multiprocessing
+        import warnings
+        warnings.filterwarnings("ignore")
+
+        if (incremental or resume) and (validation or not adjoint_src):
+            raise LASIFError(
+                "Incremental calculations and resuming are only possible for "
+                "adjoint sources."
+            )
+
+        # Globally define the processing function. This is required to enable
+        # pickling of a function within a function.
+        global _process_task
+
+        contexts = {}
+        filenames = {}
+        ledgers = {}
+        completed = []
+        for event in events:
+            event_name = self.comm.events.get(event)["event_name"]
+            if resume:
+                ledgers[event_name], complete = self._read_ledger(
+                    event_name, iteration
+                )
+                if complete:
+                    print(
+                        f"Event {event_name} has been completed before, "
+                        f"skipping it."
+                    )
+                    completed.append(event_name)
+                    continue
+            contexts[event_name] = self._get_adjoint_source_context(
+                event_name,
+                iteration,
+                window_set_name,
+                stations,
+                num_processes=num_processes,
+                cache_all_stations=validation,
+            )
+            filenames.update(contexts[event_name]["filenames"])
+            if validation and reference_iteration:
+                filenames[
+                    f"reference_synthetic/{event_name}"
+                ] = self.comm.waveforms.build_processed_synthetics_cache(
+                    event_name,
+                    reference_iteration,
+                    num_processes,
+                    stations=contexts[event_name]["all_stations"],
+                )
+        station_lists = {
+            event_name: context["all_stations" if validation else "stations"]
+            for event_name, context in contexts.items()
+        }
+        reused = {event_name: None for event_name in contexts}
+        for event_name, context in contexts.items():
+            if incremental:
+                reused[event_name] = self._find_reusable_stations(
+                    event_name, iteration, context
+                )
+            if resume:
+                ledger = {
+                    _s: _m
+                    for _s, _m in ledgers[event_name].items()
+                    if _s in context["stations"]
+                }
+                print(
+                    f"Event {event_name}: resuming with {len(ledger)} of "
+                    f"{len(context['stations'])} stations already written."
+                )
+                reused[event_name] = {**(reused[event_name] or {}), **ledger}
+            if reused[event_name] is not None:
+                station_lists[event_name] = [
+                    _s
+                    for _s in station_lists[event_name]
+                    if _s not in reused[event_name]
+                ]
+
+        def _process_task(task):
+            event_name, station = task
+            context = contexts[event_name]
+            if not validation:
+                return (
+                    event_name,
+                    self._calculate_station_adjoint_sources(
+                        context,
+                        station,
+                        iteration,
+                        window_set_name,
+                        adjoint_src=adjoint_src,
+                    ),
+                    None,
+                )
+
+            # Read and process the data once for both misfits.
+            streams = self._read_station_streams(
+                event_name, station, iteration, reference_iteration
+            )
+            if streams is None:
+                return event_name, {station: {}}, {}
+            st_obs, st_syn, st_ref_syn = streams
+            # The validation misfit normalizes and interpolates the traces
+            # differently, so it works on copies.
+            misfits = self._validation_misfits_from_streams(
+                st_obs.copy(), st_syn.copy(), st_ref_syn, min_sn_ratio
+            )
+            if station not in context["windows"]:
+                return event_name, {station: {}}, misfits
+            return (
+                event_name,
+                self._adjoint_sources_from_streams(
+                    context,
+                    station,
+                    st_obs,
+                    st_syn,
+                    window_set_name,
+                    adjoint_src=adjoint_src,
+                ),
+                misfits,
+            )
+
+        event_misfits = {}
+        validation_misfits = {}
+        # Writers of the events with results, created on the first result.
+        writers = {}
+
+        def _get_writer(event_name):
+            if event_name not in writers:
+                writers[event_name] = self._open_adjoint_source_writer(
+                    event_name, iteration, reused[event_name]
+                )
+            return writers[event_name]
+
+        def _event_done(event_name):
+            if validation:
+                print(
+                    f"\nTotal validation misfit of event {event_name}: "
+                    f"{validation_misfits[event_name]}"
+                )
+            if not adjoint_src:
+                event_misfits[event_name] = self._write_misfits(
+                    event_name,
+                    iteration,
+                    results.pop(event_name),
+                    weight_set_name,
+                    stations=stations,
+                )
+                return
+            writer = _get_writer(event_name)
+            self._close_adjoint_source_writer(event_name, iteration, writer)
+            del writers[event_name]
+            if incremental:
+                self._write_input_hashes(
+                    event_name,
+                    iteration,
+                    contexts[event_name],
+                    writer.station_misfits,
+                )
+            if finalize:
+                self.finalize_adjoint_sources(
+                    iteration, event_name, weight_set_name
+                )
+            mark_ledger_complete(writer.ledger_filename)
+            event_misfits[event_name] = self.get_misfit_for_event(
+                event_name, iteration
+            )
+
+        # The tasks are ordered by event, so the workers mostly read from
+        # the files of one or two events at any time.
+        task_list = [
+            (event_name, station)
+            for event_name, event_stations in station_lists.items()
+            for station in event_stations
+        ]
+        remaining = {
+            event_name: len(event_stations)
+            for event_name, event_stations in station_lists.items()
+        }
+        # Only the misfits are kept in memory, the adjoint sources go to the
+        # writers.
+        results = {}
+        if not adjoint_src:
+            results.update({event_name: {} for event_name in contexts})
+        if validation:
+            validation_misfits.update({_e: 0.0 for _e in contexts})
+        for event_name in completed:
+            event_misfits[event_name] = self.get_misfit_for_event(
+                event_name, iteration
+            )
+        for event_name in [_e for _e, _n in remaining.items() if _n == 0]:
+            _event_done(event_name)
+
+        # Use at most num_processes
+        number_processes = min(num_processes, multiprocessing.cpu_count())
+
+        # At most a few results per worker wait to be written.
+        feed = BackPressure(task_list, max_pending=4 * number_processes)
+
+        # Keep the files of a few events open in every worker.
+        try:
+            with multiprocessing.Pool(
+                number_processes,
+                initializer=init_worker_datasets,
+                initargs=(filenames, None, 6 if validation else 4),
+            ) as pool, feed:
+                with tqdm(total=len(task_list)) as pbar:
+                    for event_name, r, misfits in collect(
+                        pool.imap_unordered(timed(_process_task), feed)
+                    ):
+                        pbar.update()
+                        if adjoint_src:
+                            writer = _get_writer(event_name)
+                            for station, value in r.items():
+                                writer.add(station, value)
+                        else:
+                            results[event_name].update(r)
+                        feed.done()
+                        if misfits:
+                            for trace_misfit in misfits.values():
+                                validation_misfits[
+                                    event_name
+                                ] += trace_misfit["misfit"]
+                        remaining[event_name] -= 1
+                        if remaining[event_name] == 0:
+                            _event_done(event_name)
+
+                pool.close()
+                pool.join()
+        finally:
+            # Keep the stations written so far if the run is interrupted,
+            # so it can be resumed.
+            for writer in writers.values():
+                writer.close()
+        return event_misfits, validation_misfits
+
+    def _get_adjoint_source_context(
+        self,
+        event_name: str,
+        iteration: str,
+        window_set_name: str,
+        stations: list = None,
+        num_processes: int = 16,
+        cache_all_stations: bool = False,
+    ):
+        """
+        Collect what the station tasks of an event need: the data files,
+        the windows, the stations to compute adjoint sources for and all
+        stations with data. The synthetics of the stations are processed
+        into their cache first, if they are not yet.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param window_set_name: Name of window set
+        :type window_set_name: str
+        :param stations: Only use these stations, defaults to all stations
+            with windows
+        :type stations: list, optional
+        :param num_processes: The number of processes used to build the
+            cache of processed synthetics, defaults to 16
+        :type num_processes: int, optional
+        :param cache_all_stations: Cache the processed synthetics of all
+            stations with data, not only of the stations with windows,
+            defaults to False
+        :type cache_all_stations: bool, optional
+        """
+        # Get the ASDF filenames.
+        processed_filename = self.comm.waveforms.get_asdf_filename(
+            event_name=event_name,
+            data_type="processed",
+            tag_or_iteration=self.comm.waveforms.preprocessing_tag,
+        )
+        synthetic_filename = self.comm.waveforms.get_asdf_filename(
+            event_name=event_name,
+            data_type="synthetic",
+            tag_or_iteration=iteration,
+        )
+
+        if not os.path.exists(processed_filename):
+            msg = "File '%s' does not exists." % processed_filename
+            raise LASIFNotFoundError(msg)
+
+        if not os.path.exists(synthetic_filename):
+            msg = "File '%s' does not exists." % synthetic_filename
+            raise LASIFNotFoundError(msg)
+
+        all_windows = self.comm.windows.read_all_windows(
+            event=event_name, window_set_name=window_set_name
+        )
+
+        if len(all_windows.keys()) == 0:
+            raise Exception(f"No windows where found for event "
+                            f"{event_name} in window set "
+                            f"{window_set_name}.")
+
+        with pyasdf.ASDFDataSet(processed_filename, mode="r", mpi=False) as ds:
+            all_stations = ds.waveforms.list()
+        if stations is not None:
+            stations = set(stations)
+            all_stations = [_s for _s in all_stations if _s in stations]
+        # Stations without windows do not have adjoint sources.
+        task_list = [_s for _s in all_stations if _s in all_windows]
+
+        return {
+            "event_name": event_name,
+            "filenames": {
+                f"processed/{event_name}": processed_filename,
+                f"synthetic/{event_name}": (
+                    self.comm.waveforms.build_processed_synthetics_cache(
+                        event_name,
+                        iteration,
+                        num_processes,
+                        stations=(
+                            all_stations if cache_all_stations else task_list
+                        ),
+                    )
+                ),
+            },
+            "windows": all_windows,
+            "stations": task_list,
+            "all_stations": all_stations,
+        }
+
+    def _find_reusable_stations(
+        self, event_name: str, iteration: str, context: dict
+    ):
+        """
+        Hash the inputs of the stations of an event and compare them to the
+        hashes stored by the last incremental calculation. The new hashes
+        are added to the context as ``input_hashes``.
+
+        Returns a dictionary with the unweighted misfit of every station
+        whose inputs did not change. Their adjoint sources are still in the
+        auxiliary file and do not need to be computed again.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param context: Event information from
+            :meth:`_get_adjoint_source_context`
+        :type context: dict
+        """
+        from lasif.tools.input_hashes import (
+            compute_station_hashes,
+            read_station_hashes,
+        )
+
+        process_params = self.comm.project.simulation_settings
+        optimization_settings = self.comm.project.optimization_settings
+        config = {
+            "misfit_type": optimization_settings["misfit_type"],
+            "adjoint_source_parameters": optimization_settings.get(
+                "adjoint_source_parameters", {}
+            ),
+            "minimum_period_in_s": process_params["minimum_period_in_s"],
+            "maximum_period_in_s": process_params["maximum_period_in_s"],
+            "scale_data_to_synthetics": process_params[
+                "scale_data_to_synthetics"
+            ],
+        }
+        context["input_hashes"] = compute_station_hashes(
+            context["filenames"][f"processed/{event_name}"],
+            context["filenames"][f"synthetic/{event_name}"].filename,
+            context["stations"],
+            context["windows"],
+            config,
+        )
+
+        previous = {}
+        if os.path.exists(self.get_filename(event_name, iteration)):
+            previous = read_station_hashes(
+                self.get_input_hashes_filename(event_name, iteration)
+            )
+        reusable = {
+            station: previous[station]["misfit"]
+            for station, input_hash in context["input_hashes"].items()
+            if station in previous and previous[station]["hash"] == input_hash
+        }
+        print(
+            f"Event {event_name}: {len(reusable)} of "
+            f"{len(context['stations'])} stations are unchanged and keep "
+            f"their adjoint sources, recomputing "
+            f"{len(context['stations']) - len(reusable)} stations."
+        )
+        return reusable
+
+    def _calculate_station_adjoint_sources(
+        self,
+        context: dict,
+        station: str,
+        iteration: str,
+        window_set_name: str,
+        plot: bool = False,
+        adjoint_src: bool = True,
+    ):
+        """
+        Calculate the adjoint sources of all components of a station. Runs
+        within a worker whose data sets have been registered with the
+        filenames of :meth:`_get_adjoint_source_context`.
+
+        Returns a dictionary with the station name as key and the misfits
+        and adjoint sources of the channels as values.
+
+        :param context: Event information from
+            :meth:`_get_adjoint_source_context`
+        :type context: dict
+        :param station: Name of station
+        :type station: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param window_set_name: Name of window set
+        :type window_set_name: str
+        :param plot: Should the adjoint source be plotted?, defaults to False
+        :type plot: bool, optional
+        :param adjoint_src: Calculate the adjoint sources or only the
+            misfits, defaults to True
+        :type adjoint_src: bool, optional
+        """
+        streams = self._read_station_streams(
+            context["event_name"], station, iteration
+        )
+        if streams is None:
+            return {station: {}}
+        st_obs, st_syn, _ = streams
+        return self._adjoint_sources_from_streams(
+            context,
+            station,
+            st_obs,
+            st_syn,
+            window_set_name,
+            plot=plot,
+            adjoint_src=adjoint_src,
+        )
+
+    def _read_station_streams(
+        self,
+        event_name: str,
+        station: str,
+        iteration: str,
+        reference_iteration: str = None,
+    ):
+        """
+        Read the observed data and the processed synthetics of a station.
+        Runs within a worker whose data sets have been registered under
+        ``processed/`` and the processed synthetics caches under
+        ``synthetic/`` and, with a reference iteration,
+        ``reference_synthetic/`` plus the event name.
+
+        Returns the observed, synthetic and reference synthetic streams, the
+        last one is None without a reference iteration. Returns None if the
+        station does not have exactly one waveform tag per file.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param station: Name of station
+        :type station: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param reference_iteration: Name of reference iteration, defaults
+            to None
+        :type reference_iteration: str, optional
+        """
+        with stage("read_observed"):
+            ds = get_worker_dataset(f"processed/{event_name}")
+            observed_station = ds.waveforms[station]
+            obs_tag = observed_station.get_waveform_tags()
+        if len(obs_tag) != 1:
+            return None
+        # The cache only holds stations with a single synthetic tag.
+        with stage("read_synthetics"):
+            st_syn = get_worker_dataset(
+                f"synthetic/{event_name}"
+            ).get_station(station)
+        add_bytes_read("read_synthetics", st_syn)
+        if st_syn is None:
+            return None
+        with stage("read_observed"):
+            st_obs = observed_station[obs_tag[0]]
+        add_bytes_read("read_observed", st_obs)
+
+        st_ref_syn = None
+        if reference_iteration:
+            with stage("read_synthetics"):
+                st_ref_syn = get_worker_dataset(
+                    f"reference_synthetic/{event_name}"
+                ).get_station(station)
+            add_bytes_read("read_synthetics", st_ref_syn)
+            if st_ref_syn is None:
+                return None
+        return st_obs, st_syn, st_ref_syn
+
+    def _adjoint_sources_from_streams(
+        self,
+        context: dict,
+        station: str,
+        st_obs,
+        st_syn,
+        window_set_name: str,
+        plot: bool = False,
+        adjoint_src: bool = True,
+    ):
+        """
+        Calculate the adjoint sources of a station from its observed and
+        processed synthetic streams. The traces of the streams are modified.
+
+        :param context: Event information from
+            :meth:`_get_adjoint_source_context`
+        :type context: dict
+        :param station: Name of station
+        :type station: str
+        :param st_obs: Observed data of the station
+        :type st_obs: :class:`obspy.core.stream.Stream`
+        :param st_syn: Processed synthetics of the station
+        :type st_syn: :class:`obspy.core.stream.Stream`
+        :param window_set_name: Name of window set
+        :type window_set_name: str
+        :param plot: Should the adjoint source be plotted?, defaults to False
+        :type plot: bool, optional
+        :param adjoint_src: Calculate the adjoint sources or only the
+            misfits, defaults to True
+        :type adjoint_src: bool, optional
+        """
+        all_windows = context["windows"]
+        process_params = self.comm.project.simulation_settings
+        # Optional type specific parameters, e.g. the frequency_cutoff of
+        # the tf_phase_misfit.
+        optimization_settings = self.comm.project.optimization_settings
+        adjoint_source_parameters = optimization_settings.get(
+            "adjoint_source_parameters", {}
+        )
+
+        adjoint_sources = {}
+        components = []
+        ad_src_type = self.comm.project.optimization_settings[
+            "misfit_type"
+        ]
+        if ad_src_type == "weighted_waveform_misfit":
+            env_scaling = True
+            ad_src_type = "waveform_misfit"
+        else:
+            env_scaling = False
+
+        for component in ["E", "N", "Z"]:
+            try:
+                data_tr = select_component_from_stream(st_obs, component)
+                synth_tr = select_component_from_stream(st_syn, component)
+                with stage("interpolate"):
+                    synth_tr.interpolate(
+                        sampling_rate=data_tr.stats.sampling_rate
+                    )
+                    synth_tr.trim(endtime=data_tr.stats.endtime)
+                    data_tr.trim(endtime=synth_tr.stats.endtime)
+            except LASIFNotFoundError:
+                continue
+
+            if self.comm.project.simulation_settings[
+                    "scale_data_to_synthetics"]:
+                if (not self.comm.project.optimization_settings[
+                            "misfit_type"] == "envelope_misfit"):
+                    scaling_factor = (
+                            synth_tr.data.ptp() / data_tr.data.ptp()
+                    )
+                    # Store and apply the scaling.
+                    data_tr.stats.scaling_factor = scaling_factor
+                    data_tr.data *= scaling_factor
+
+            net, sta, cha = data_tr.id.split(".", 2)
+            station_name = net + "." + sta
+
+            if station_name not in all_windows:
+                continue
+            if data_tr.id not in all_windows[station_name]:
+                continue
+            # Collect all.
+            windows = all_windows[station_name][data_tr.id]
+            if not plot:
+                components.append((data_tr, synth_tr, windows))
+                continue
+            try:
+                asrc = calculate_adjoint_source(
+                    observed=data_tr,
+                    synthetic=synth_tr,
+                    window=windows,
+                    min_period=process_params["minimum_period_in_s"],
+                    max_period=process_params["maximum_period_in_s"],
+                    adj_src_type=ad_src_type,
+                    window_set=window_set_name,
+                    taper_ratio=0.15,
+                    taper_type="cosine",
+                    plot=plot,
+                    adjoint_src=adjoint_src,
+                    envelope_scaling=env_scaling,
+                    adjoint_source_parameters=adjoint_source_parameters,
+                )
+            except:
+                # Either pass or fail for the whole component.
+                continue
+
+            adjoint_sources[data_tr.id] = {
+                "misfit": asrc.misfit,
+                "adj_source": asrc.adjoint_source.data,
+            }
+
+        if not components:
+            return {station: adjoint_sources}
+
+        # Same result without copying the traces, with the windows of all
+        # components in one batch.
+        kwargs = dict(
+            adj_src_type=ad_src_type,
+            min_period=process_params["minimum_period_in_s"],
+            max_period=process_params["maximum_period_in_s"],
+            taper_type="cosine",
+            adjoint_src=adjoint_src,
+            envelope_scaling=env_scaling,
+            adjoint_source_parameters=adjoint_source_parameters,
+        )
+        with stage("misfit"):
+            try:
+                asrcs = calculate_adjoint_source_batch(
+                    observed=[_c[0].data for _c in components],
+                    synthetic=[_c[1].data for _c in components],
+                    stats=[_c[0].stats for _c in components],
+                    synthetic_stats=[_c[1].stats for _c in components],
+                    window=[_c[2] for _c in components],
+                    **kwargs,
+                )
+            except:
+                # Find the failing components, either pass or fail for the
+                # whole component.
+                asrcs = []
+                for data_tr, synth_tr, windows in components:
+                    try:
+                        asrc = calculate_adjoint_source_array(
+                            observed=data_tr.data,
+                            synthetic=synth_tr.data,
+                            stats=data_tr.stats,
+                            synthetic_stats=synth_tr.stats,
+                            window=windows,
+                            **kwargs,
+                        )
+                    except:
+                        asrc = None
+                    asrcs.append(asrc)
+
+        for (data_tr, _, _), asrc in zip(components, asrcs):
+            if not asrc:
+                continue
+            adjoint_sources[data_tr.id] = {
+                "misfit": asrc.misfit,
+                "adj_source": asrc.adjoint_source,
+            }
+        adj_dict = {station: adjoint_sources}
+        return adj_dict
+
+    def _write_misfits(
+        self,
+        event_name: str,
+        iteration: str,
+        results: dict,
+        weight_set_name: str = None,
+        stations: list = None,
+    ):
+        """
+        Write the misfits of an event to the misfit store, multiplied by
+        the station and event weights. Returns the event misfit.
+
+        Without ``stations`` all misfits of the event are replaced. With
+        ``stations`` only the misfits of these stations are replaced and
+        the event misfit is summed over all stored stations of the event.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param results: The results of
+            :meth:`_calculate_station_adjoint_sources` of all stations
+        :type results: dict
+        :param weight_set_name: Name of station weights, defaults to None
+        :type weight_set_name: str, optional
+        :param stations: The stations that were calculated, defaults to
+            all stations of the event
+        :type stations: list, optional
+        """
+        station_misfits = {}
+        for station, value in results.items():
+            if not value:
+                continue
+            station_misfit = 0.0
+            for adj_source in value.values():
+                station_misfit += adj_source["misfit"]
+            station_misfits[station] = float(station_misfit)
+
+        if weight_set_name is not None:
+            ws = self.comm.weights.get(weight_set_name)
+            event_weight = ws.events[event_name]["event_weight"]
+            station_weights = ws.events[event_name]["stations"]
+            for station in station_misfits:
+                station_misfits[station] *= (
+                    station_weights[station]["station_weight"] * event_weight
+                )
+
+        store = self.get_misfit_store(iteration)
+        if stations is not None:
+            # Only some stations were calculated, the misfits of the other
+            # stations of the event are kept.
+            return store.update_stations(event_name, station_misfits)
+        event_misfit = float(sum(station_misfits.values()))
+        store.write_event(event_name, station_misfits, event_misfit)
+        return event_misfit
+
+    def _read_ledger(self, event_name: str, iteration: str):
+        """
+        Read the ledger of an event, see
+        :func:`lasif.tools.adjoint_source_writer.read_ledger`. The ledger
+        is ignored if the auxiliary file does not exist.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        """
+        if not os.path.exists(self.get_filename(event_name, iteration)):
+            return {}, False
+        return read_ledger(self.get_ledger_filename(event_name, iteration))
+
+    def _open_adjoint_source_writer(
+        self, event_name: str, iteration: str, reused: dict = None
+    ):
+        """
+        Start writing the adjoint sources of an event to its auxiliary file.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param reused: Unweighted misfits of the stations whose adjoint
+            sources are already in the auxiliary file and are kept. The
+            adjoint sources of all other stations are removed from the file
+            first. Without it, the adjoint sources are added to the file,
+            defaults to None
+        :type reused: dict, optional
+        :rtype: :class:`lasif.tools.adjoint_source_writer.AdjointSourceWriter`
+        """
+        print("Writing adjoint sources...")
+        return AdjointSourceWriter(
+            self.get_filename(event=event_name, iteration=iteration),
+            self.get_ledger_filename(event_name, iteration),
+            reused=reused,
+        )
+
+    def _close_adjoint_source_writer(
+        self, event_name: str, iteration: str, writer: AdjointSourceWriter
+    ):
+        """
+        Write the remaining adjoint sources of an event and the misfits of
+        all its stations to the misfit store.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param writer: The writer of :meth:`_open_adjoint_source_writer`
+        :type writer:
+            :class:`lasif.tools.adjoint_source_writer.AdjointSourceWriter`
+        """
+        writer.close()
+
+        # A single transaction replaces all misfits of the event.
+        station_misfits = {
+            station: misfit
+            for station, misfit in writer.station_misfits.items()
+            if misfit is not None
+        }
+        self.get_misfit_store(iteration).write_event(
+            event_name, station_misfits, writer.total_misfit
+        )
+
+        with pyasdf.ASDFDataSet(
+                filename=writer.filename, mpi=False, mode="a"
+        ) as ds:
+            length = len(ds.auxiliary_data.AdjointSources.list())
         print(f"{length} Adjoint sources are in your file.")
 
+    def _write_input_hashes(
+        self,
+        event_name: str,
+        iteration: str,
+        context: dict,
+        station_misfits: dict,
+    ):
+        """
+        Store the input hashes and unweighted misfits of all stations of an
+        event after an incremental calculation.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param context: Event information with the ``input_hashes`` of
+            :meth:`_find_reusable_stations`
+        :type context: dict
+        :param station_misfits: Unweighted misfits of the recomputed and the
+            reused stations
+        :type station_misfits: dict
+        """
+        from lasif.tools.input_hashes import write_station_hashes
+
+        stations = {
+            station: {"hash": input_hash, "misfit": station_misfits[station]}
+            for station, input_hash in context["input_hashes"].items()
+            if station in station_misfits
+        }
+        write_station_hashes(
+            self.get_input_hashes_filename(event_name, iteration), stations
+        )
+
     def finalize_adjoint_sources(
         self, iteration_name: str, event_name: str, weight_set_name: str = None
     ):
@@ -724,107 +1657,177 @@ class AdjointSourcesComponent(Component):
         :param weight_set_name: Name of station weights, defaults to None
         :type weight_set_name: str, optional
         """
-        import pyasdf
-        import h5py
         print("Finalizing adjoint sources...")
-        # This will do stuff for each event and a single iteration
-        # Step one, read adj_src file that should have been created already
-        iteration = self.comm.iterations.get_long_iteration_name(
-            iteration_name
-        )
+        with stage("finalize_adjoint_sources"):
+            weights = self._write_source_time_functions(
+                iteration_name, event_name, weight_set_name
+            )
+        if weight_set_name is not None:
+            self.get_misfit_store(iteration_name).apply_station_weights(
+                event_name, weights
+            )
 
-        adj_src_file = self.get_filename(event_name, iteration)
+    def finalize_adjoint_sources_multiprocessing(
+        self,
+        iteration_name: str,
+        events: list,
+        weight_set_name: str = None,
+        num_processes: int = 16,
+    ):
+        """
+        Finalize the adjoint sources of multiple events in parallel. Does
+        the same as :meth:`finalize_adjoint_sources` for every event.
 
-        ds = pyasdf.ASDFDataSet(adj_src_file, mpi=False)
-        adj_srcs = ds.auxiliary_data["AdjointSources"]
+        :param iteration_name: Name of iteration
+        :type iteration_name: str
+        :param events: Names of the events
+        :type events: list
+        :param weight_set_name: Name of station weights, defaults to None
+        :type weight_set_name: str, optional
+        :param num_processes: The number of processes used in
+            multiprocessing, defaults to 16
+        :type num_processes: int, optional
+        """
+        from tqdm import tqdm
+        import multiprocessing
 
-        input_files_dir = self.comm.project.paths["adjoint_sources"]
+        # Globally define the processing function. This is required to enable
+        # pickling of a function within a function.
+        global _finalize
+
+        # Make sure the store exists before the workers write to it.
+        store = self.get_misfit_store(iteration_name)
 
+        def _finalize(event_name):
+            weights = self._write_source_time_functions(
+                iteration_name, event_name, weight_set_name
+            )
+            if weight_set_name is not None:
+                store.apply_station_weights(event_name, weights)
+
+        print(f"Finalizing adjoint sources of {len(events)} events...")
+        number_processes = min(
+            num_processes, multiprocessing.cpu_count(), len(events)
+        )
+        if number_processes <= 1:
+            for event_name in tqdm(events):
+                _finalize(event_name)
+        else:
+            with multiprocessing.Pool(number_processes) as pool:
+                with tqdm(total=len(events)) as pbar:
+                    for _ in pool.imap_unordered(_finalize, events):
+                        pbar.update()
+                pool.close()
+                pool.join()
+
+    def _get_receiver_index(self, event_name: str, station_names: list):
+        """
+        Map the station names of the adjoint source file, e.g. ``NET_STA``,
+        to the receiver names of the event, e.g. ``NET.STA``.
+
+        Adjoint sources only exist for stations of the raw data, so the raw
+        data file is only consulted if the stations have to be restricted to
+        the intersection of all events.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param station_names: Station names of the adjoint source file
+        :type station_names: list
+        """
+        if not self.comm.project.stacking_settings["use_only_intersection"]:
+            # Network codes do not contain underscores.
+            return {
+                station: station.replace("_", ".", 1)
+                for station in station_names
+            }
         receivers = self.comm.query.get_all_stations_for_event(event_name)
+        return {receiver.replace(".", "_"): receiver for receiver in receivers}
+
+    def _write_source_time_functions(
+        self, iteration_name: str, event_name: str, weight_set_name: str = None
+    ):
+        """
+        Write the adjoint sources of an event to the stf.h5 file, one ZNE
+        dataset per receiver, multiplied with the station and event weights.
+
+        Returns a dictionary with the weight applied to every receiver which
+        is empty if no weight set is given.
+
+        :param iteration_name: Name of iteration
+        :type iteration_name: str
+        :param event_name: Name of event
+        :type event_name: str
+        :param weight_set_name: Name of station weights, defaults to None
+        :type weight_set_name: str, optional
+        """
+        import h5py
+        from lasif.tools.batch_h5_writer import BatchH5Writer
 
+        iteration = self.comm.iterations.get_long_iteration_name(
+            iteration_name
+        )
+        adj_src_file = self.get_filename(event_name, iteration)
+
+        input_files_dir = self.comm.project.paths["adjoint_sources"]
         output_dir = os.path.join(input_files_dir, iteration, event_name)
         if not os.path.exists(output_dir):
             os.mkdir(output_dir)
-
         adjoint_source_file_name = os.path.join(output_dir, "stf.h5")
 
-        f = h5py.File(adjoint_source_file_name, "w")
-
         event_weight = 1.0
         if weight_set_name is not None:
             ws = self.comm.weights.get(weight_set_name)
             event_weight = ws.events[event_name]["event_weight"]
             station_weights = ws.events[event_name]["stations"]
-            computed_misfits = toml.load(self.get_misfit_file(iteration))
-
-        for adj_src in adj_srcs:
-            station_name = adj_src.auxiliary_data_type.split("/")[1]
-            channels = adj_src.list()
-
-            e_comp = np.zeros_like(adj_src[channels[0]].data[()])
-            n_comp = np.zeros_like(adj_src[channels[0]].data[()])
-            z_comp = np.zeros_like(adj_src[channels[0]].data[()])
-
-            for channel in channels:
-                # check channel and set component
-                if channel[-1] == "E":
-                    e_comp = adj_src[channel].data[()]
-                elif channel[-1] == "N":
-                    n_comp = adj_src[channel].data[()]
-                elif channel[-1] == "Z":
-                    z_comp = adj_src[channel].data[()]
-            zne = np.array((z_comp, n_comp, e_comp))
-            for receiver in receivers.keys():
-                station = receiver.replace(".", "_")
-                # station = receiver["network"] + "_" + receiver["station"]
-
-                if station == station_name:
-                    # transform_mat = np.array(receiver["transform_matrix"])
-                    # xyz = np.dot(transform_mat.T, zne).T
-
-                    # net_dot_sta = \
-                    #    receiver["network"] + "." + receiver["station"]
+
+        dt = self.comm.project.simulation_settings["time_step_in_s"]
+        attributes = {
+            "dt": dt,
+            "sampling_rate_in_hertz": 1 / np.asarray(dt),
+            "spatial-type": np.string_("vector"),
+            "start_time_in_seconds": self.comm.project.simulation_settings[
+                "start_time_in_s"
+            ],
+        }
+
+        weights = {}
+        # The auxiliary data is read directly, which avoids parsing the
+        # parameters of every single adjoint source.
+        with h5py.File(adj_src_file, "r") as f:
+            if "AdjointSources" not in f.get("AuxiliaryData", {}):
+                raise LASIFNotFoundError(
+                    f"No adjoint sources found in {adj_src_file}"
+                )
+            adj_srcs = f["AuxiliaryData"]["AdjointSources"]
+            receivers = self._get_receiver_index(event_name, list(adj_srcs))
+
+            with BatchH5Writer(
+                adjoint_source_file_name, attributes=attributes
+            ) as writer:
+                for station_name, adj_src in adj_srcs.items():
+                    if station_name not in receivers:
+                        continue
+                    receiver = receivers[station_name]
+
+                    channels = sorted(adj_src.keys())
+                    components = {}
+                    for channel in channels:
+                        components[channel[-1]] = adj_src[channel][()]
+                    empty = np.zeros_like(components[channels[0][-1]])
+                    zne = np.array(
+                        [components.get(_c, empty) for _c in ("Z", "N", "E")]
+                    )
+
                     if weight_set_name is not None:
                         weight = (
                             station_weights[receiver]["station_weight"]
                             * event_weight
                         )
                         zne *= weight
-                        computed_misfits[event_name]["stations"][
-                            receiver
-                        ] *= weight
-
-                    source = f.create_dataset(station, data=zne.T)
-                    source.attrs["dt"] = self.comm.project.simulation_settings[
-                        "time_step_in_s"
-                    ]
-                    source.attrs["sampling_rate_in_hertz"] = (
-                        1 / source.attrs["dt"]
-                    )
-
-                    # source.attrs['location'] = np.array(
-                    #    [receivers[receiver]["s"]])
-                    source.attrs["spatial-type"] = np.string_("vector")
-                    # Start time in nanoseconds
-                    source.attrs[
-                        "start_time_in_seconds"
-                    ] = self.comm.project.simulation_settings[
-                        "start_time_in_s"
-                    ]
-
-                    # toml_string += f"[[source]]\n" \
-                    #               f"name = \"{station}\"\n" \
-                    #               f"dataset_name = \"/{station}\"\n\n"
-        if weight_set_name is not None:
-            computed_misfits[event_name]["event_misfit"] = np.sum(
-                np.array(
-                    list(computed_misfits[event_name]["stations"].values())
-                )
-            )
-            with open(self.get_misfit_file(iteration), "w") as fh:
-                toml.dump(computed_misfits, fh)
+                        weights[receiver] = weight
 
-        f.close()
+                    writer.add(station_name, zne.T)
+        return weights
 
     @staticmethod
     def _validate_return_value(adsrc):
@@ -132,8 +132,6 @@ class EventsComponent(Component):
         :type iteration_2: str, optional
         """
         if iteration is not None:
-            import toml
-
             iter_name = self.comm.iterations.get_long_iteration_name(iteration)
             path = os.path.join(
                 self.comm.project.paths["iterations"],
@@ -147,7 +145,7 @@ class EventsComponent(Component):
                 )
                 self._update_cache()
                 return sorted(self.__event_info_cache.keys())
-            iter_events = toml.load(path)
+            iter_events = self.comm.project.load_toml(path)
             events = iter_events["events"]["events_used"]
             if iteration_2 is not None:
                 iter2_name = self.comm.iterations.get_long_iteration_name(iteration_2)
@@ -162,7 +160,7 @@ class EventsComponent(Component):
                         "Will give all events"
                     )
                     self._update_cache()
-                iter2_events = toml.load(path2)
+                iter2_events = self.comm.project.load_toml(path2)
                 events2 = iter2_events["events"]["events_used"]
                 intersection_set = set.intersection(set(events), set(events2))
                 events = list(intersection_set)
@@ -184,8 +182,6 @@ class EventsComponent(Component):
         :type iteration: str, optional
         """
         if iteration is not None:
-            import toml
-
             iter_name = self.comm.iterations.get_long_iteration_name(iteration)
             path = os.path.join(
                 self.comm.project.paths["iterations"],
@@ -198,7 +194,7 @@ class EventsComponent(Component):
                     "Will give all events"
                 )
                 return len(self.all_events)
-            iter_events = toml.load(path)
+            iter_events = self.comm.project.load_toml(path)
             return len(iter_events["events"]["events_used"])
         else:
             return len(self.all_events)
@@ -25,6 +25,7 @@ import toml
 
 import lasif.domain
 from lasif.exceptions import LASIFError, LASIFNotFoundError, LASIFWarning
+from lasif.tools.toml_cache import TomlCache
 from .adjoint_sources import AdjointSourcesComponent
 from .communicator import Communicator
 from .component import Component
@@ -75,6 +76,9 @@ class Project(Component):
             )
             raise LASIFError(msg)
 
+        # Parsed TOML metadata files will be cached here.
+        self.__toml_cache = TomlCache()
+
         # Setup the communicator and register this component.
         self.__comm = Communicator()
         super(Project, self).__init__(self.__comm, "project")
@@ -420,7 +424,10 @@ class Project(Component):
             "comment": (
                 "Supported misfits are: tf_phase_misfit, "
                 "cc_traveltime_misfit, "
-                "waveform_misfit"
+                "waveform_misfit. Parameters specific to the misfit, e.g. "
+                "frequency_cutoff = 2.0 and single_precision = true for "
+                "the tf_phase_misfit, can be given in an optional "
+                "[optimization_settings.adjoint_source_parameters] table."
             ),
             "misfit_type": "tf_phase_misfit",
         }
@@ -449,6 +456,7 @@ class Project(Component):
         # type / filename map
         fct_type_map = {
             "window_picking_function": "window_picking_function.py",
+            "window_picking_function_batch": "window_picking_function.py",
             "processing_function": "process_data.py",
             "preprocessing_function_asdf": "preprocessing_function_asdf.py",
             "process_synthetics": "process_synthetics.py",
@@ -491,6 +499,27 @@ class Project(Component):
         self.__project_function_cache[fct_type] = fct
         return fct
 
+    def load_toml(self, filename):
+        """
+        Helper parsing a TOML metadata file of the project, e.g. an
+        ``events_used.toml`` or ``forward.toml`` file.
+
+        Files are only parsed again if their modification time or size
+        changed, so this is cheap to call in loops. Returns a copy of the
+        content.
+
+        :param filename: The TOML file.
+        :type filename: Union[str, pathlib.Path]
+        """
+        return self.__toml_cache.load(filename)
+
+    def get_toml_cache_info(self):
+        """
+        Get the number of ``hits``, ``misses`` and cached ``files`` of the
+        cache used by :meth:`load_toml`.
+        """
+        return self.__toml_cache.info()
+
     def get_output_folder(self, type, tag, timestamp=True):
         """
         Generates a output folder in a unified way.
@@ -5,7 +5,6 @@ from __future__ import absolute_import
 import math
 import numpy as np
 import os
-import toml
 from typing import List
 
 from lasif.exceptions import LASIFError, LASIFNotFoundError
@@ -177,14 +176,9 @@ class VisualizationsComponent(Component):
         stations = self.comm.query.get_all_stations_for_event(
             event_name, intersection_override=intersection_override
         )
-        long_iter = self.comm.iterations.get_long_iteration_name(iteration)
-        misfit_toml = (
-            self.comm.project.paths["iterations"] / long_iter / "misfits.toml"
-        )
-        iteration_misfits = toml.load(misfit_toml)
-        station_misfits = iteration_misfits[event_info["event_name"]][
-            "stations"
-        ]
+        station_misfits = self.comm.adj_sources.get_misfit_for_event(
+            event_info["event_name"], iteration, include_station_misfit=True
+        )["stations"]
         misfitted_stations = {k: stations[k] for k in station_misfits.keys()}
         for k in misfitted_stations.keys():
             misfitted_stations[k]["misfit"] = station_misfits[k]
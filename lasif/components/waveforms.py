@@ -11,9 +11,24 @@ import obspy
 from typing import List
 
 from lasif.exceptions import LASIFNotFoundError, LASIFWarning
+from lasif.tools.processed_synthetics_cache import (
+    ProcessedSyntheticsCache,
+    compute_cache_key,
+)
 from .component import Component
 
 
+def _file_state(filename):
+    """
+    Size and modification time of a file, None if it does not exist.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
 class LimitedSizeDict(collections.OrderedDict):
     """
     Based on http://stackoverflow.com/a/2437645/1657047
@@ -60,6 +75,9 @@ class WaveformsComponent(Component):
         self._data_folder = data_folder
         self._preproc_data_folder = preproc_data_folder
         self._synthetics_folder = synthetics_folder
+        # The state of the files and the cache of processed synthetics, if
+        # it is up to date, per event and iteration.
+        self._valid_synthetics_caches = {}
         super(WaveformsComponent, self).__init__(communicator, component_name)
 
     def get_asdf_filename(
@@ -196,6 +214,16 @@ class WaveformsComponent(Component):
         :type long_iteration_name: str
         """
 
+        # Read from the cache of processed synthetics if it is up to date.
+        cache = self._get_valid_synthetics_cache(
+            event_name, long_iteration_name
+        )
+        if cache is not None:
+            with cache.open() as reader:
+                st = reader.get_station(station_id)
+            if st is not None:
+                return st
+
         st = self._get_waveforms(
             event_name,
             station_id,
@@ -222,10 +250,19 @@ class WaveformsComponent(Component):
         :return: Processed stream of waveforms
         :rtype: obspy.core.stream.Stream
         """
-
-        import toml
-
         fct = self.comm.project.get_project_function("process_synthetics")
+        simulation_settings = self._get_synthetics_processing_settings(
+            iteration
+        )
+        return fct(
+            st, simulation_settings, event=self.comm.events.get(event_name)
+        )
+
+    def _get_synthetics_processing_settings(self, iteration: str):
+        """
+        The simulation settings passed to the project function processing
+        the synthetics of an iteration.
+        """
         if not iteration.startswith("ITERATION"):
             iteration = f"ITERATION_{iteration}"
 
@@ -236,8 +273,7 @@ class WaveformsComponent(Component):
             "forward.toml",
         )
         if os.path.exists(info_file):
-            with open(info_file, "r") as fh:
-                iter_info = toml.load(fh)
+            iter_info = self.comm.project.load_toml(info_file)
             simulation_settings = iter_info["simulation_settings"]
             simulation_settings[
                 "end_time_in_s"
@@ -256,9 +292,194 @@ class WaveformsComponent(Component):
             simulation_settings[
                 "maximum_period"
             ] = self.comm.project.simulation_settings["maximum_period_in_s"]
-        return fct(
-            st, simulation_settings, event=self.comm.events.get(event_name)
+        return simulation_settings
+
+    def get_processed_synthetics_cache(self, event_name: str, iteration: str):
+        """
+        The cache of the processed synthetics of an event and iteration.
+        It is stored next to the raw synthetics and is only valid as long
+        as neither the raw synthetics, the project's
+        ``process_synthetics.py`` nor the simulation settings change.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :rtype: :class:`~lasif.tools.processed_synthetics_cache.ProcessedSyntheticsCache`
+        """
+        raw_filename = self.get_asdf_filename(
+            event_name=event_name,
+            data_type="synthetic",
+            tag_or_iteration=iteration,
+        )
+        if not os.path.exists(raw_filename):
+            raise LASIFNotFoundError(
+                "No synthetic waveform data found for event '%s' and "
+                "iteration '%s'." % (event_name, iteration)
+            )
+        # Loading the function makes sure the file exists.
+        self.comm.project.get_project_function("process_synthetics")
+        with open(
+            os.path.join(
+                self.comm.project.paths["functions"], "process_synthetics.py"
+            ),
+            "rb",
+        ) as fh:
+            function_source = fh.read()
+        key = compute_cache_key(
+            function_source,
+            self._get_synthetics_processing_settings(iteration),
+            self.comm.events.get(event_name),
+            raw_filename,
+        )
+        return ProcessedSyntheticsCache(
+            os.path.join(
+                os.path.dirname(raw_filename), "processed_receivers.h5"
+            ),
+            key,
+        )
+
+    def _get_valid_synthetics_cache(self, event_name: str, iteration: str):
+        """
+        The cache of the processed synthetics of an event and iteration if
+        it is up to date, otherwise None. The cache key is only computed
+        again if the raw synthetics or the cache file changed on disk, not
+        for every station.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        """
+        raw_filename = self.get_asdf_filename(
+            event_name=event_name,
+            data_type="synthetic",
+            tag_or_iteration=iteration,
+        )
+        files = (
+            _file_state(raw_filename),
+            _file_state(
+                os.path.join(
+                    os.path.dirname(raw_filename), "processed_receivers.h5"
+                )
+            ),
+        )
+        previous = self._valid_synthetics_caches.get((event_name, iteration))
+        if previous is not None and previous[0] == files:
+            return previous[1]
+        try:
+            cache = self.get_processed_synthetics_cache(event_name, iteration)
+        except LASIFNotFoundError:
+            cache = None
+        if cache is not None and not cache.is_valid():
+            cache = None
+        self._valid_synthetics_caches[(event_name, iteration)] = (files, cache)
+        return cache
+
+    def build_processed_synthetics_cache(
+        self,
+        event_name: str,
+        iteration: str,
+        num_processes: int = 16,
+        stations: List[str] = None,
+    ):
+        """
+        Process the synthetics of an event and iteration and store them in
+        the cache. Only the stations which are not yet in an up to date
+        cache are processed.
+        Uses Python's multiprocessing for parallelization.
+
+        :param event_name: Name of event
+        :type event_name: str
+        :param iteration: Name of iteration
+        :type iteration: str
+        :param num_processes: The number of processes used in multiprocessing
+        :type num_processes: int
+        :param stations: The stations which are needed in the form
+            ``NET.STA``, all stations with synthetics if None, defaults to
+            None
+        :type stations: List[str], optional
+        :rtype: :class:`~lasif.tools.processed_synthetics_cache.ProcessedSyntheticsCache`
+        """
+        from lasif.tools.asdf_handle_pool import (
+            init_worker_datasets,
+            get_worker_dataset,
+        )
+        from lasif.tools.stage_timing import (
+            add_bytes_read,
+            collect,
+            stage,
+            timed,
+        )
+        import multiprocessing
+
+        # Globally define the processing function. This is required to enable
+        # pickling of a function within a function.
+        global _process_station_synthetics
+
+        cache = self.get_processed_synthetics_cache(event_name, iteration)
+        extend = cache.is_valid()
+        cached = set()
+        if extend:
+            with cache.open() as reader:
+                cached = set(reader.list()) | set(reader.list_skipped())
+
+        def _process_station_synthetics(station):
+            with stage("read_raw_synthetics"):
+                station_group = get_worker_dataset("synthetic").waveforms[
+                    station
+                ]
+                tags = station_group.get_waveform_tags()
+                # Stations the pipelines would reject are not cached.
+                if len(tags) != 1:
+                    return station, None
+                st = station_group[tags[0]]
+            add_bytes_read("read_raw_synthetics", st)
+            with warnings.catch_warnings(), stage("process_synthetics"):
+                warnings.simplefilter("ignore")
+                st = self.process_synthetics(
+                    st=st, event_name=event_name, iteration=iteration,
+                )
+            return station, st
+
+        raw_filename = self.get_asdf_filename(
+            event_name=event_name,
+            data_type="synthetic",
+            tag_or_iteration=iteration,
+        )
+        with pyasdf.ASDFDataSet(raw_filename, mode="r", mpi=False) as ds:
+            task_list = ds.waveforms.list()
+        if stations is not None:
+            stations = set(stations)
+            task_list = [_s for _s in task_list if _s in stations]
+        task_list = [_s for _s in task_list if _s not in cached]
+        if extend and not task_list:
+            return cache
+
+        print(
+            f"Processing the synthetics of {len(task_list)} stations of "
+            f"event {event_name} for the cache."
         )
+        number_processes = min(num_processes, multiprocessing.cpu_count())
+        with cache.writer(extend=extend) as writer:
+            with multiprocessing.Pool(
+                number_processes,
+                initializer=init_worker_datasets,
+                initargs=({"synthetic": raw_filename},),
+            ) as pool:
+                for station, st in collect(
+                    pool.imap_unordered(
+                        timed(_process_station_synthetics), task_list
+                    )
+                ):
+                    if st is None:
+                        writer.skip(station)
+                        continue
+                    with stage("write_synthetics_cache"):
+                        writer.add(station, st)
+                pool.close()
+                pool.join()
+        return cache
 
     def process_data_on_the_fly(
         self,
@@ -6,6 +6,8 @@ import glob
 import os
 from typing import List
 
+import numpy as np
+
 from .component import Component
 
 from ..window_manager_sql import WindowGroupManager
@@ -24,15 +26,18 @@ class WindowsComponent(Component):
     def __init__(self, communicator, component_name):
         super(WindowsComponent, self).__init__(communicator, component_name)
 
-    def get(self, window_set_name: str):
+    def get(self, window_set_name: str, read_only: bool = False):
         """
         Returns the window manager instance for a window set.
 
         :param window_set_name: The name of the window set.
         :type window_set_name: str
+        :param read_only: Open the window set read-only, it has to exist,
+            defaults to False
+        :type read_only: bool, optional
         """
         filename = self.get_window_set_filename(window_set_name)
-        return WindowGroupManager(filename)
+        return WindowGroupManager(filename, read_only=read_only)
 
     def list(self):
         """
@@ -90,9 +95,12 @@ class WindowsComponent(Component):
             dictionary(stations) of dicts(channels) of lists(windowS)
             of tuples (start- and end times)
         :type windows: dict
+        :return: The number of windows written
         """
-        window_group_manager = self.get(window_set_name)
-        window_group_manager.write_windows_bulk(event_name, windows)
+        with self.get(window_set_name) as window_group_manager:
+            return window_group_manager.write_windows_bulk(
+                event_name, windows
+            )
 
     def read_all_windows(self, event: str, window_set_name: str):
         """
@@ -105,8 +113,12 @@ class WindowsComponent(Component):
         :param window_set_name: The name of the window set.
         :type window_set_name: str
         """
-        window_group_manager = self.get(window_set_name)
-        return window_group_manager.get_all_windows_for_event(event_name=event)
+        if not self.has_window_set(window_set_name):
+            return {}
+        with self.get(window_set_name, read_only=True) as window_group_manager:
+            return window_group_manager.get_all_windows_for_event(
+                event_name=event
+            )
 
     def get_window_statistics(self, window_set_name: str, events: List[str]):
         """
@@ -120,6 +132,9 @@ class WindowsComponent(Component):
         :type events: List[str]
         """
         statistics = {}
+        window_group_manager = None
+        if self.has_window_set(window_set_name):
+            window_group_manager = self.get(window_set_name, read_only=True)
 
         for _i, event in enumerate(events):
             print(
@@ -127,9 +142,12 @@ class WindowsComponent(Component):
                 % (_i + 1, len(events))
             )
 
-            wm = self.read_all_windows(
-                event=event, window_set_name=window_set_name
-            )
+            if window_group_manager is not None:
+                wm = window_group_manager.get_all_windows_for_event(
+                    event_name=event
+                )
+            else:
+                wm = {}
 
             # wm is dict with stations/channels/list of start_end tuples
             station_details = self.comm.query.get_all_stations_for_event(event)
@@ -170,6 +188,8 @@ class WindowsComponent(Component):
                 "window_length_east_components": component_length_sum["E"],
             }
 
+        if window_group_manager is not None:
+            window_group_manager.close()
         return statistics
 
     def select_windows_multiprocessing(
@@ -182,7 +202,9 @@ class WindowsComponent(Component):
     ):
         """
         Automatically select the windows for the given event and iteration.
-        Uses Python's multiprocessing for parallelization.
+        Uses Python's multiprocessing for parallelization. The components of
+        a station are picked with the project's window_picking_function_batch
+        if it exists.
 
         :param event: The event.
         :type event: str
@@ -194,6 +216,16 @@ class WindowsComponent(Component):
         :type num_processes: int
         """
         from lasif.utils import select_component_from_stream
+        from lasif.tools.asdf_handle_pool import (
+            init_worker_datasets,
+            get_worker_dataset,
+        )
+        from lasif.tools.stage_timing import (
+            add_bytes_read,
+            collect,
+            stage,
+            timed,
+        )
         from tqdm import tqdm
         import multiprocessing
         import warnings
@@ -229,6 +261,12 @@ class WindowsComponent(Component):
         select_windows = self.comm.project.get_project_function(
             "window_picking_function"
         )
+        try:
+            select_windows_batch = self.comm.project.get_project_function(
+                "window_picking_function_batch"
+            )
+        except LASIFNotFoundError:
+            select_windows_batch = None
 
         # Get source time function
         stf_fct = self.comm.project.get_project_function(
@@ -251,58 +289,53 @@ class WindowsComponent(Component):
         maximum_period = process_params["maximum_period_in_s"]
 
         def _window_select(station):
-            ds = pyasdf.ASDFDataSet(processed_filename, mode="r", mpi=False)
-            ds_synth = pyasdf.ASDFDataSet(
-                synthetic_filename, mode="r", mpi=False
-            )
-            observed_station = ds.waveforms[station]
-            synthetic_station = ds_synth.waveforms[station]
-
-            obs_tag = observed_station.get_waveform_tags()
-            syn_tag = synthetic_station.get_waveform_tags()
+            with stage("read_observed"):
+                ds = get_worker_dataset("processed")
+                observed_station = ds.waveforms[station]
+                obs_tag = observed_station.get_waveform_tags()
 
             try:
-                # Make sure both have length 1.
+                # Make sure it has length 1.
                 assert len(obs_tag) == 1, (
                     "Station: %s - Requires 1 observed waveform tag. Has %i."
                     % (observed_station._station_name, len(obs_tag))
                 )
-                assert len(syn_tag) == 1, (
-                    "Station: %s - Requires 1 synthetic waveform tag. Has %i."
-                    % (observed_station._station_name, len(syn_tag))
-                )
             except AssertionError:
                 return {station: None}
 
-            obs_tag = obs_tag[0]
-            syn_tag = syn_tag[0]
+            # The processed synthetics, the cache only holds stations with
+            # a single synthetic waveform tag.
+            with stage("read_synthetics"):
+                st_syn = get_worker_dataset("synthetic").get_station(station)
+            add_bytes_read("read_synthetics", st_syn)
+            if st_syn is None:
+                return {station: None}
 
             # Finally get the data.
-            st_obs = observed_station[obs_tag]
-            st_syn = synthetic_station[syn_tag]
+            with stage("read_observed"):
+                st_obs = observed_station[obs_tag[0]]
+            add_bytes_read("read_observed", st_obs)
 
             # Extract coordinates once.
             try:
-                coordinates = observed_station.coordinates
+                with stage("read_observed"):
+                    coordinates = observed_station.coordinates
             except Exception as e:
                 print(e)
                 return {station: None}
 
-            # Process the synthetics.
-            st_syn = self.comm.waveforms.process_synthetics(
-                st=st_syn.copy(),
-                event_name=event["event_name"],
-                iteration=iteration_name,
-            )
-
-            all_windows = {}
+            data_traces = []
+            synthetic_traces = []
             for component in ["E", "N", "Z"]:
                 try:
                     data_tr = select_component_from_stream(st_obs, component)
                     synth_tr = select_component_from_stream(st_syn, component)
-                    synth_tr.interpolate(sampling_rate=data_tr.stats.sampling_rate)
-                    synth_tr.trim(endtime=data_tr.stats.endtime)
-                    data_tr.trim(endtime=synth_tr.stats.endtime)
+                    with stage("interpolate"):
+                        synth_tr.interpolate(
+                            sampling_rate=data_tr.stats.sampling_rate
+                        )
+                        synth_tr.trim(endtime=data_tr.stats.endtime)
+                        data_tr.trim(endtime=synth_tr.stats.endtime)
 
                     if self.comm.project.simulation_settings[
                         "scale_data_to_synthetics"
@@ -316,29 +349,71 @@ class WindowsComponent(Component):
 
                 except LASIFNotFoundError:
                     continue
-
-                windows = None
+                data_traces.append(data_tr)
+                synthetic_traces.append(synth_tr)
+
+            # All components are picked at once if they are sampled
+            # identically, as in select_windows_for_station(). If that
+            # fails they are picked one by one so an error only drops the
+            # windows of a single component.
+            picked = None
+            npts = {tr.stats.npts for tr in data_traces + synthetic_traces}
+            delta = {tr.stats.delta for tr in data_traces}
+            if (
+                select_windows_batch is not None
+                and len(npts) == len(delta) == 1
+            ):
                 try:
-                    windows = select_windows(
-                        data_tr,
-                        synth_tr,
-                        stf_trace,
-                        event["latitude"],
-                        event["longitude"],
-                        event["depth_in_km"],
-                        coordinates["latitude"],
-                        coordinates["longitude"],
-                        minimum_period=minimum_period,
-                        maximum_period=maximum_period,
-                        iteration=iteration_name,
-                        **kwargs,
-                    )
-                except Exception as e:
-                    print(e)
-
-                if not windows:
-                    continue
-                all_windows[data_tr.id] = windows
+                    with stage("window_picking"):
+                        picked = select_windows_batch(
+                            np.array([tr.data for tr in data_traces]),
+                            np.array([tr.data for tr in synthetic_traces]),
+                            [tr.stats.starttime for tr in data_traces],
+                            data_traces[0].stats.delta,
+                            stf_trace,
+                            event["latitude"],
+                            event["longitude"],
+                            event["depth_in_km"],
+                            [coordinates["latitude"]] * len(data_traces),
+                            [coordinates["longitude"]] * len(data_traces),
+                            minimum_period=minimum_period,
+                            maximum_period=maximum_period,
+                            iteration=iteration_name,
+                            ids=[tr.id for tr in data_traces],
+                            **kwargs,
+                        )
+                except Exception:
+                    picked = None
+
+            if picked is None:
+                picked = []
+                for data_tr, synth_tr in zip(data_traces, synthetic_traces):
+                    windows = None
+                    try:
+                        with stage("window_picking"):
+                            windows = select_windows(
+                                data_tr,
+                                synth_tr,
+                                stf_trace,
+                                event["latitude"],
+                                event["longitude"],
+                                event["depth_in_km"],
+                                coordinates["latitude"],
+                                coordinates["longitude"],
+                                minimum_period=minimum_period,
+                                maximum_period=maximum_period,
+                                iteration=iteration_name,
+                                **kwargs,
+                            )
+                    except Exception as e:
+                        print(e)
+                    picked.append(windows)
+
+            all_windows = {
+                data_tr.id: windows
+                for data_tr, windows in zip(data_traces, picked)
+                if windows
+            }
 
             if all_windows:
                 return {station: all_windows}
@@ -352,12 +427,28 @@ class WindowsComponent(Component):
         # Use at most num_processes workers
         number_processes = min(num_processes, multiprocessing.cpu_count())
 
-        # Open Pool of workers
-        with multiprocessing.Pool(number_processes) as pool:
+        # Open Pool of workers. Every worker opens the files once and reuses
+        # them for all stations.
+        filenames = {
+            "processed": processed_filename,
+            "synthetic": self.comm.waveforms.build_processed_synthetics_cache(
+                event["event_name"],
+                iteration_name,
+                num_processes,
+                stations=task_list,
+            ),
+        }
+        with multiprocessing.Pool(
+            number_processes,
+            initializer=init_worker_datasets,
+            initargs=(filenames,),
+        ) as pool:
             results = {}
             with tqdm(total=len(task_list)) as pbar:
                 for i, r in enumerate(
-                    pool.imap_unordered(_window_select, task_list)
+                    collect(
+                        pool.imap_unordered(timed(_window_select), task_list)
+                    )
                 ):
                     pbar.update()
                     k, v = r.popitem()
@@ -373,11 +464,13 @@ class WindowsComponent(Component):
             f"Writing windows for {num_sta_with_windows} out of "
             f"{len(task_list)} stations."
         )
-        self.comm.windows.write_windows_to_sql(
-            event_name=event["event_name"],
-            windows=results,
-            window_set_name=window_set_name,
-        )
+        with stage("write_windows"):
+            num_windows = self.comm.windows.write_windows_to_sql(
+                event_name=event["event_name"],
+                windows=results,
+                window_set_name=window_set_name,
+            )
+        print(f"Wrote {num_windows} windows.")
 
     def select_windows_for_station(
         self,
@@ -390,6 +483,8 @@ class WindowsComponent(Component):
         """
         Selects windows for the given event, iteration, and station. Will
         delete any previously existing windows for that station if any.
+        The components are picked with the project's
+        window_picking_function_batch if it exists.
 
         :param event: The event.
         :type event: str
@@ -434,7 +529,8 @@ class WindowsComponent(Component):
 
         window_group_manager = self.comm.windows.get(window_set_name)
 
-        found_something = False
+        data_traces = []
+        synthetic_traces = []
         for component in ["E", "N", "Z"]:
             try:
                 data_tr = select_component_from_stream(data.data, component)
@@ -447,22 +543,66 @@ class WindowsComponent(Component):
                 )
             except LASIFNotFoundError:
                 continue
-            found_something = True
+            data_traces.append(data_tr)
+            synthetic_traces.append(synth_tr)
 
-            windows = select_windows(
-                data_tr,
-                synth_tr,
+        if not data_traces:
+            raise LASIFNotFoundError(
+                "No matching data found for event '%s', iteration '%s', and "
+                "station '%s'."
+                % (event["event_name"], iteration.name, station)
+            )
+
+        # All components are picked at once if the project has a batched
+        # window picking function and they are sampled identically. Like
+        # the window picking function, this only uses the sampling of the
+        # data.
+        try:
+            select_windows_batch = self.comm.project.get_project_function(
+                "window_picking_function_batch"
+            )
+        except LASIFNotFoundError:
+            select_windows_batch = None
+        npts = {tr.stats.npts for tr in data_traces + synthetic_traces}
+        delta = {tr.stats.delta for tr in data_traces}
+        if select_windows_batch is not None and len(npts) == len(delta) == 1:
+            all_windows = select_windows_batch(
+                np.array([tr.data for tr in data_traces]),
+                np.array([tr.data for tr in synthetic_traces]),
+                [tr.stats.starttime for tr in data_traces],
+                data_traces[0].stats.delta,
                 stf_trace,
                 event["latitude"],
                 event["longitude"],
                 event["depth_in_km"],
-                data.coordinates["latitude"],
-                data.coordinates["longitude"],
+                [data.coordinates["latitude"]] * len(data_traces),
+                [data.coordinates["longitude"]] * len(data_traces),
                 minimum_period=minimum_period,
                 maximum_period=maximum_period,
                 iteration=iteration,
+                ids=[tr.id for tr in data_traces],
                 **kwargs,
             )
+        else:
+            all_windows = [
+                select_windows(
+                    data_tr,
+                    synth_tr,
+                    stf_trace,
+                    event["latitude"],
+                    event["longitude"],
+                    event["depth_in_km"],
+                    data.coordinates["latitude"],
+                    data.coordinates["longitude"],
+                    minimum_period=minimum_period,
+                    maximum_period=maximum_period,
+                    iteration=iteration,
+                    **kwargs,
+                )
+                for data_tr, synth_tr in zip(data_traces, synthetic_traces)
+            ]
+
+        for data_tr, windows in zip(data_traces, all_windows):
             if not windows:
                 continue
 
@@ -473,10 +613,3 @@ class WindowsComponent(Component):
                     start_time=starttime,
                     end_time=endtime,
                 )
-
-        if found_something is False:
-            raise LASIFNotFoundError(
-                "No matching data found for event '%s', iteration '%s', and "
-                "station '%s'."
-                % (event["event_name"], iteration.name, station)
-            )
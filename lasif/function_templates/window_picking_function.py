@@ -9,7 +9,7 @@ Project specific function picking windows.
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
-from lasif.window_selection import select_windows
+from lasif.window_selection import select_windows, select_windows_batch
 
 
 def window_picking_function(
@@ -81,6 +81,95 @@ def window_picking_function(
     Use ``$ lasif shell`` to play around and figure out what the iteration
     objects can do.
     """
+    windows = select_windows(
+        data_trace=data_trace,
+        synthetic_trace=synthetic_trace,
+        stf_trace=stf_trace,
+        event_latitude=event_latitude,
+        event_longitude=event_longitude,
+        event_depth_in_km=event_depth_in_km,
+        station_latitude=station_latitude,
+        station_longitude=station_longitude,
+        minimum_period=minimum_period,
+        maximum_period=maximum_period,
+        # User adjustable parameters.
+        **window_picking_parameters(iteration),
+        **kwargs
+    )
+
+    return windows
+
+
+def window_picking_function_batch(
+    data,
+    synthetics,
+    starttimes,
+    delta,
+    stf_trace,
+    event_latitude,
+    event_longitude,
+    event_depth_in_km,
+    station_latitudes,
+    station_longitudes,
+    minimum_period,
+    maximum_period,
+    iteration,
+    **kwargs
+):  # NOQA
+    """
+    Optional function picking the windows of many pairs of traces with
+    identical sampling at once, e.g. all components of a station. If it
+    exists it is used instead of :func:`window_picking_function` where
+    possible, so both have to pick the same windows. Remove it if you
+    change :func:`window_picking_function` to something else than
+    :func:`~lasif.window_selection.select_windows`.
+
+    This function has to return a list of windows for every pair of
+    traces, as returned by :func:`window_picking_function`.
+
+    :param data: The fully preprocessed data, one trace per row.
+    :type data: :class:`numpy.ndarray`
+    :param synthetics: The fully preprocessed synthetics, one trace per
+        row.
+    :type synthetics: :class:`numpy.ndarray`
+    :param starttimes: The start time of every trace.
+    :type starttimes: list of :class:`obspy.core.utcdatetime.UTCDateTime`
+    :param delta: The sampling interval of all traces in seconds.
+    :type delta: float
+    :param station_latitudes: The station latitude of every trace.
+    :type station_latitudes: list of float
+    :param station_longitudes: The station longitude of every trace.
+    :type station_longitudes: list of float
+
+    All other parameters are those of :func:`window_picking_function`.
+    """
+    return select_windows_batch(
+        data=data,
+        synthetics=synthetics,
+        starttimes=starttimes,
+        delta=delta,
+        stf_trace=stf_trace,
+        event_latitude=event_latitude,
+        event_longitude=event_longitude,
+        event_depth_in_km=event_depth_in_km,
+        station_latitudes=station_latitudes,
+        station_longitudes=station_longitudes,
+        minimum_period=minimum_period,
+        maximum_period=maximum_period,
+        # User adjustable parameters.
+        **window_picking_parameters(iteration),
+        **kwargs
+    )
+
+
+def window_picking_parameters(iteration):
+    """
+    The parameters of the window selection, shared by both window picking
+    functions. Use the iteration to change them between iterations.
+
+    :param iteration: The iteration object.
+    :type iteration: :class:`lasif.iteration-xml.Iteration`
+    """
     # Minimum normalised correlation coefficient of the complete traces.
     MIN_CC = 0.10
 
@@ -129,31 +218,17 @@ def window_picking_function(
     # Windows the whole trace when global criteria on the trace are met.
     WINDOW_EVERYTHING = False
 
-    windows = select_windows(
-        data_trace=data_trace,
-        synthetic_trace=synthetic_trace,
-        stf_trace=stf_trace,
-        event_latitude=event_latitude,
-        event_longitude=event_longitude,
-        event_depth_in_km=event_depth_in_km,
-        station_latitude=station_latitude,
-        station_longitude=station_longitude,
-        minimum_period=minimum_period,
-        maximum_period=maximum_period,
-        # User adjustable parameters.
-        min_cc=MIN_CC,
-        max_noise=MAX_NOISE,
-        max_noise_window=MAX_NOISE_WINDOW,
-        min_velocity=MIN_VELOCITY,
-        threshold_shift=THRESHOLD_SHIFT,
-        threshold_correlation=THRESHOLD_CORRELATION,
-        min_length_period=MIN_LENGTH_PERIOD,
-        min_peaks_troughs=MIN_PEAKS_TROUGHS,
-        max_energy_ratio=MAX_ENERGY_RATIO,
-        global_inversion=GLOBAL_INVERSION,
-        window_everything=WINDOW_EVERYTHING,
-        min_envelope_similarity=MIN_ENVELOPE_SIMILARITY,
-        **kwargs
-    )
-
-    return windows
+    return {
+        "min_cc": MIN_CC,
+        "max_noise": MAX_NOISE,
+        "max_noise_window": MAX_NOISE_WINDOW,
+        "min_velocity": MIN_VELOCITY,
+        "threshold_shift": THRESHOLD_SHIFT,
+        "threshold_correlation": THRESHOLD_CORRELATION,
+        "min_length_period": MIN_LENGTH_PERIOD,
+        "min_peaks_troughs": MIN_PEAKS_TROUGHS,
+        "max_energy_ratio": MAX_ENERGY_RATIO,
+        "global_inversion": GLOBAL_INVERSION,
+        "window_everything": WINDOW_EVERYTHING,
+        "min_envelope_similarity": MIN_ENVELOPE_SIMILARITY,
+    }
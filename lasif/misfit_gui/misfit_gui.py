@@ -236,6 +236,8 @@ class Window(QtWidgets.QMainWindow):
         value = str(value).strip()
         if not value:
             return
+        if self.current_window_manager is not None:
+            self.current_window_manager.close()
         self.current_window_manager = self.comm.windows.get(value)
         self._reset_all_plots()
 
@@ -98,7 +98,8 @@ class WindowLinearRegionItem(pyqtgraph.LinearRegionItem):
         )
 
         process_params = self.comm.project.simulation_settings
-        adj_src = self.comm.project.optimization_settings["misfit_type"]
+        optimization_settings = self.comm.project.optimization_settings
+        adj_src = optimization_settings["misfit_type"]
         window = [(self.start, self.end)]
         calculate_adjoint_source(
             observed=data.data[0],
@@ -111,5 +112,8 @@ class WindowLinearRegionItem(pyqtgraph.LinearRegionItem):
             taper_ratio=0.15,
             taper_type="cosine",
             plot=True,
+            adjoint_source_parameters=optimization_settings.get(
+                "adjoint_source_parameters", {}
+            ),
         )
         plt.show()
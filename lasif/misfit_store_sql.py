@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SQLite based store for the misfits of an iteration.
+
+Every iteration has its own database, so iterations never compete for the
+same file. Within an iteration all writes are done per event in a single
+transaction, which makes them atomic and allows multiple processes to
+write the misfits of different events at the same time.
+
+The misfits can be exported to, and migrated from, the ``misfits.toml``
+layout previously used by LASIF::
+
+    [EVENT_NAME]
+    event_misfit = 1.0
+
+    [EVENT_NAME.stations]
+    "NET.STA" = 1.0
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import sqlite3
+from contextlib import contextmanager
+
+import toml
+
+from lasif.exceptions import LASIFNotFoundError
+
+
+class MisfitStore(object):
+    """
+    Represents the event and station misfits of one iteration.
+
+    :param filename: The SQLite file. It is created on first use.
+    :type filename: str
+    :param timeout: Seconds to wait for a concurrent writer before giving
+        up, defaults to 60
+    :type timeout: float, optional
+    """
+
+    def __init__(self, filename, timeout: float = 60.0):
+        self.filename = filename
+        self.timeout = timeout
+
+    @contextmanager
+    def sqlite_cursor(self, write: bool = False):
+        """
+        Cursor within a single transaction. Write transactions take the
+        write lock right away, so concurrent writers wait for each other
+        instead of failing halfway.
+
+        DB - Design Plan:
+        events - event_name, event_misfit
+        stations - FK_event_name, station_name, misfit
+        """
+        conn = sqlite3.connect(
+            str(self.filename), timeout=self.timeout, isolation_level=None
+        )
+        c = conn.cursor()
+        try:
+            c.execute("PRAGMA foreign_keys = 1")
+            c.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS events (
+                    event_name TEXT PRIMARY KEY,
+                    event_misfit REAL NOT NULL
+                    )
+            """
+            )
+            c.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stations (
+                    event_name TEXT NOT NULL,
+                    station_name TEXT NOT NULL,
+                    misfit REAL NOT NULL,
+                    PRIMARY KEY (event_name, station_name),
+                    FOREIGN KEY (event_name) REFERENCES events(event_name)
+                        ON DELETE CASCADE
+                    )
+            """
+            )
+            yield c
+            c.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                c.execute("ROLLBACK")
+            raise
+        finally:
+            c.close()
+            conn.close()
+
+    def has_event(self, event_name: str):
+        """Check if misfits are stored for the event."""
+        with self.sqlite_cursor() as c:
+            c.execute(
+                "SELECT EXISTS(SELECT 1 FROM events WHERE event_name = ?)",
+                (event_name,),
+            )
+            return bool(c.fetchone()[0])
+
+    def list_events(self):
+        """List the events with stored misfits."""
+        with self.sqlite_cursor() as c:
+            c.execute("SELECT event_name FROM events ORDER BY event_name")
+            return [row[0] for row in c.fetchall()]
+
+    def write_event(
+        self,
+        event_name: str,
+        station_misfits: dict,
+        event_misfit: float = None,
+    ):
+        """
+        Replace all misfits of an event.
+
+        :param event_name: Name of the event
+        :type event_name: str
+        :param station_misfits: Misfit per station, e.g. ``{"NET.STA": 1.0}``
+        :type station_misfits: dict
+        :param event_misfit: Misfit of the event, defaults to the sum of the
+            station misfits
+        :type event_misfit: float, optional
+        """
+        if event_misfit is None:
+            event_misfit = sum(station_misfits.values())
+        with self.sqlite_cursor(write=True) as c:
+            self._write_event(c, event_name, station_misfits, event_misfit)
+
+    def update_stations(self, event_name: str, station_misfits: dict):
+        """
+        Replace the misfits of some stations of an event and keep the
+        misfits of all other stations. The event misfit becomes the sum of
+        the station misfits. The event is added if it is not stored yet.
+
+        :param event_name: Name of the event
+        :type event_name: str
+        :param station_misfits: Misfit per station, e.g. ``{"NET.STA": 1.0}``
+        :type station_misfits: dict
+        :return: The event misfit
+        """
+        with self.sqlite_cursor(write=True) as c:
+            c.execute(
+                "INSERT OR IGNORE INTO events VALUES (?, 0.0)", (event_name,)
+            )
+            c.executemany(
+                "INSERT INTO stations VALUES (?, ?, ?) "
+                "ON CONFLICT (event_name, station_name) "
+                "DO UPDATE SET misfit = excluded.misfit",
+                [
+                    (event_name, station, float(misfit))
+                    for station, misfit in station_misfits.items()
+                ],
+            )
+            c.execute(
+                "UPDATE events SET event_misfit = ("
+                "SELECT TOTAL(misfit) FROM stations WHERE event_name = ?) "
+                "WHERE event_name = ?",
+                (event_name, event_name),
+            )
+            c.execute(
+                "SELECT event_misfit FROM events WHERE event_name = ?",
+                (event_name,),
+            )
+            return c.fetchone()[0]
+
+    @staticmethod
+    def _write_event(c, event_name, station_misfits, event_misfit):
+        c.execute("DELETE FROM events WHERE event_name = ?", (event_name,))
+        c.execute(
+            "INSERT INTO events VALUES (?, ?)",
+            (event_name, float(event_misfit)),
+        )
+        c.executemany(
+            "INSERT INTO stations VALUES (?, ?, ?)",
+            [
+                (event_name, station, float(misfit))
+                for station, misfit in station_misfits.items()
+            ],
+        )
+
+    def apply_station_weights(self, event_name: str, weights: dict):
+        """
+        Multiply the station misfits of an event with weights. The event
+        misfit becomes the sum of the weighted station misfits.
+
+        :param event_name: Name of the event
+        :type event_name: str
+        :param weights: Weight per station, stations that are not given
+            keep their misfit
+        :type weights: dict
+        """
+        with self.sqlite_cursor(write=True) as c:
+            c.execute(
+                "SELECT station_name FROM stations WHERE event_name = ?",
+                (event_name,),
+            )
+            stations = {row[0] for row in c.fetchall()}
+            missing = set(weights) - stations
+            if missing:
+                raise LASIFNotFoundError(
+                    f"No misfit stored for stations {sorted(missing)} of "
+                    f"event {event_name}."
+                )
+            c.executemany(
+                "UPDATE stations SET misfit = misfit * ? "
+                "WHERE event_name = ? AND station_name = ?",
+                [
+                    (float(weight), event_name, station)
+                    for station, weight in weights.items()
+                ],
+            )
+            c.execute(
+                "UPDATE events SET event_misfit = ("
+                "SELECT TOTAL(misfit) FROM stations WHERE event_name = ?) "
+                "WHERE event_name = ?",
+                (event_name, event_name),
+            )
+
+    def get_event(self, event_name: str, include_station_misfit=False):
+        """
+        Get the misfit of an event.
+
+        :param event_name: Name of the event
+        :type event_name: str
+        :param include_station_misfit: Return a dictionary that includes
+            the station misfits, defaults to False
+        :type include_station_misfit: bool, optional
+        :return: The event misfit, or a dictionary with the keys
+            ``event_misfit`` and ``stations`` as in the TOML layout.
+        """
+        with self.sqlite_cursor() as c:
+            c.execute(
+                "SELECT event_misfit FROM events WHERE event_name = ?",
+                (event_name,),
+            )
+            row = c.fetchone()
+            if row is None:
+                raise LASIFNotFoundError(
+                    f"No misfit stored for event {event_name}."
+                )
+            if not include_station_misfit:
+                return row[0]
+            c.execute(
+                "SELECT station_name, misfit FROM stations "
+                "WHERE event_name = ? ORDER BY rowid",
+                (event_name,),
+            )
+            return {"event_misfit": row[0], "stations": dict(c.fetchall())}
+
+    def to_dict(self):
+        """All misfits as a dictionary in the TOML layout."""
+        with self.sqlite_cursor() as c:
+            c.execute("SELECT event_name, event_misfit FROM events")
+            misfits = {
+                event: {"event_misfit": misfit, "stations": {}}
+                for event, misfit in c.fetchall()
+            }
+            c.execute(
+                "SELECT event_name, station_name, misfit FROM stations "
+                "ORDER BY rowid"
+            )
+            for event, station, misfit in c.fetchall():
+                misfits[event]["stations"][station] = misfit
+        return misfits
+
+    def export_toml(self, filename):
+        """
+        Write all misfits to a TOML file in the layout of the previous
+        ``misfits.toml`` files.
+
+        :param filename: The TOML file
+        :type filename: str
+        """
+        misfits = self.to_dict()
+        with open(filename, "w") as fh:
+            toml.dump(misfits, fh)
+
+    def import_toml(self, filename):
+        """
+        Import the misfits of a ``misfits.toml`` file. Events that are
+        already stored are replaced. Entries of the file that are not
+        event misfits are ignored.
+
+        :param filename: The TOML file
+        :type filename: str
+        :return: The names of the imported events
+        """
+        misfits = toml.load(filename)
+        events = [
+            event
+            for event, value in misfits.items()
+            if isinstance(value, dict) and "event_misfit" in value
+        ]
+        with self.sqlite_cursor(write=True) as c:
+            for event in events:
+                self._write_event(
+                    c,
+                    event,
+                    misfits[event].get("stations", {}),
+                    misfits[event]["event_misfit"],
+                )
+        return events
@@ -619,15 +619,54 @@ def lasif_calculate_adjoint_sources(parser, args):
         type=str,
         help="name of station weight set",
     )
+    parser.add_argument(
+        "--misfit_only",
+        action="store_true",
+        help="only calculate the misfits, no adjoint sources are written",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only recompute stations whose data, synthetics, windows or "
+        "misfit settings changed since the last incremental run",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume an interrupted run, completed events and stations are "
+        "not computed again",
+    )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="time the stages of the calculation and write a summary to the "
+        "logs",
+    )
 
     args = parser.parse_args(args)
 
+    if args.misfit_only:
+        misfits = api.calculate_misfits_multiprocessing(
+            lasif_root=".",
+            iteration=args.iteration_name,
+            window_set=args.window_set_name,
+            events=args.events if args.events else None,
+            weight_set=args.weight_set if args.weight_set else None,
+            timing=args.timing,
+        )
+        for event, misfit in misfits.items():
+            print(f"{event}: {misfit}")
+        return
+
     api.calculate_adjoint_sources_multiprocessing(
         lasif_root=".",
         iteration=args.iteration_name,
         window_set=args.window_set_name,
         events=args.events if args.events else None,
         weight_set=args.weight_set if args.weight_set else None,
+        incremental=args.incremental,
+        resume=args.resume,
+        timing=args.timing,
     )
 
 
@@ -648,12 +687,19 @@ def lasif_select_windows(parser, args):
         help="One or more events. If none given, all will be done.",
         nargs="*",
     )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="time the stages of the window selection and write a summary "
+        "to the logs",
+    )
     args = parser.parse_args(args)
-    api.select_windows(
+    api.select_windows_multiprocessing(
         lasif_root=".",
         iteration=args.iteration,
         window_set=args.window_set_name,
         events=args.events if args.events else None,
+        timing=args.timing,
     )
 
 
@@ -808,6 +854,26 @@ def lasif_write_misfit(parser, args):
     )
 
 
+@command_group("Iteration Management")
+def lasif_export_misfits(parser, args):
+    """
+    Export the misfits of an iteration to a toml file.
+    """
+    parser.add_argument("iteration_name", help="name of the iteration")
+    parser.add_argument(
+        "--filename",
+        default=None,
+        type=str,
+        help="output file, defaults to misfits_export.toml in the "
+        "iteration folder",
+    )
+    args = parser.parse_args(args)
+
+    api.export_misfits(
+        lasif_root=".", iteration=args.iteration_name, filename=args.filename
+    )
+
+
 @command_group("Iteration Management")
 def lasif_list_iterations(parser, args):
     """
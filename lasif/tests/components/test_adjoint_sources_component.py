@@ -1,4 +1,5 @@
 import inspect
+import json
 import pathlib
 
 import os
@@ -35,6 +36,20 @@ def comm(tmpdir):
     return project.comm
 
 
+@pytest.fixture()
+def comm_with_events(comm):
+    # The example project does not ship raw data, which is what makes
+    # events known to LASIF. The processed data serves as a stand in.
+    raw_folder = comm.project.paths["eq_data"]
+    os.makedirs(raw_folder, exist_ok=True)
+    for filename in glob.glob(
+        os.path.join(comm.project.paths["preproc_eq_data"], "*", "*.h5")
+    ):
+        event = os.path.basename(os.path.dirname(filename))
+        shutil.copy(filename, os.path.join(raw_folder, event + ".h5"))
+    return comm
+
+
 def test_get_filename(comm):
     event = lasif.api.list_events(comm, output=True)[0]
     name = comm.adj_sources.get_filename(event, "1")
@@ -47,6 +62,56 @@ def test_get_filename(comm):
     assert name == should_be
 
 
+def test_remove_adjoint_sources(comm_with_events):
+    comm = comm_with_events
+    event = lasif.api.list_events(comm, output=True)[0]
+    filenames = [
+        comm.adj_sources.get_filename(event, "1"),
+        comm.adj_sources.get_input_hashes_filename(event, "1"),
+        comm.adj_sources.get_ledger_filename(event, "1"),
+    ]
+    for filename in filenames[1:]:
+        pathlib.Path(filename).touch()
+    # Files which do not exist are skipped.
+    comm.adj_sources.remove_adjoint_sources(event, "1")
+    assert not any(os.path.exists(_i) for _i in filenames)
+
+    for filename in filenames:
+        pathlib.Path(filename).touch()
+    comm.adj_sources.remove_adjoint_sources(event, "1")
+    assert not any(os.path.exists(_i) for _i in filenames)
+
+
+def test_calculate_misfits_for_station_subset(comm_with_events):
+    comm = comm_with_events
+    events = lasif.api.list_events(comm, output=True)
+    iteration = lasif.api.list_iterations(comm, output=True)[0]
+    comm.adj_sources.calculate_misfits_multiprocessing(
+        events, iteration, "A", num_processes=2
+    )
+    expected = comm.adj_sources.get_misfit_for_event(
+        event=events[1], iteration=iteration, include_station_misfit=True
+    )
+    station = list(expected["stations"])[0]
+    # Another station of the event, which is not part of the subset.
+    store = comm.adj_sources.get_misfit_store(iteration)
+    expected["stations"]["XX.OTHER"] = 2.0
+    expected["event_misfit"] += 2.0
+    store.write_event(events[1], expected["stations"])
+    other_event_misfit = store.get_event(events[0])
+
+    comm.adj_sources.calculate_misfits_multiprocessing(
+        [events[1]], iteration, "A", num_processes=2, stations=[station]
+    )
+    misfits = comm.adj_sources.get_misfit_for_event(
+        event=events[1], iteration=iteration, include_station_misfit=True
+    )
+    assert misfits["stations"] == pytest.approx(expected["stations"])
+    assert misfits["event_misfit"] == pytest.approx(expected["event_misfit"])
+    # The other events are not changed.
+    assert store.get_event(events[0]) == other_event_misfit
+
+
 def test_get_misfit_for_event(comm):
     events = lasif.api.list_events(comm, output=True)
     iteration = lasif.api.list_iterations(comm, output=True)[0]
@@ -121,3 +186,155 @@ def test_finalize_adjoint_sources(comm):
     with h5py.File(output) as f:
         src = f["HT_ALN"][()]
     np.testing.assert_array_equal(should_be, src)
+
+
+def test_incremental_adjoint_sources(comm_with_events, capsys):
+    comm = comm_with_events
+    events = comm.events.list(iteration="1")
+
+    def read_adjoint_sources():
+        adjoint_sources = {}
+        for event in events:
+            with h5py.File(comm.adj_sources.get_filename(event, "1")) as f:
+                group = f["AuxiliaryData/AdjointSources"]
+                for station in group:
+                    for channel in group[station]:
+                        dataset = group[station][channel]
+                        adjoint_sources[event, station, channel] = (
+                            dataset[()],
+                            dataset.attrs["misfit"],
+                        )
+        return adjoint_sources
+
+    def calculate(**kwargs):
+        lasif.api.calculate_adjoint_sources_multiprocessing(
+            comm, "1", "A", num_processes=2, **kwargs
+        )
+        misfits = {
+            _e: comm.adj_sources.get_misfit_for_event(_e, "1") for _e in events
+        }
+        return read_adjoint_sources(), misfits
+
+    def assert_same(result, expected):
+        assert result[0].keys() == expected[0].keys()
+        for key, (data, misfit) in result[0].items():
+            np.testing.assert_allclose(data, expected[0][key][0])
+            np.testing.assert_allclose(misfit, expected[0][key][1])
+        for event, misfit in result[1].items():
+            np.testing.assert_allclose(misfit, expected[1][event])
+
+    expected = calculate()
+    assert_same(calculate(incremental=True), expected)
+    hashes_file = comm.adj_sources.get_input_hashes_filename(events[0], "1")
+    assert os.path.exists(hashes_file)
+
+    # Nothing changed, nothing is recomputed.
+    capsys.readouterr()
+    assert_same(calculate(incremental=True), expected)
+    out = capsys.readouterr().out
+    for event in events:
+        assert f"Event {event}: 1 of 1 stations are unchanged" in out
+
+    # Only the station with new windows is recomputed.
+    windows = comm.windows.read_all_windows(events[0], "A")
+    station = sorted(windows)[0]
+    channel = sorted(windows[station])[0]
+    start, end = windows[station][channel][0][:2]
+    window_set = comm.windows.get("A")
+    window_set.del_all_windows_from_event_channel(events[0], channel)
+    window_set.add_window_to_event_channel(
+        events[0], channel, start + 10.0, end - 10.0
+    )
+    result = calculate(incremental=True)
+    out = capsys.readouterr().out
+    assert f"Event {events[0]}: 0 of 1 stations are unchanged" in out
+    assert f"Event {events[1]}: 1 of 1 stations are unchanged" in out
+    assert result[1][events[0]] != expected[1][events[0]]
+    assert_same(result, calculate())
+
+    # A complete calculation removes the hashes.
+    assert not os.path.exists(hashes_file)
+
+
+def test_resume_adjoint_sources(comm_with_events, capsys):
+    comm = comm_with_events
+    events = comm.events.list(iteration="1")
+
+    def calculate(**kwargs):
+        lasif.api.calculate_adjoint_sources_multiprocessing(
+            comm, "1", "A", num_processes=2, **kwargs
+        )
+        adjoint_sources = {}
+        for event in events:
+            with h5py.File(comm.adj_sources.get_filename(event, "1")) as f:
+                group = f["AuxiliaryData/AdjointSources"]
+                for station in group:
+                    for channel in group[station]:
+                        adjoint_sources[event, station, channel] = group[
+                            station
+                        ][channel][()]
+        misfits = {
+            _e: comm.adj_sources.get_misfit_for_event(_e, "1") for _e in events
+        }
+        return adjoint_sources, misfits
+
+    expected = calculate()
+    ledgers = [comm.adj_sources.get_ledger_filename(_e, "1") for _e in events]
+    with open(ledgers[0], "r") as fh:
+        lines = fh.readlines()
+    assert lines[-1].strip() == '{"complete": true}'
+
+    # The run stopped after writing the station of the first event and
+    # while writing the second event.
+    with open(ledgers[0], "w") as fh:
+        fh.writelines(lines[:-1])
+    with open(ledgers[1], "w") as fh:
+        fh.write('{"station": "')
+
+    capsys.readouterr()
+    result = calculate(resume=True)
+    out = capsys.readouterr().out
+    assert f"Event {events[0]}: resuming with 1 of 1 stations" in out
+    assert f"Event {events[1]}: resuming with 0 of 1 stations" in out
+    assert result[0].keys() == expected[0].keys()
+    for key, data in result[0].items():
+        np.testing.assert_allclose(data, expected[0][key])
+    for event, misfit in result[1].items():
+        np.testing.assert_allclose(misfit, expected[1][event])
+
+    # Both events are complete now.
+    calculate(resume=True)
+    out = capsys.readouterr().out
+    for event in events:
+        assert f"Event {event} has been completed before" in out
+
+
+def test_adjoint_sources_timing(comm_with_events, capsys):
+    comm = comm_with_events
+    lasif.api.calculate_adjoint_sources_multiprocessing(
+        comm, "1", "A", num_processes=2, timing=True
+    )
+    assert "Timing summary written to" in capsys.readouterr().out
+    filenames = glob.glob(
+        os.path.join(comm.project.paths["logs"], "TIMING", "*.json")
+    )
+    assert len(filenames) == 1
+    with open(filenames[0], "r") as fh:
+        summary = json.load(fh)
+    # The adjoint sources are only computed for the stations with windows
+    # and only their synthetics are processed for the cache.
+    assert summary["stages"]["misfit"]["tasks"] == 2
+    assert summary["stages"]["process_synthetics"]["tasks"] == 2
+    assert summary["tasks"] == 4
+    for name in [
+        "read_raw_synthetics",
+        "process_synthetics",
+        "read_observed",
+        "read_synthetics",
+        "interpolate",
+        "misfit",
+        "write_adjoint_sources",
+        "finalize_adjoint_sources",
+    ]:
+        assert summary["stages"][name]["calls"] > 0
+    assert summary["stages"]["read_observed"]["bytes_read"] > 0
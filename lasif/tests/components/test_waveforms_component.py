@@ -4,10 +4,14 @@ from __future__ import absolute_import
 
 import inspect
 import os
+import pathlib
 import pytest
 import shutil
+from unittest import mock
 
 from lasif.components.project import Project
+from lasif.components.waveforms import WaveformsComponent
+from lasif.tools.processed_synthetics_cache import compute_cache_key
 
 
 @pytest.fixture()
@@ -25,6 +29,121 @@ def comm(tmpdir):
     shutil.copytree(proj_dir, os.path.join(tmpdir, "proj"))
     proj_dir = os.path.join(tmpdir, "proj")
 
-    project = Project(project_root_path=proj_dir, init_project=False)
+    folder_path = pathlib.Path(proj_dir).absolute()
+    project = Project(project_root_path=folder_path, init_project=False)
 
     return project.comm
+
+
+def test_processed_synthetics_cache(comm, capsys):
+    import glob
+    import numpy as np
+    import pyasdf
+
+    # The example project does not ship raw data, which is what makes
+    # events known to LASIF. The processed data serves as a stand in.
+    raw_folder = comm.project.paths["eq_data"]
+    os.makedirs(raw_folder, exist_ok=True)
+    for filename in glob.glob(
+        os.path.join(comm.project.paths["preproc_eq_data"], "*", "*.h5")
+    ):
+        event = os.path.basename(os.path.dirname(filename))
+        shutil.copy(filename, os.path.join(raw_folder, event + ".h5"))
+
+    event = comm.events.list()[0]
+    cache = comm.waveforms.get_processed_synthetics_cache(event, "1")
+    assert not cache.is_valid()
+    # Without a cache the synthetics are processed on the fly. The cache
+    # key is only computed for the first station.
+    raw_filename = comm.waveforms.get_asdf_filename(event, "synthetic", "1")
+    with pyasdf.ASDFDataSet(raw_filename, mode="r") as ds:
+        stations = ds.waveforms.list()
+    assert len(stations) > 2
+    with mock.patch(
+        "lasif.components.waveforms.compute_cache_key",
+        wraps=compute_cache_key,
+    ) as patch:
+        for station in stations[:2]:
+            comm.waveforms.get_waveforms_synthetic(
+                event, station, "ITERATION_1"
+            )
+    assert patch.call_count == 1
+
+    # Only the stations which are needed are processed, the cache is
+    # extended with the others later on.
+    capsys.readouterr()
+    cache = comm.waveforms.build_processed_synthetics_cache(
+        event, "1", num_processes=2, stations=stations[:1]
+    )
+    assert cache.is_valid()
+    with cache.open() as reader:
+        assert reader.list() == stations[:1]
+    cache = comm.waveforms.build_processed_synthetics_cache(
+        event, "1", num_processes=2
+    )
+    assert cache.is_valid()
+    with cache.open() as reader:
+        assert sorted(reader.list()) == sorted(stations)
+    cache = comm.waveforms.build_processed_synthetics_cache(
+        event, "1", num_processes=2, stations=stations[:2]
+    )
+    out = capsys.readouterr().out
+    assert "Processing the synthetics of 1 stations" in out
+    assert f"Processing the synthetics of {len(stations) - 1} stations" in out
+    assert out.count("Processing the synthetics") == 2
+
+    # Once it is built, the cache is used, again with a
+    # single cache key for all stations.
+    with mock.patch(
+        "lasif.components.waveforms.compute_cache_key",
+        wraps=compute_cache_key,
+    ) as patch, mock.patch(
+        "lasif.components.waveforms.WaveformsComponent._get_waveforms"
+    ) as raw_patch:
+        for station in stations:
+            comm.waveforms.get_waveforms_synthetic(
+                event, station, "ITERATION_1"
+            )
+    assert patch.call_count == 1
+    assert raw_patch.call_count == 0
+
+    for station in stations:
+        with pyasdf.ASDFDataSet(
+            comm.waveforms.get_asdf_filename(event, "synthetic", "1"),
+            mode="r",
+        ) as ds:
+            raw = ds.waveforms[station].displacement
+        expected = comm.waveforms.process_synthetics(raw, event, "1")
+        st = comm.waveforms.get_waveforms_synthetic(
+            event, station, "ITERATION_1"
+        )
+        assert [tr.id for tr in st] == [tr.id for tr in expected]
+        for tr, tr_expected in zip(st, expected):
+            assert tr.stats.starttime == tr_expected.stats.starttime
+            assert tr.stats.delta == tr_expected.stats.delta
+            np.testing.assert_array_equal(tr.data, tr_expected.data)
+
+    # Replacing the raw synthetics makes the cache stale, which is noticed
+    # without building the cache again.
+    stat = os.stat(raw_filename)
+    os.utime(raw_filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    with mock.patch.object(
+        WaveformsComponent,
+        "_get_waveforms",
+        autospec=True,
+        side_effect=WaveformsComponent._get_waveforms,
+    ) as raw_patch:
+        comm.waveforms.get_waveforms_synthetic(
+            event, stations[0], "ITERATION_1"
+        )
+    assert raw_patch.call_count == 1
+
+    # Changing the processing function invalidates the cache.
+    with open(
+        os.path.join(comm.project.paths["functions"], "process_synthetics.py"),
+        "a",
+    ) as fh:
+        fh.write("\n# Changed.\n")
+    assert not comm.waveforms.get_processed_synthetics_cache(
+        event, "1"
+    ).is_valid()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the streaming adjoint source writer.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+import threading
+
+import h5py
+import numpy as np
+import pytest
+
+from lasif.exceptions import LASIFError
+from lasif.tools.adjoint_source_writer import (
+    AdjointSourceWriter,
+    BackPressure,
+    mark_ledger_complete,
+    read_ledger,
+)
+
+
+def _station(misfit):
+    return {
+        f"XX.{_s}.00.BH{_c}": {
+            "adj_source": np.arange(10.0) * misfit,
+            "misfit": misfit,
+        }
+        for _s, _c in [("A", "Z"), ("A", "N")]
+    }
+
+
+def test_adjoint_source_writer(tmpdir):
+    filename = os.path.join(str(tmpdir), "adjoint_source_auxiliary.h5")
+    ledger = os.path.join(str(tmpdir), "adjoint_source_ledger.jsonl")
+
+    with AdjointSourceWriter(filename, ledger, buffer_size=2) as writer:
+        writer.add("XX.A", _station(1.5))
+        # Nothing is written before the buffer is full.
+        assert not os.path.exists(filename)
+        assert read_ledger(ledger) == ({}, False)
+        writer.add("XX.B", {})
+        assert read_ledger(ledger) == ({"XX.A": 3.0, "XX.B": None}, False)
+        with h5py.File(filename, "r") as f:
+            group = f["AuxiliaryData/AdjointSources/XX_A"]
+            assert sorted(group) == ["Channel_00_BHN", "Channel_00_BHZ"]
+            np.testing.assert_array_equal(
+                group["Channel_00_BHZ"][()], np.arange(10.0) * 1.5
+            )
+        writer.add("XX.C", {"XX.C.00.BHZ": _station(0.5)["XX.A.00.BHZ"]})
+    with pytest.raises(LASIFError):
+        writer.add("XX.D", {})
+    assert writer.adjoint_sources_written == 3
+    assert writer.total_misfit == 3.5
+
+    mark_ledger_complete(ledger)
+    # Lines cut off by an interruption are ignored.
+    with open(ledger, "a") as fh:
+        fh.write('{"station": "XX.D", "mis')
+    assert read_ledger(ledger) == (
+        {"XX.A": 3.0, "XX.B": None, "XX.C": 0.5},
+        True,
+    )
+
+    # Only the reused stations are kept and the ledger is started anew.
+    writer = AdjointSourceWriter(filename, ledger, reused={"XX.C": 0.5})
+    assert read_ledger(ledger) == ({"XX.C": 0.5}, False)
+    with h5py.File(filename, "r") as f:
+        assert list(f["AuxiliaryData/AdjointSources"]) == ["XX_C"]
+    writer.add("XX.A", _station(2.0))
+    writer.close()
+    assert writer.station_misfits == {"XX.C": 0.5, "XX.A": 4.0}
+    assert writer.total_misfit == 4.5
+
+
+def test_back_pressure():
+    feed = BackPressure(range(10), max_pending=3)
+    fed = []
+
+    def consume():
+        for task in feed:
+            fed.append(task)
+
+    thread = threading.Thread(target=consume)
+    thread.start()
+    thread.join(timeout=0.5)
+    # The feed blocks until results are acknowledged.
+    assert thread.is_alive()
+    assert fed == [0, 1, 2]
+    feed.done()
+    feed.done()
+    thread.join(timeout=0.5)
+    assert fed == [0, 1, 2, 3, 4]
+
+    # Stopping unblocks the feed.
+    feed.stop()
+    thread.join(timeout=5.0)
+    assert not thread.is_alive()
+    assert fed == [0, 1, 2, 3, 4]
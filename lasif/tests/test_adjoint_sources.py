@@ -13,12 +13,18 @@ import inspect
 import numpy as np
 import os
 
-# import obspy
+import obspy
+from unittest import mock
 from scipy.io import loadmat
 
 from lasif.tools.adjoint import utils, time_frequency
+from lasif.tools.adjoint.adjoint_source import (
+    calculate_adjoint_source,
+    calculate_adjoint_source_array,
+    calculate_adjoint_source_batch,
+)
 
-# from lasif.tools.adjoint.adjoint_source_types import tf_phase_misfit
+from lasif.tools.adjoint.adjoint_source_types import tf_phase_misfit
 
 from .testing_helpers import reset_matplotlib
 
@@ -126,6 +132,325 @@ def test_time_frequency_transform():
     # np.testing.assert_allclose(np.angle(tfs), np.angle(tfs_matlab))
 
 
+def test_time_frequency_transform_matches_loop():
+    """
+    The batched transform must reproduce the loop over all time shifts.
+    """
+    t, u = utils.get_dispersed_wavetrain(dt=2.0)
+    for threshold in [1e-2, 0.5, 2.0]:
+        _, nu, tfs = time_frequency.time_frequency_transform(
+            t=t, s=u, width=10.0, threshold=threshold
+        )
+        _, nu_ref, tfs_ref = time_frequency._time_frequency_transform_loop(
+            t=t, s=u, width=10.0, threshold=threshold
+        )
+        np.testing.assert_allclose(nu, nu_ref)
+        np.testing.assert_allclose(tfs, tfs_ref, rtol=1e-12, atol=1e-14)
+
+    # Multi-threaded FFT and small blocks give the same result.
+    _, _, tfs = time_frequency.time_frequency_transform(
+        t=t, s=u, width=10.0, workers=2, block_size=7
+    )
+    _, _, tfs_ref = time_frequency._time_frequency_transform_loop(
+        t=t, s=u, width=10.0
+    )
+    np.testing.assert_allclose(tfs, tfs_ref, rtol=1e-12, atol=1e-14)
+
+
+def test_time_frequency_cc_difference_matches_loop():
+    """
+    The spectral cross correlation must reproduce the loop over all time
+    shifts.
+    """
+    t, u = utils.get_dispersed_wavetrain(dt=2.0)
+    t, u0 = utils.get_dispersed_wavetrain(
+        dt=2.0,
+        a=3.91,
+        b=0.87,
+        c=0.8,
+        body_wave_factor=0.015,
+        body_wave_freq_scale=1.0 / 2.2,
+    )
+    tau, nu, tfs = time_frequency.time_frequency_cc_difference(
+        t, u, u0, width=10.0, block_size=50
+    )
+    ref = time_frequency._time_frequency_cc_difference_loop(
+        t, u, u0, width=10.0
+    )
+    np.testing.assert_allclose(tau, ref[0])
+    np.testing.assert_allclose(nu, ref[1])
+    np.testing.assert_allclose(
+        tfs, ref[2], rtol=0, atol=np.abs(ref[2]).max() * 1e-12
+    )
+
+
+def test_itfa_matches_loop():
+    """
+    The batched inverse transform must reproduce the loops over all time
+    shifts.
+    """
+    t, u = utils.get_dispersed_wavetrain(dt=2.0)
+    _, _, tfs = time_frequency.time_frequency_transform(t, u, width=10.0)
+    for threshold in [1e-2, 0.3]:
+        s, tau, I = time_frequency.itfa(
+            t, tfs, width=10.0, threshold=threshold, block_size=64
+        )
+        s_ref, tau_ref, I_ref = time_frequency._itfa_loop(
+            t, tfs, width=10.0, threshold=threshold
+        )
+        np.testing.assert_allclose(tau, tau_ref)
+        np.testing.assert_allclose(
+            I, I_ref, rtol=0, atol=np.abs(I_ref).max() * 1e-12
+        )
+        np.testing.assert_allclose(
+            s, s_ref, rtol=0, atol=np.abs(s_ref).max() * 1e-12
+        )
+
+
+def test_frequency_truncated_transforms():
+    """
+    Truncated transforms return the leading frequencies of the full ones.
+    """
+    t, u = utils.get_dispersed_wavetrain(dt=2.0)
+    u0 = np.roll(u, 5)
+    _, nu, tfs = time_frequency.time_frequency_transform(t, u, width=10.0)
+    _, _, tf_cc = time_frequency.time_frequency_cc_difference(
+        t, u, u0, width=10.0
+    )
+
+    for dtype, rtol in [("complex128", 1e-12), ("complex64", 1e-5)]:
+        _, nu_k, tfs_k = time_frequency.time_frequency_transform(
+            t, u, width=10.0, n_freqs=100, dtype=dtype
+        )
+        _, _, tf_cc_k = time_frequency.time_frequency_cc_difference(
+            t, u, u0, width=10.0, n_freqs=100, dtype=dtype
+        )
+        assert tfs_k.shape == tf_cc_k.shape == (len(t), 100)
+        assert tfs_k.dtype == tf_cc_k.dtype == np.dtype(dtype)
+        np.testing.assert_allclose(nu_k, nu[:100])
+        np.testing.assert_allclose(
+            tfs_k, tfs[:, :100], rtol=0, atol=np.abs(tfs).max() * rtol
+        )
+        np.testing.assert_allclose(
+            tf_cc_k, tf_cc[:, :100], rtol=0, atol=np.abs(tf_cc).max() * rtol
+        )
+
+    # The missing frequencies are zero for the inverse transform.
+    padded = np.zeros_like(tfs)
+    padded[:, :100] = tfs[:, :100]
+    s, _, I = time_frequency.itfa(t, tfs[:, :100], 10.0, return_inverse=False)
+    s_ref, _, _ = time_frequency.itfa(t, padded, 10.0)
+    assert I is None
+    np.testing.assert_allclose(
+        s, s_ref, rtol=0, atol=np.abs(s_ref).max() * 1e-12
+    )
+
+
+def test_tf_phase_misfit_frequency_cutoff():
+    """
+    Only computing frequencies that are not suppressed by the weighting
+    barely changes the misfit and the adjoint source.
+    """
+    obs, syn = obspy.read(os.path.join(data_dir, "adj_src_test.mseed"))
+    ref = tf_phase_misfit.calculate_adjoint_source(
+        obs, syn, None, min_period=20.0, max_period=100.0, adjoint_src=True
+    )
+    for single_precision, rtol in [(False, 1e-8), (True, 1e-5)]:
+        new = tf_phase_misfit.calculate_adjoint_source(
+            obs,
+            syn,
+            None,
+            min_period=20.0,
+            max_period=100.0,
+            adjoint_src=True,
+            frequency_cutoff=2.0,
+            single_precision=single_precision,
+        )
+        np.testing.assert_allclose(new["misfit"], ref["misfit"], rtol=rtol)
+        np.testing.assert_allclose(
+            new["adjoint_source"].data,
+            ref["adjoint_source"].data,
+            rtol=0,
+            atol=np.abs(ref["adjoint_source"].data).max() * rtol,
+        )
+
+
+def test_hilbert_transform():
+    """
+    Same as scipy's Hilbert transform, also for lengths that are not fast
+    FFT lengths.
+    """
+    from scipy.signal import hilbert
+
+    rng = np.random.RandomState(12345)
+    for npts in [1, 2, 7, 602, 3600, 3601]:
+        data = rng.randn(3, npts)
+        ref = hilbert(data, axis=-1).imag
+        np.testing.assert_allclose(
+            utils.hilbert_transform(data), ref, rtol=1e-10, atol=1e-12
+        )
+        np.testing.assert_allclose(
+            utils.hilbert_transform(data[0]), ref[0], rtol=1e-10, atol=1e-12
+        )
+
+    # The envelope misfit of a tapered window of 3601 samples.
+    obs, syn = obspy.read(os.path.join(data_dir, "adj_src_test.mseed"))
+    for tr in [obs, syn]:
+        tr.data = np.tile(tr.data, 6)[:3601]
+    syn.stats.channel = obs.stats.channel
+    start = obs.stats.starttime
+    windows = [(start + 1000.3, start + 1650.7)]
+    new = calculate_adjoint_source(
+        "envelope_misfit",
+        obs,
+        syn,
+        windows,
+        min_period=20.0,
+        max_period=100.0,
+    )
+    with mock.patch(
+        "lasif.tools.adjoint.adjoint_source_types.envelope_misfit."
+        "hilbert_transform",
+        lambda data: hilbert(data, axis=-1).imag,
+    ):
+        ref = calculate_adjoint_source(
+            "envelope_misfit",
+            obs,
+            syn,
+            windows,
+            min_period=20.0,
+            max_period=100.0,
+        )
+    np.testing.assert_allclose(new.misfit, ref.misfit, rtol=1e-12)
+    np.testing.assert_allclose(
+        new.adjoint_source.data,
+        ref.adjoint_source.data,
+        rtol=0,
+        atol=np.abs(ref.adjoint_source.data).max() * 1e-12,
+    )
+
+
+def test_lanczos_resample_matches_obspy():
+    """
+    The cached resampling operators give the same results as obspy.
+    """
+    from obspy.signal.interpolation import lanczos_interpolation
+
+    rng = np.random.RandomState(12345)
+    for npts, dt, dt_new, new_npts, new_start in [
+        (3600, 1.0, 5.0, 720, 0.0),
+        (3601, 0.5, 3.0, 601, 0.0),
+        (1100, 5.0, 1.0, 5000, 0.0),
+        (500, 2.0, 2.0, 400, 10.0),
+        (10, 1.0, 0.3, 30, 0.0),
+    ]:
+        data = rng.randn(npts)
+        ref = lanczos_interpolation(
+            data, 0.0, dt, new_start, dt_new, new_npts, a=8
+        )
+        new = utils.lanczos_resample(
+            data, 0.0, dt, new_start, dt_new, new_npts, a=8
+        )
+        np.testing.assert_allclose(new, ref, rtol=1e-12, atol=1e-13)
+
+        # Several traces at once, sharing the cached operator.
+        info = utils.get_lanczos_operator.cache_info()
+        stacked = utils.lanczos_resample(
+            np.stack([data, 2.0 * data], axis=-1),
+            0.0,
+            dt,
+            new_start,
+            dt_new,
+            new_npts,
+            a=8,
+        )
+        assert utils.get_lanczos_operator.cache_info().hits == info.hits + 1
+        np.testing.assert_allclose(stacked[:, 0], new)
+        np.testing.assert_allclose(stacked[:, 1], 2.0 * new)
+
+
+def test_window_array_matches_window_trace():
+    """
+    Windowing arrays with index slices and cached tapers gives the same as
+    windowing traces.
+    """
+    tr = obspy.read(os.path.join(data_dir, "adj_src_test.mseed"))[0]
+    tr.data = np.require(tr.data, dtype=np.float64)
+    start = tr.stats.starttime
+    for window in [
+        (start + 100.3, start + 250.7),
+        (start - 20.0, start + 80.0),
+        (start + 500.5, start + 900.0),
+        (start + 10.0, start + 11.0),
+    ]:
+        for taper in [True, False]:
+            ref = utils.window_trace(
+                tr.copy(), window, taper, 0.15, "cosine"
+            ).data
+            win_slice = utils.window_slice(tr.stats, window)
+            win_taper = None
+            if taper:
+                win_taper = utils.get_taper(
+                    win_slice[1] - win_slice[0], 0.15, "cosine"
+                )
+            new = utils.window_array(tr.data, win_slice, win_taper)
+            np.testing.assert_array_equal(new, ref)
+
+            # In place.
+            data = tr.data.copy()
+            utils.window_array(data, win_slice, win_taper, out=data)
+            np.testing.assert_array_equal(data, ref)
+
+
+def test_calculate_adjoint_source_array_matches_traces():
+    """
+    The array version gives the same misfits and adjoint sources as the
+    trace based one for all adjoint source types.
+    """
+    obs, syn = obspy.read(os.path.join(data_dir, "adj_src_test.mseed"))
+    syn.stats.channel = obs.stats.channel
+    start = obs.stats.starttime
+    windows = [
+        (start + 100.3, start + 250.7),
+        (start + 300.0, start + 420.0, 0.5),
+    ]
+    for adj_src_type in [
+        "waveform_misfit",
+        "cc_traveltime_misfit",
+        "tf_phase_misfit",
+        "envelope_misfit",
+    ]:
+        for envelope_scaling in [False, True]:
+            ref = calculate_adjoint_source(
+                adj_src_type,
+                obs,
+                syn,
+                windows,
+                min_period=20.0,
+                max_period=100.0,
+                envelope_scaling=envelope_scaling,
+            )
+            observed = obs.data.copy()
+            new = calculate_adjoint_source_array(
+                adj_src_type,
+                observed,
+                syn.data,
+                obs.stats,
+                windows,
+                min_period=20.0,
+                max_period=100.0,
+                synthetic_stats=syn.stats,
+                envelope_scaling=envelope_scaling,
+            )
+            assert new.misfit == ref.misfit
+            assert new.individual_misfits == ref.individual_misfits
+            np.testing.assert_array_equal(
+                new.adjoint_source, ref.adjoint_source.data
+            )
+            # The input is not modified.
+            np.testing.assert_array_equal(observed, obs.data)
+
+
 # def test_adjoint_time_frequency_phase_misfit_source_plot(tmpdir):
 #     """
 #     Tests the plot for a time-frequency misfit adjoint source.
@@ -151,3 +476,72 @@ def test_time_frequency_transform():
 #     # or the waveforms would induce changes all over the plot which would
 #     # make the rms error much larger.
 #     images_are_identical("tf_adjoint_source", str(tmpdir), tol=35)
+
+
+def test_calculate_adjoint_source_batch_matches_array():
+    """
+    The batched version gives the same misfits and adjoint sources as the
+    array version, also for traces of different lengths.
+    """
+    obs, syn = obspy.read(os.path.join(data_dir, "adj_src_test.mseed"))
+    syn.stats.channel = obs.stats.channel
+    start = obs.stats.starttime
+    obs.data = np.require(obs.data, dtype=np.float64)
+    syn.data = np.require(syn.data, dtype=np.float64)
+    short_obs = obs.copy().trim(endtime=start + 600.0)
+    short_syn = syn.copy().trim(endtime=start + 600.0)
+    traces = [(obs, syn), (short_obs, short_syn), (syn, obs)]
+    windows = [
+        [(start + 100.3, start + 250.7), (start + 300.0, start + 420.0, 0.5)],
+        [(start + 450.0, start + 610.0)],
+        [(start + 50.0, start + 200.0, 2.0), (start + 10.0, start + 15.0)],
+    ]
+    for adj_src_type in [
+        "waveform_misfit",
+        "cc_traveltime_misfit",
+        "tf_phase_misfit",
+        "envelope_misfit",
+    ]:
+        for envelope_scaling in [False, True]:
+            for adjoint_src in [True, False]:
+                kwargs = dict(
+                    min_period=20.0,
+                    max_period=100.0,
+                    envelope_scaling=envelope_scaling,
+                    adjoint_src=adjoint_src,
+                )
+                new = calculate_adjoint_source_batch(
+                    adj_src_type,
+                    [_t[0].data for _t in traces],
+                    [_t[1].data for _t in traces],
+                    [_t[0].stats for _t in traces],
+                    windows,
+                    synthetic_stats=[_t[1].stats for _t in traces],
+                    **kwargs,
+                )
+                assert len(new) == len(traces)
+                for (o, s), win, asrc in zip(traces, windows, new):
+                    ref = calculate_adjoint_source_array(
+                        adj_src_type,
+                        o.data,
+                        s.data,
+                        o.stats,
+                        win,
+                        synthetic_stats=s.stats,
+                        **kwargs,
+                    )
+                    np.testing.assert_allclose(
+                        asrc.misfit, ref.misfit, rtol=1e-12
+                    )
+                    assert len(asrc.individual_misfits) == len(
+                        ref.individual_misfits
+                    )
+                    if adjoint_src:
+                        np.testing.assert_allclose(
+                            asrc.adjoint_source,
+                            ref.adjoint_source,
+                            rtol=1e-10,
+                            atol=1e-14 * np.abs(ref.adjoint_source).max(),
+                        )
+                    else:
+                        assert asrc.adjoint_source is None
@@ -236,16 +236,85 @@ def test_list_events(comm):
 def test_calculate_adjoint_sources(comm):
     adjoints = "lasif.components.adjoint_sources.AdjointSourcesComponent."
     it = lasif.api.list_iterations(comm, output=True)[0]
-    events = lasif.api.list_events(comm, output=True)
-    with mock.patch(adjoints + "calculate_adjoint_sources_multiprocessing") as patch:
-        with mock.patch(adjoints + "finalize_adjoint_sources") as patch_2:
-            lasif.api.calculate_adjoint_sources_multiprocessing(comm, it, "A")
-    patch.assure_called_once_with(events[0], it, "A")
-    patch.assure_called_once_with(events[1], it, "A")
-    patch_2.assure_called_once_with(it, events[0], "A")
-    patch_2.assure_called_once_with(it, events[1], "A")
-    assert patch.call_count == len(events)
-    assert patch_2.call_count == len(events)
+    events = comm.events.list(iteration=it)
+    assert len(events) > 1
+    has_event = mock.patch(
+        "lasif.components.events.EventsComponent.has_event", return_value=True
+    )
+    with has_event, mock.patch(
+        adjoints + "calculate_adjoint_sources_for_events"
+    ) as patch:
+        lasif.api.calculate_adjoint_sources_multiprocessing(comm, it, "A")
+    patch.assert_called_once_with(events, it, "A", 16, weight_set_name=None)
+
+    with has_event, mock.patch(
+        adjoints + "calculate_adjoint_sources_multiprocessing"
+    ) as patch_2:
+        with mock.patch(adjoints + "finalize_adjoint_sources") as patch_3:
+            lasif.api.calculate_adjoint_sources_multiprocessing(
+                comm, it, "A", events=events[0]
+            )
+    patch_2.assert_called_once_with(events[0], it, "A", 16)
+    patch_3.assert_called_once_with(it, events[0], None)
+
+
+def test_calculate_adjoint_sources_incremental(comm):
+    adjoints = "lasif.components.adjoint_sources.AdjointSourcesComponent."
+    it = lasif.api.list_iterations(comm, output=True)[0]
+    events = comm.events.list(iteration=it)
+    filename = comm.adj_sources.get_filename(events[0], it)
+    with open(filename, "w"):
+        pass
+    with mock.patch(
+        "lasif.components.events.EventsComponent.has_event", return_value=True
+    ), mock.patch(adjoints + "calculate_adjoint_sources_for_events") as patch:
+        lasif.api.calculate_adjoint_sources_multiprocessing(
+            comm, it, "A", events=events[0], incremental=True
+        )
+    patch.assert_called_once_with(
+        [events[0]], it, "A", 16, weight_set_name=None, incremental=True,
+        resume=False,
+    )
+    # The existing adjoint sources are kept.
+    assert os.path.exists(filename)
+
+
+def test_calculate_misfits(comm):
+    adjoints = "lasif.components.adjoint_sources.AdjointSourcesComponent."
+    it = lasif.api.list_iterations(comm, output=True)[0]
+    events = comm.events.list(iteration=it)
+    with mock.patch(
+        "lasif.components.events.EventsComponent.has_event", return_value=True
+    ), mock.patch(adjoints + "calculate_misfits_multiprocessing") as patch:
+        lasif.api.calculate_misfits_multiprocessing(
+            comm, it, "A", events=events[0], stations="YD.4F14"
+        )
+    patch.assert_called_once_with(
+        [events[0]], it, "A", 16, weight_set_name=None, stations=["YD.4F14"]
+    )
+
+
+def test_calculate_validation_and_adjoint_sources(comm):
+    adjoints = "lasif.components.adjoint_sources.AdjointSourcesComponent."
+    it = lasif.api.list_iterations(comm, output=True)[0]
+    events = comm.events.list(iteration=it)
+    with mock.patch(
+        "lasif.components.events.EventsComponent.has_event", return_value=True
+    ), mock.patch(
+        adjoints + "calculate_validation_and_adjoint_sources"
+    ) as patch:
+        lasif.api.calculate_validation_and_adjoint_sources(
+            comm, it, "A", events=events, reference_iteration="2"
+        )
+    patch.assert_called_once_with(
+        events,
+        it,
+        "A",
+        16,
+        weight_set_name=None,
+        reference_iteration="2",
+        min_sn_ratio=0.1,
+    )
 
 
 def test_select_windows(comm):
@@ -392,6 +461,25 @@ def test_compare_misfits(comm, capsys):
     assert "22.04%" in captured.out
 
 
+def test_export_misfits(comm):
+    it = lasif.api.list_iterations(comm, output=True)[0]
+    filename = lasif.api.export_misfits(comm, it)
+    assert os.path.basename(filename) == "misfits_export.toml"
+    assert "event_misfit" in list(toml.load(filename).values())[0]
+
+    # The misfit summary is not overwritten by later exports.
+    with mock.patch(
+        "lasif.components.adjoint_sources.AdjointSourcesComponent."
+        "get_misfit_for_event",
+        return_value=2.0,
+    ):
+        total_misfit = lasif.api.write_misfit(comm, it)
+        lasif.api.export_misfits(comm, it)
+        assert lasif.api.write_misfit(
+            comm, it, events=["event_a"]
+        ) == pytest.approx(total_misfit + 2.0)
+
+
 def test_create_weight_set(comm):
     with mock.patch(
         "lasif.components.weights.WeightsComponent.create_new_weight_set"
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the per-worker ASDF handle pool.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import glob
+import inspect
+import multiprocessing
+import os
+
+import pytest
+
+from lasif.exceptions import LASIFError
+from lasif.tools import asdf_handle_pool
+from lasif.tools.stage_timing import StageTimer
+
+processed_files = sorted(
+    glob.glob(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(inspect.getfile(inspect.currentframe()))
+            ),
+            "data",
+            "example_project",
+            "PROCESSED_DATA",
+            "EARTHQUAKES",
+            "*",
+            "*.h5",
+        )
+    )
+)
+
+
+def _list_stations(_):
+    ds = asdf_handle_pool.get_worker_dataset("processed")
+    return ds.waveforms.list()
+
+
+def test_handles_are_reused():
+    opens_saved = multiprocessing.Value("i", 0)
+    asdf_handle_pool.init_worker_datasets(
+        {"processed": processed_files[0], "synthetic": None}, opens_saved
+    )
+    try:
+        ds = asdf_handle_pool.get_worker_dataset("processed")
+        assert asdf_handle_pool.get_worker_dataset("processed") is ds
+        assert asdf_handle_pool.get_worker_dataset("processed") is ds
+        assert opens_saved.value == 2
+
+        # Reused handles are counted in the timing summary.
+        with StageTimer() as timer:
+            asdf_handle_pool.get_worker_dataset("processed")
+        assert timer.summary()["stages"]["reuse_open_file"]["calls"] == 1
+
+        # Keys with no filename are not registered.
+        with pytest.raises(LASIFError):
+            asdf_handle_pool.get_worker_dataset("synthetic")
+    finally:
+        asdf_handle_pool.close_worker_datasets()
+    assert asdf_handle_pool._datasets == {}
+
+
+def test_handles_in_pool():
+    opens_saved = multiprocessing.Value("i", 0)
+    with multiprocessing.Pool(
+        2,
+        initializer=asdf_handle_pool.init_worker_datasets,
+        initargs=({"processed": processed_files[0]}, opens_saved),
+    ) as pool:
+        results = pool.map(_list_stations, range(10), chunksize=1)
+        pool.close()
+        pool.join()
+
+    assert all(_i == results[0] for _i in results)
+    # At most one open per worker, every other task reused a handle.
+    assert opens_saved.value >= 8
+
+
+def test_max_open_handles():
+    filenames = {f"file_{_i}": _f for _i, _f in enumerate(processed_files)}
+    asdf_handle_pool.init_worker_datasets(filenames, max_open=1)
+    try:
+        first = asdf_handle_pool.get_worker_dataset("file_0")
+        assert asdf_handle_pool.get_worker_dataset("file_0") is first
+        asdf_handle_pool.get_worker_dataset("file_1")
+        # The least recently used file has been closed.
+        assert list(asdf_handle_pool._datasets) == ["file_1"]
+        assert asdf_handle_pool.get_worker_dataset("file_0") is not first
+    finally:
+        asdf_handle_pool.close_worker_datasets()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the batched HDF5 dataset writer.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from lasif.exceptions import LASIFError
+from lasif.tools.batch_h5_writer import BatchH5Writer
+
+
+def test_batch_writer_matches_h5py(tmpdir):
+    attributes = {
+        "dt": 0.1,
+        "sampling_rate_in_hertz": 1 / np.asarray(0.1),
+        "spatial-type": np.string_("vector"),
+        "start_time_in_seconds": -10,
+    }
+    rng = np.random.RandomState(12345)
+    sources = {
+        f"XX_S{_i}": rng.randn(100 + _i % 3, 3) for _i in range(11)
+    }
+    sources["XX_INT"] = np.arange(12, dtype=np.int32).reshape(4, 3)
+
+    reference = os.path.join(str(tmpdir), "reference.h5")
+    with h5py.File(reference, "w") as f:
+        for name, data in sources.items():
+            dataset = f.create_dataset(name, data=data)
+            for key, value in attributes.items():
+                dataset.attrs[key] = value
+
+    filename = os.path.join(str(tmpdir), "batched.h5")
+    with BatchH5Writer(filename, attributes, chunk_size=4) as writer:
+        for name, data in sources.items():
+            # Non contiguous input, as the transposed ZNE arrays.
+            writer.add(name, data.T.copy().T)
+    assert writer.datasets_written == len(sources)
+
+    with h5py.File(reference, "r") as f_ref, h5py.File(filename, "r") as f:
+        assert sorted(f.keys()) == sorted(f_ref.keys())
+        for name in f_ref:
+            np.testing.assert_array_equal(f[name][()], f_ref[name][()])
+            assert f[name].dtype == f_ref[name].dtype
+            assert f[name].chunks == f_ref[name].chunks
+            assert dict(f[name].attrs) == dict(f_ref[name].attrs)
+            for key in attributes:
+                assert (
+                    f[name].attrs.get_id(key).get_type().dtype
+                    == f_ref[name].attrs.get_id(key).get_type().dtype
+                )
+
+    with pytest.raises(LASIFError):
+        writer.add("XX_LATE", sources["XX_INT"])
+    with pytest.raises(LASIFError):
+        BatchH5Writer(filename, {"location": np.zeros(3)})
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the SQLite misfit store.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import multiprocessing
+import os
+
+import pytest
+import toml
+
+from lasif.exceptions import LASIFNotFoundError
+from lasif.misfit_store_sql import MisfitStore
+
+
+def _write_event(args):
+    filename, event = args
+    store = MisfitStore(filename)
+    stations = {f"XX.S{_i}": float(_i) for _i in range(50)}
+    store.write_event(event, stations)
+    store.apply_station_weights(event, {"XX.S1": 0.5, "XX.S3": 2.0})
+
+
+def test_misfit_store(tmpdir):
+    filename = os.path.join(str(tmpdir), "misfits.sqlite")
+    store = MisfitStore(filename)
+    store.write_event("event_a", {"XX.A": 1.0, "XX.B": 2.0})
+    store.write_event("event_b", {"XX.A": 0.5}, event_misfit=3.0)
+    assert store.list_events() == ["event_a", "event_b"]
+    assert store.has_event("event_a")
+    assert not store.has_event("event_c")
+    assert store.get_event("event_a") == 3.0
+    assert store.get_event("event_b") == 3.0
+
+    # Writing an event again replaces all of its misfits.
+    store.write_event("event_a", {"XX.C": 4.0})
+    assert store.get_event("event_a", include_station_misfit=True) == {
+        "event_misfit": 4.0,
+        "stations": {"XX.C": 4.0},
+    }
+
+    store.apply_station_weights("event_b", {"XX.A": 0.5})
+    assert store.get_event("event_b", include_station_misfit=True) == {
+        "event_misfit": 0.25,
+        "stations": {"XX.A": 0.25},
+    }
+    with pytest.raises(LASIFNotFoundError):
+        store.apply_station_weights("event_b", {"XX.B": 0.5})
+    # Failed transactions do not change anything.
+    assert store.get_event("event_b") == 0.25
+    with pytest.raises(LASIFNotFoundError):
+        store.get_event("event_c")
+
+    # Round trip through the TOML layout.
+    toml_file = os.path.join(str(tmpdir), "misfits.toml")
+    store.export_toml(toml_file)
+    assert toml.load(toml_file) == store.to_dict()
+    # Entries written by ``lasif write_misfit`` are not events.
+    misfits = toml.load(toml_file)
+    misfits["event_misfits"] = {"event_a": 4.0}
+    misfits["total_misfit"] = 4.25
+    with open(toml_file, "w") as fh:
+        toml.dump(misfits, fh)
+    new_store = MisfitStore(os.path.join(str(tmpdir), "new.sqlite"))
+    assert sorted(new_store.import_toml(toml_file)) == ["event_a", "event_b"]
+    assert new_store.to_dict() == store.to_dict()
+
+
+def test_update_stations(tmpdir):
+    store = MisfitStore(os.path.join(str(tmpdir), "misfits.sqlite"))
+    store.write_event("event_a", {"XX.A": 1.0, "XX.B": 2.0, "XX.C": 3.0})
+    # Updating some stations keeps the others.
+    assert store.update_stations("event_a", {"XX.B": 0.5, "XX.D": 4.0}) == 8.5
+    assert store.get_event("event_a", include_station_misfit=True) == {
+        "event_misfit": 8.5,
+        "stations": {"XX.A": 1.0, "XX.B": 0.5, "XX.C": 3.0, "XX.D": 4.0},
+    }
+    assert store.update_stations("event_b", {"XX.A": 2.0}) == 2.0
+    assert store.list_events() == ["event_a", "event_b"]
+
+
+def test_concurrent_event_writes(tmpdir):
+    filename = os.path.join(str(tmpdir), "misfits.sqlite")
+    events = [f"event_{_i}" for _i in range(8)]
+    with multiprocessing.Pool(4) as pool:
+        pool.map(_write_event, [(filename, _e) for _e in events])
+        pool.close()
+        pool.join()
+
+    store = MisfitStore(filename)
+    assert store.list_events() == events
+    expected = sum(range(50)) - 1 - 3 + 0.5 + 6.0
+    for event in events:
+        misfits = store.get_event(event, include_station_misfit=True)
+        assert len(misfits["stations"]) == 50
+        assert misfits["event_misfit"] == expected
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the timing of the pipeline stages.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import json
+import multiprocessing
+import os
+
+import numpy as np
+import obspy
+
+from lasif.tools import stage_timing
+from lasif.tools.stage_timing import (
+    StageTimer,
+    add_bytes_read,
+    collect,
+    report,
+    stage,
+    timed,
+)
+
+
+def _task(station):
+    with stage("read_observed"):
+        st = obspy.Stream([obspy.Trace(data=np.zeros(100))])
+    add_bytes_read("read_observed", st)
+    with stage("misfit"):
+        pass
+    return station.lower()
+
+
+def test_stages_without_timer():
+    assert stage_timing._current is None
+    with stage("misfit"):
+        pass
+    add_bytes_read("read_observed", obspy.Stream())
+    assert timed(_task) is _task
+    results = ["A"]
+    assert collect(results) is results
+
+
+def test_stage_timer(tmpdir):
+    with StageTimer() as timer:
+        with stage("write_windows"):
+            pass
+        with multiprocessing.Pool(2) as pool:
+            results = sorted(
+                collect(pool.imap_unordered(timed(_task), ["A", "B", "C"]))
+            )
+    assert stage_timing._current is None
+    assert results == ["a", "b", "c"]
+
+    summary = timer.summary()
+    assert summary["tasks"] == 3
+    assert sorted(summary["stages"]) == [
+        "misfit",
+        "read_observed",
+        "write_windows",
+    ]
+    read = summary["stages"]["read_observed"]
+    assert read["calls"] == 3
+    assert read["bytes_read"] == 3 * 800
+    assert read["tasks"] == 3
+    assert read["seconds_per_task"] == read["seconds"] / 3
+    assert summary["stages"]["write_windows"]["tasks"] == 0
+    assert summary["stages"]["write_windows"]["seconds_per_task"] is None
+    assert {_t["task"] for _t in summary["slowest_tasks"]} == {"A", "B", "C"}
+    assert summary["wall_time"] > 0.0
+
+    table = timer.format_table()
+    for name in ["misfit", "read_observed", "write_windows", "other"]:
+        assert name in table
+    assert "3 worker tasks" in table
+
+    filename = os.path.join(str(tmpdir), "timing.json")
+    with report(filename) as timer:
+        with stage("misfit"):
+            pass
+    with open(filename, "r") as fh:
+        assert list(json.load(fh)["stages"]) == ["misfit"]
+
+    with report(None, enabled=False) as timer:
+        assert timer is None
+        assert stage_timing._current is None
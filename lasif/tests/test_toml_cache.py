@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the memoized TOML parsing.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+
+import toml
+
+from lasif.tools.toml_cache import TomlCache
+
+
+def test_toml_cache(tmpdir):
+    filename = os.path.join(str(tmpdir), "events_used.toml")
+    with open(filename, "w") as fh:
+        toml.dump({"events": {"events_used": ["event_a"]}}, fh)
+
+    cache = TomlCache()
+    content = cache.load(filename)
+    assert content == {"events": {"events_used": ["event_a"]}}
+    # Callers get a copy they can modify.
+    content["events"]["events_used"].append("event_b")
+    assert cache.load(filename) == {"events": {"events_used": ["event_a"]}}
+    assert cache.info() == {"hits": 1, "misses": 1, "files": 1}
+
+    # A changed file is parsed again.
+    with open(filename, "w") as fh:
+        toml.dump({"events": {"events_used": ["event_a", "event_b"]}}, fh)
+    assert cache.load(filename)["events"]["events_used"] == [
+        "event_a",
+        "event_b",
+    ]
+    assert cache.info() == {"hits": 1, "misses": 2, "files": 1}
+
+    cache.clear()
+    assert cache.info() == {"hits": 0, "misses": 0, "files": 0}
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test suite for the SQLite window set manager.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import os
+import pickle
+import sqlite3
+
+import obspy
+import pytest
+
+from lasif.exceptions import LASIFError, LASIFNotFoundError
+from lasif.window_manager_sql import WindowGroupManager
+
+T = obspy.UTCDateTime(2010, 3, 24, 14, 11, 31)
+
+
+def test_window_group_manager_connection(tmpdir):
+    filename = os.path.join(str(tmpdir), "A.sqlite")
+    manager = WindowGroupManager(filename)
+    manager.add_window_to_event_channel("event_a", "XX.A.00.BHZ", T, T + 10)
+    manager.add_window_to_event_channel("event_a", "XX.A.00.BHN", T, T + 20)
+
+    # One connection for all queries, the database is journaled with WAL.
+    conn = manager._connection()
+    assert manager.event_in_db("event_a")
+    assert manager._connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+    # A read-only manager sees everything the writer committed.
+    reader = WindowGroupManager(filename, read_only=True)
+    windows = reader.get_all_windows_for_event("event_a")
+    assert windows == {
+        "XX.A": {
+            "XX.A.00.BHZ": [(T, T + 10, 1.0)],
+            "XX.A.00.BHN": [(T, T + 20, 1.0)],
+        }
+    }
+    manager.add_window_to_event_channel("event_a", "XX.B.00.BHZ", T, T + 5)
+    assert reader.get_all_windows_for_event_station("event_a", "XX.B") == {
+        "XX.B.00.BHZ": [(T, T + 5, 1.0)]
+    }
+    # Unknown events are not added by readers.
+    assert reader.get_all_windows_for_event("event_b") == {}
+    assert not manager.event_in_db("event_b")
+
+    with pytest.raises(LASIFError):
+        reader.add_window_to_event_channel("event_a", "XX.C.00.BHZ", T, T + 1)
+    with pytest.raises(sqlite3.OperationalError):
+        with reader.sqlite_cursor() as c:
+            c.execute("DELETE FROM windows")
+    reader.close()
+
+    # Managers can be pickled, the connection is opened again.
+    copy = pickle.loads(pickle.dumps(manager))
+    assert copy._conn is None
+    assert copy.get_all_windows_for_event(
+        "event_a"
+    ) == manager.get_all_windows_for_event("event_a")
+    copy.close()
+    manager.close()
+
+    with pytest.raises(LASIFNotFoundError):
+        WindowGroupManager(
+            os.path.join(str(tmpdir), "B.sqlite"), read_only=True
+        ).event_in_db("event_a")
+    assert not os.path.exists(os.path.join(str(tmpdir), "B.sqlite"))
+
+
+def test_window_group_manager_transactions(tmpdir):
+    filename = os.path.join(str(tmpdir), "A.sqlite")
+    with WindowGroupManager(filename) as manager:
+        manager.add_window_to_event_channel(
+            "event_a", "XX.A.00.BHZ", T, T + 10
+        )
+
+        # Failed transactions do not change anything, also when nested.
+        with pytest.raises(ValueError):
+            with manager.sqlite_cursor(write=True):
+                manager.del_all_windows_from_event_channel(
+                    "event_a", "XX.A.00.BHZ"
+                )
+                manager.add_event("event_b")
+                raise ValueError
+        assert not manager.event_in_db("event_b")
+        assert manager.get_all_windows_for_event("event_a") == {
+            "XX.A": {"XX.A.00.BHZ": [(T, T + 10, 1.0)]}
+        }
+
+        # Overlapping windows are still replaced.
+        manager.add_window_to_event_channel(
+            "event_a", "XX.A.00.BHZ", T + 5, T + 15
+        )
+        assert manager.get_all_windows_for_event("event_a") == {
+            "XX.A": {"XX.A.00.BHZ": [(T + 5, T + 15, 1.0)]}
+        }
+
+        manager.drop_all_tables()
+        assert not manager.event_in_db("event_a")
+
+
+def test_window_group_manager_schema(tmpdir):
+    # A window set of the first schema version, with the times as strings.
+    filename = os.path.join(str(tmpdir), "A.sqlite")
+    conn = sqlite3.connect(filename)
+    conn.executescript(
+        """
+        CREATE TABLE events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_name TEXT NOT NULL UNIQUE);
+        CREATE TABLE traces (
+            trace_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            channel_name TEXT NOT NULL,
+            FOREIGN KEY (event_id) REFERENCES events(event_id),
+            UNIQUE (event_id, channel_name));
+        CREATE TABLE windows (
+            window_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trace_id INTEGER NOT NULL,
+            start_time utc_datetime NOT NULL,
+            end_time utc_datetime NOT NULL,
+            weight REAL NOT NULL,
+            FOREIGN KEY (trace_id) REFERENCES traces(trace_id));
+        INSERT INTO events VALUES (1, 'event_a');
+        INSERT INTO traces VALUES (1, 1, 'XX.A.00.BHZ');
+        INSERT INTO traces VALUES (2, 1, 'XX.AB.00.BHZ');
+        INSERT INTO windows VALUES
+            (1, 1, '2010-03-24 14:11:31', '2010-03-24 14:11:41.5', 1.0);
+        INSERT INTO windows VALUES
+            (2, 2, '2010-03-24 14:11:51.250000', '2010-03-24 14:12:01', 2.0);
+        """
+    )
+    conn.close()
+
+    # Readers migrate the window set as well.
+    reader = WindowGroupManager(filename, read_only=True)
+    assert reader.get_all_windows_for_event_station("event_a", "XX.A") == {
+        "XX.A.00.BHZ": [(T, T + 10.5, 1.0)]
+    }
+    assert reader.get_all_windows_for_event("event_a") == {
+        "XX.A": {"XX.A.00.BHZ": [(T, T + 10.5, 1.0)]},
+        "XX.AB": {"XX.AB.00.BHZ": [(T + 20.25, T + 30, 2.0)]},
+    }
+    reader.close()
+
+    conn = sqlite3.connect(filename)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+    assert conn.execute("SELECT * FROM traces").fetchall() == [
+        (1, 1, "XX", "A", "XX.A.00.BHZ"),
+        (2, 1, "XX", "AB", "XX.AB.00.BHZ"),
+    ]
+    assert conn.execute(
+        "SELECT start_time, end_time FROM windows WHERE window_id=2"
+    ).fetchone() == (T.timestamp + 20.25, T.timestamp + 30)
+    indices = [
+        _i[0]
+        for _i in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index'"
+        )
+        if not _i[0].startswith("sqlite_")
+    ]
+    assert sorted(indices) == ["traces_station", "windows_trace"]
+    conn.close()
+
+    # Windows of whole events as structured arrays.
+    with WindowGroupManager(filename) as manager:
+        manager.add_window_to_event_channel(
+            "event_a", "XX.A.00.BHZ", T + 0.000001, T + 0.5
+        )
+        manager.add_window_to_event_channel(
+            "event_a", "XX.A.00.BHZ", T + 20, T + 25
+        )
+        windows = manager.get_all_windows_for_event_array("event_a")
+        assert windows.dtype.names == (
+            "network",
+            "station",
+            "channel",
+            "start_time",
+            "end_time",
+            "weight",
+        )
+        assert windows["channel"].tolist() == [
+            "XX.A.00.BHZ",
+            "XX.A.00.BHZ",
+            "XX.AB.00.BHZ",
+        ]
+        assert windows["station"].tolist() == ["A", "A", "AB"]
+        assert windows["start_time"].tolist() == [
+            T.timestamp + 0.000001,
+            T.timestamp + 20,
+            T.timestamp + 20.25,
+        ]
+        assert windows["weight"].tolist() == [1.0, 1.0, 2.0]
+        assert len(manager.get_all_windows_for_event_array("event_b")) == 0
+        # Microseconds are kept.
+        assert manager.get_all_windows_for_event("event_a")["XX.A"][
+            "XX.A.00.BHZ"
+        ][0][:2] == (T + 0.000001, T + 0.5)
+
+
+def test_write_windows_bulk(tmpdir):
+    filename = os.path.join(str(tmpdir), "A.sqlite")
+    manager = WindowGroupManager(filename)
+    manager.add_window_to_event_channel("event_a", "XX.A.00.BHZ", T, T + 5)
+    manager.add_window_to_event_channel(
+        "event_a", "XX.A.00.BHN", T + 50, T + 60
+    )
+
+    # Every window replaces the earlier windows it overlaps or touches,
+    # the windows written before included.
+    results = {
+        "XX.A": {
+            "XX.A.00.BHZ": [
+                (T + 10, T + 20, False),
+                (T + 30, T + 40, False),
+                (T + 20, T + 25, True),
+                (T + 5, T + 8, False),
+            ],
+            "XX.A.00.BHE": [],
+        },
+        "XX.B": None,
+        "XX.C": {"XX.C.00.BHZ": [(T, T + 10, False), (T, T + 10, False)]},
+    }
+    assert manager.write_windows_bulk("event_a", results) == 4
+    assert manager.write_windows_bulk("event_b", results) == 4
+    expected = {
+        "XX.A": {
+            "XX.A.00.BHZ": [
+                (T + 5, T + 8, 1.0),
+                (T + 20, T + 25, 1.0),
+                (T + 30, T + 40, 1.0),
+            ]
+        },
+        "XX.C": {"XX.C.00.BHZ": [(T, T + 10, 1.0)]},
+    }
+    assert manager.get_all_windows_for_event("event_b") == expected
+    # Windows already in the window set are not written again.
+    assert manager.write_windows_bulk("event_b", results) == 0
+    assert manager.get_all_windows_for_event("event_b") == expected
+    # Other channels keep their windows, traces are added without windows.
+    expected["XX.A"]["XX.A.00.BHN"] = [(T + 50, T + 60, 1.0)]
+    assert manager.get_all_windows_for_event("event_a") == expected
+    assert manager.trace_in_db("event_a", "XX.A.00.BHE")
+
+    # Nothing is written if one of the windows is invalid.
+    with pytest.raises(AssertionError):
+        manager.write_windows_bulk(
+            "event_c", {"XX.A": {"XX.A.00.BHZ": [(T, T, False)]}}
+        )
+    assert not manager.event_in_db("event_c")
+    manager.close()
@@ -10,10 +10,25 @@ Test suite for the window selection.
     (http://www.gnu.org/copyleft/gpl.html)
 """
 import inspect
+import numpy as np
 import obspy
 import os
 
-from lasif.window_selection import select_windows
+from lasif.window_selection import (
+    _mask_around,
+    _mask_short_windows,
+    _max_cross_correlation,
+    find_local_extrema,
+    select_windows,
+    select_windows_batch,
+)
+from lasif.function_templates.source_time_function import (
+    source_time_function,
+)
+from lasif.function_templates.window_picking_function import (
+    window_picking_function,
+    window_picking_function_batch,
+)
 from lasif.tests.testing_helpers import communicator, cli  # NOQA
 
 # Data path.
@@ -98,3 +113,194 @@ def test_select_windows(cli):
     ]
 
     assert windows == expected_windows
+
+
+def test_max_cross_correlation():
+    """
+    The FFT based cross correlations give exactly the results of
+    np.correlate.
+    """
+    rng = np.random.RandomState(12345)
+    taper = np.hanning(301)
+    t = np.linspace(0, 30, 2000)
+    data = np.sin(t) + 0.1 * rng.randn(len(t))
+    synth = np.sin(t - 0.3)
+    starts = np.arange(0, 1600, 7)
+    data_windows = np.array([data[_s : _s + 301] * taper for _s in starts])
+    synthetic_windows = np.array(
+        [synth[_s : _s + 301] * taper for _s in starts]
+    )
+    # Windows without a unique maximum.
+    data_windows[3] = 0.0
+    data_windows[5] = synthetic_windows[5] = taper
+    data_windows[7, 100] = np.nan
+
+    time_shifts, max_cc = _max_cross_correlation(
+        data_windows, synthetic_windows, chunk_size=64
+    )
+    for i, (d, s) in enumerate(zip(data_windows, synthetic_windows)):
+        cc = np.correlate(d, s, mode="full")
+        assert time_shifts[i] == cc.argmax() - len(d) + 1
+        expected = cc.max() / np.sqrt((s ** 2).sum() * (d ** 2).sum())
+        np.testing.assert_array_equal(max_cc[i], expected)
+
+    time_shifts, max_cc = _max_cross_correlation(
+        data_windows[:0], synthetic_windows[:0]
+    )
+    assert len(time_shifts) == len(max_cc) == 0
+
+
+def test_find_local_extrema():
+    """
+    Flat extrema are returned with their first index, the first and last
+    samples are added for the peak and trough marching.
+    """
+    for data, peaks, troughs in [
+        ([0, 1, 1, 0, 2, 2, 3, 0, 0, 1], [1, 6, 9], [0, 3, 7]),
+        ([1, 0, 0, 2, 2, 1, 1, 1], [0, 3], [1, 7]),
+        ([0, 1, 2, 3], [], []),
+        # The slope before a flat start is taken from the end of the data.
+        ([3, 3, 1, 0, 5], [0, 4], [3]),
+        ([2, 2, 1, 3, 3, 3, 0], [0, 3], [2, 6]),
+        # Constant data has no extrema.
+        ([2, 2, 2, 2], [], []),
+    ]:
+        p, t = find_local_extrema(np.array(data, dtype=np.float64))
+        assert p.dtype == t.dtype == np.int32
+        np.testing.assert_array_equal(p, peaks)
+        np.testing.assert_array_equal(t, troughs)
+
+
+def test_masking_stages():
+    """
+    Masking around indices and masking short windows.
+    """
+    time_windows = np.ma.ones(20)
+    time_windows.mask = False
+    time_windows.mask[[6, 15]] = True
+    # Like the slice it replaces, a range starting before the first sample
+    # is empty.
+    _mask_around(time_windows, np.array([1, 10, 18]), 3)
+    np.testing.assert_array_equal(
+        np.flatnonzero(time_windows.mask),
+        [6, 7, 8, 9, 10, 11, 12, 15, 16, 17, 18, 19],
+    )
+
+    time_windows.mask[:] = False
+    time_windows.mask[[3, 4, 9, 12, 13]] = True
+    _mask_short_windows(time_windows, 4)
+    np.testing.assert_array_equal(
+        np.flatnonzero(time_windows.mask), [0, 1, 2, 3, 4, 9, 10, 11, 12, 13]
+    )
+    time_windows.mask[:] = True
+    _mask_short_windows(time_windows, 4)
+    assert time_windows.mask.all()
+
+
+def test_select_windows_batch():
+    """
+    The batched window selection picks the same windows as the window
+    selection of every single pair of traces.
+    """
+    data_trace = obspy.read(os.path.join(DATA, "LA.AA10..BHZ.mseed"))[0]
+    synthetic_trace = obspy.read(os.path.join(DATA, "LA.AA10_.___.z.mseed"))[0]
+    stf_trace = source_time_function(
+        npts=data_trace.stats.npts,
+        delta=data_trace.stats.delta,
+        freqmin=1.0 / 100.0,
+        freqmax=1.0 / 40.0,
+    )
+
+    rng = np.random.RandomState(12345)
+    data = np.array([data_trace.data] * 6)
+    synthetics = np.array([synthetic_trace.data] * 6)
+    data[1] += 0.05 * np.abs(data[1]).max() * rng.randn(data.shape[1])
+    synthetics[2] = np.roll(synthetics[2], 20)
+    # NaNs, no data and no synthetics.
+    data[3, 10] = np.nan
+    data[4] = 0.0
+    synthetics[5] = 0.0
+    station_latitudes = [41.3317000452, 41.3317000452, 40.0, 41.0, 41.0, 41.0]
+    station_longitudes = [2.00073761549, 2.00073761549, 2.5, 2.0, 2.0, 2.0]
+    parameters = {
+        "event_latitude": 44.87,
+        "event_longitude": 8.48,
+        "event_depth_in_km": 15.0,
+        "minimum_period": 40.0,
+        "maximum_period": 100.0,
+        "max_energy_ratio": 2.0,
+    }
+
+    windows = select_windows_batch(
+        data=data,
+        synthetics=synthetics,
+        starttimes=data_trace.stats.starttime,
+        delta=data_trace.stats.delta,
+        stf_trace=stf_trace,
+        station_latitudes=station_latitudes,
+        station_longitudes=station_longitudes,
+        max_batch_windows=100,
+        **parameters,
+    )
+
+    assert len(windows) == 6
+    assert len(windows[0]) == 2
+    assert windows[3] == windows[4] == windows[5] == []
+    for i in range(6):
+        data_trace.data = data[i]
+        synthetic_trace.data = synthetics[i]
+        assert windows[i] == select_windows(
+            data_trace=data_trace,
+            synthetic_trace=synthetic_trace,
+            stf_trace=stf_trace,
+            station_latitude=station_latitudes[i],
+            station_longitude=station_longitudes[i],
+            **parameters,
+        )
+
+
+def test_window_picking_function_batch():
+    """
+    Both window picking functions of the project template pick the same
+    windows.
+    """
+    data = obspy.read(os.path.join(DATA, "LA.AA10..BHZ.mseed"))
+    synthetics = obspy.read(os.path.join(DATA, "LA.AA10_.___.z.mseed"))
+    data += data[0].copy()
+    synthetics += synthetics[0].copy()
+    synthetics[1].data = np.roll(synthetics[1].data, 20)
+    stf_trace = source_time_function(
+        npts=data[0].stats.npts,
+        delta=data[0].stats.delta,
+        freqmin=1.0 / 100.0,
+        freqmax=1.0 / 40.0,
+    )
+    parameters = {
+        "stf_trace": stf_trace,
+        "event_latitude": 44.87,
+        "event_longitude": 8.48,
+        "event_depth_in_km": 15.0,
+        "minimum_period": 40.0,
+        "maximum_period": 100.0,
+        "iteration": "1",
+    }
+
+    windows = window_picking_function_batch(
+        data=np.array([tr.data for tr in data]),
+        synthetics=np.array([tr.data for tr in synthetics]),
+        starttimes=[tr.stats.starttime for tr in data],
+        delta=data[0].stats.delta,
+        station_latitudes=[41.3317000452] * 2,
+        station_longitudes=[2.00073761549] * 2,
+        **parameters,
+    )
+    assert len(windows) == 2
+    assert windows[0]
+    for data_tr, synth_tr, tr_windows in zip(data, synthetics, windows):
+        assert tr_windows == window_picking_function(
+            data_trace=data_tr,
+            synthetic_trace=synth_tr,
+            station_latitude=41.3317000452,
+            station_longitude=2.00073761549,
+            **parameters,
+        )
@@ -8,7 +8,13 @@ import warnings
 import matplotlib.pyplot as plt
 from obspy.core import Stream
 import obspy.signal.filter
-from lasif.tools.adjoint.utils import window_trace, generic_adjoint_source_plot
+from lasif.tools.adjoint.utils import (
+    window_trace,
+    window_slice,
+    window_array,
+    get_taper,
+    generic_adjoint_source_plot,
+)
 
 
 from lasif.exceptions import LASIFError, LASIFWarning
@@ -97,6 +103,7 @@ def calculate_adjoint_source(
     adjoint_src=True,
     plot=False,
     plot_filename=None,
+    adjoint_source_parameters=None,
     **kwargs,
 ):
     """
@@ -132,6 +139,10 @@ def calculate_adjoint_source(
     :param plot_filename: If given, the plot of the adjoint source will be
         saved there. Only used if ``plot`` is ``True``.
     :type plot_filename: str
+    :param adjoint_source_parameters: Additional keyword arguments passed on
+        to the function of the chosen adjoint source type, e.g.
+        ``frequency_cutoff`` for the ``tf_phase_misfit``.
+    :type adjoint_source_parameters: dict, optional
     """
     observed, synthetic = _sanity_checks(observed, synthetic)
     # Keep these as they will need to be imported later
@@ -234,6 +245,7 @@ def calculate_adjoint_source(
             taper=taper,
             taper_ratio=taper_ratio,
             taper_type=taper_type,
+            **(adjoint_source_parameters or {}),
         )
 
         if adjoint_src:
@@ -269,8 +281,10 @@ def calculate_adjoint_source(
         plt.show()
 
     # adjoint source requires an additional factor due to chain rule
-    if adj_src_type == "envelope_misfit" or "envelope_scaling" in kwargs \
-            and kwargs["envelope_scaling"]:
+    if full_ad_src is not None and (
+        adj_src_type == "envelope_misfit" or "envelope_scaling" in kwargs
+        and kwargs["envelope_scaling"]
+    ):
         full_ad_src.data *= (scaling_factor_syn * env_weighting)
 
     return AdjointSource(
@@ -282,6 +296,396 @@ def calculate_adjoint_source(
     )
 
 
+def calculate_adjoint_source_array(
+    adj_src_type,
+    observed,
+    synthetic,
+    stats,
+    window,
+    min_period=None,
+    max_period=None,
+    taper=True,
+    taper_type="cosine",
+    adjoint_src=True,
+    synthetic_stats=None,
+    envelope_scaling=False,
+    adjoint_source_parameters=None,
+):
+    """
+    Version of :func:`calculate_adjoint_source` working on plain data arrays
+    with the same results.
+
+    No traces are copied. The windows are applied with precomputed index
+    slices and cached tapers into two work arrays that are reused for all
+    windows. Adjoint source types providing a
+    ``calculate_adjoint_source_array()`` function work on these arrays
+    directly, all others get traces sharing the work arrays. Plotting is not
+    supported.
+
+    :param adj_src_type: The type of adjoint source to calculate.
+    :type adj_src_type: str
+    :param observed: The observed data. Is not modified.
+    :type observed: :class:`numpy.ndarray`
+    :param synthetic: The synthetic data. Is not modified.
+    :type synthetic: :class:`numpy.ndarray`
+    :param stats: Header of the observed data, also used for the synthetic
+        data.
+    :type stats: :class:`obspy.core.trace.Stats`
+    :param window: starttime and endtime of window(s) potentially including
+        weighting for each window.
+    :type window: list of tuples
+    :param min_period: The minimum period of the spectral content of the data.
+    :type min_period: float
+    :param adjoint_src: Only calculate the misfit or also derive
+        the adjoint source.
+    :type adjoint_src: bool
+    :param synthetic_stats: Header of the synthetic data. If given, it is
+        checked against ``stats`` like :func:`calculate_adjoint_source` does.
+    :type synthetic_stats: :class:`obspy.core.trace.Stats`, optional
+    :param envelope_scaling: Scale the data by their envelope as done for
+        the ``weighted_waveform_misfit``.
+    :type envelope_scaling: bool
+    :param adjoint_source_parameters: Additional keyword arguments passed on
+        to the function of the chosen adjoint source type.
+    :type adjoint_source_parameters: dict, optional
+    :return: The adjoint source. Its ``adjoint_source`` attribute is a numpy
+        array or ``None`` if not calculated.
+    :rtype: :class:`AdjointSource`
+    """
+    if adj_src_type not in AdjointSource._ad_srcs:
+        raise LASIFError(
+            "Adjoint Source type '%s' is unknown. Available types: %s"
+            % (adj_src_type, ", ".join(sorted(AdjointSource._ad_srcs.keys())))
+        )
+
+    _check_headers(
+        stats,
+        synthetic_stats if synthetic_stats is not None else stats,
+        observed,
+        synthetic,
+    )
+    observed = np.require(observed, dtype=np.float64, requirements=["C"])
+    synthetic = np.require(synthetic, dtype=np.float64, requirements=["C"])
+
+    # window variable should be a list of windows, if it is not make it into
+    # a list.
+    if not isinstance(window, list):
+        window = [window]
+
+    fct, array_fct = (
+        AdjointSource._ad_srcs[adj_src_type][0],
+        AdjointSource._ad_srcs[adj_src_type][4],
+    )
+    adjoint_source_parameters = adjoint_source_parameters or {}
+
+    full_ad_src = None
+    trace_misfit = 0.0
+    window_misfit = []
+    s = 0
+
+    if adj_src_type == "envelope_misfit" or envelope_scaling:
+        # scale data to same amplitude range and to 1
+        # such that weak earthquakes count equally much
+        scaling_factor_syn = 1.0 / synthetic.ptp()
+        scaling_factor_data = 1.0 / observed.ptp()
+        synthetic = synthetic * scaling_factor_syn
+        observed = observed * scaling_factor_data
+
+        # At this point they have the same ptp amplitude range.
+        # Now we want to downweight high amplitude surface waves
+        # and upweight body waves by dividing by the envelope + a reg term.
+        envelope = obspy.signal.filter.envelope(observed)
+        env_weighting = 1.0 / (envelope + np.max(envelope) * 0.3)
+        observed *= env_weighting
+        synthetic *= env_weighting
+
+    # Work arrays reused for all windows.
+    windowed_observed = np.empty_like(observed)
+    windowed_synthetic = np.empty_like(synthetic)
+
+    for win in window:
+        taper_ratio = 0.5 * (min_period / (win[1] - win[0]))
+        if taper_ratio > 0.5:
+            s += 1
+            station_name = stats.network + "." + stats.station
+            msg = (
+                f"Window {win} at Station {station_name} might be to "
+                f"short for your frequency content. Adjoint source "
+                f"was not calculated because it could result in "
+                f"high frequency artifacts and wacky misfit measurements."
+            )
+            warnings.warn(msg)
+            if len(window) == 1 or s == len(window):
+                adjoint = {
+                    "adjoint_source": np.zeros_like(observed),
+                    "misfit": 0.0,
+                }
+            else:
+                continue
+
+        win_slice = window_slice(stats, win)
+        win_taper = None
+        if taper:
+            win_taper = get_taper(
+                win_slice[1] - win_slice[0], taper_ratio, taper_type
+            )
+        window_array(observed, win_slice, win_taper, out=windowed_observed)
+        window_array(synthetic, win_slice, win_taper, out=windowed_synthetic)
+
+        kwargs = dict(
+            window=win,
+            min_period=min_period,
+            max_period=max_period,
+            adjoint_src=adjoint_src,
+            plot=False,
+            taper=taper,
+            taper_ratio=taper_ratio,
+            taper_type=taper_type,
+            **adjoint_source_parameters,
+        )
+        if array_fct is not None:
+            adjoint = array_fct(
+                observed=windowed_observed,
+                synthetic=windowed_synthetic,
+                stats=stats,
+                window_slice=win_slice,
+                **kwargs,
+            )
+        else:
+            adjoint = fct(
+                observed=obspy.Trace(data=windowed_observed, header=stats),
+                synthetic=obspy.Trace(data=windowed_synthetic, header=stats),
+                **kwargs,
+            )
+            if isinstance(adjoint.get("adjoint_source"), obspy.Trace):
+                adjoint["adjoint_source"] = adjoint["adjoint_source"].data
+
+        if adjoint_src:
+            window_array(
+                adjoint["adjoint_source"],
+                win_slice,
+                win_taper,
+                out=adjoint["adjoint_source"],
+            )
+            if win == window[0]:
+                full_ad_src = adjoint["adjoint_source"]
+            else:
+                full_ad_src += adjoint["adjoint_source"]
+
+        window_misfit.append((win[0], win[1], adjoint["misfit"]))
+        trace_misfit += adjoint["misfit"]
+
+    # adjoint source requires an additional factor due to chain rule
+    if full_ad_src is not None and (
+        adj_src_type == "envelope_misfit" or envelope_scaling
+    ):
+        full_ad_src *= scaling_factor_syn * env_weighting
+
+    return AdjointSource(
+        adj_src_type,
+        misfit=trace_misfit,
+        window_misfits=window_misfit,
+        adjoint_source=full_ad_src,
+        individual_ad_sources=Stream(),
+    )
+
+
+def calculate_adjoint_source_batch(
+    adj_src_type,
+    observed,
+    synthetic,
+    stats,
+    window,
+    min_period=None,
+    max_period=None,
+    taper=True,
+    taper_type="cosine",
+    adjoint_src=True,
+    synthetic_stats=None,
+    envelope_scaling=False,
+    adjoint_source_parameters=None,
+):
+    """
+    Version of :func:`calculate_adjoint_source_array` for many traces at
+    once with the same results.
+
+    The windows of all traces are stacked into two 2D arrays with one
+    window per row, rows of shorter traces are padded with zeros. Adjoint
+    source types providing a ``calculate_adjoint_source_batch()`` function
+    evaluate all rows with a few vectorized calls. For all other types, the
+    traces are passed to :func:`calculate_adjoint_source_array` one by one.
+
+    :param adj_src_type: The type of adjoint source to calculate.
+    :type adj_src_type: str
+    :param observed: The observed data of every trace. Are not modified.
+    :type observed: list of :class:`numpy.ndarray`
+    :param synthetic: The synthetic data of every trace. Are not modified.
+    :type synthetic: list of :class:`numpy.ndarray`
+    :param stats: Header of the observed data of every trace.
+    :type stats: list of :class:`obspy.core.trace.Stats`
+    :param window: The windows of every trace, see
+        :func:`calculate_adjoint_source_array`.
+    :type window: list of lists of tuples
+    :param synthetic_stats: Header of the synthetic data of every trace.
+    :type synthetic_stats: list of :class:`obspy.core.trace.Stats`, optional
+    :return: The adjoint source of every trace.
+    :rtype: list of :class:`AdjointSource`
+
+    All other parameters are the same as for
+    :func:`calculate_adjoint_source_array`.
+    """
+    if adj_src_type not in AdjointSource._ad_srcs:
+        raise LASIFError(
+            "Adjoint Source type '%s' is unknown. Available types: %s"
+            % (adj_src_type, ", ".join(sorted(AdjointSource._ad_srcs.keys())))
+        )
+    if synthetic_stats is None:
+        synthetic_stats = stats
+
+    batch_fct = AdjointSource._ad_srcs[adj_src_type][5]
+    if batch_fct is None:
+        return [
+            calculate_adjoint_source_array(
+                adj_src_type,
+                observed=_obs,
+                synthetic=_syn,
+                stats=_stats,
+                synthetic_stats=_syn_stats,
+                window=_win,
+                min_period=min_period,
+                max_period=max_period,
+                taper=taper,
+                taper_type=taper_type,
+                adjoint_src=adjoint_src,
+                envelope_scaling=envelope_scaling,
+                adjoint_source_parameters=adjoint_source_parameters,
+            )
+            for _obs, _syn, _stats, _syn_stats, _win in zip(
+                observed, synthetic, stats, synthetic_stats, window
+            )
+        ]
+
+    # Collect the windows of all traces.
+    traces = []
+    rows = []
+    for i, (obs, syn, trace_stats, syn_stats, windows) in enumerate(
+        zip(observed, synthetic, stats, synthetic_stats, window)
+    ):
+        _check_headers(trace_stats, syn_stats, obs, syn)
+        obs = np.require(obs, dtype=np.float64, requirements=["C"])
+        syn = np.require(syn, dtype=np.float64, requirements=["C"])
+        if not isinstance(windows, list):
+            windows = [windows]
+
+        env_scaling = None
+        if adj_src_type == "envelope_misfit" or envelope_scaling:
+            # Same scaling as in calculate_adjoint_source_array().
+            scaling_factor_syn = 1.0 / syn.ptp()
+            scaling_factor_data = 1.0 / obs.ptp()
+            syn = syn * scaling_factor_syn
+            obs = obs * scaling_factor_data
+            envelope = obspy.signal.filter.envelope(obs)
+            env_weighting = 1.0 / (envelope + np.max(envelope) * 0.3)
+            obs *= env_weighting
+            syn *= env_weighting
+            env_scaling = (scaling_factor_syn, env_weighting)
+        traces.append((obs, syn, trace_stats, windows, env_scaling))
+
+        s = 0
+        for win in windows:
+            taper_ratio = 0.5 * (min_period / (win[1] - win[0]))
+            if taper_ratio > 0.5:
+                s += 1
+                station_name = trace_stats.network + "." + trace_stats.station
+                msg = (
+                    f"Window {win} at Station {station_name} might be to "
+                    f"short for your frequency content. Adjoint source "
+                    f"was not calculated because it could result in "
+                    f"high frequency artifacts and wacky misfit "
+                    f"measurements."
+                )
+                warnings.warn(msg)
+                # The last window is used if all of them are too short.
+                if not (len(windows) == 1 or s == len(windows)):
+                    continue
+            win_slice = window_slice(trace_stats, win)
+            win_taper = None
+            if taper:
+                win_taper = get_taper(
+                    win_slice[1] - win_slice[0], taper_ratio, taper_type
+                )
+            rows.append((i, win, win_slice, win_taper))
+
+    # Stack the windowed data, one window per row.
+    width = max([len(_t[0]) for _t in traces], default=0)
+    windowed_observed = np.zeros((len(rows), width))
+    windowed_synthetic = np.zeros((len(rows), width))
+    for r, (i, win, win_slice, win_taper) in enumerate(rows):
+        obs, syn = traces[i][:2]
+        window_array(
+            obs, win_slice, win_taper, out=windowed_observed[r, : len(obs)]
+        )
+        window_array(
+            syn, win_slice, win_taper, out=windowed_synthetic[r, : len(syn)]
+        )
+
+    if rows:
+        result = batch_fct(
+            observed=windowed_observed,
+            synthetic=windowed_synthetic,
+            lengths=np.array([len(traces[_r[0]][0]) for _r in rows]),
+            deltas=np.array([traces[_r[0]][2].delta for _r in rows]),
+            windows=[_r[1] for _r in rows],
+            window_slices=np.array([_r[2] for _r in rows]),
+            station_names=[
+                traces[_r[0]][2].network + "." + traces[_r[0]][2].station
+                for _r in rows
+            ],
+            min_period=min_period,
+            max_period=max_period,
+            adjoint_src=adjoint_src,
+            taper=taper,
+            taper_type=taper_type,
+            **(adjoint_source_parameters or {}),
+        )
+
+    # Sum up the windows of every trace.
+    adjoint_sources = []
+    for i, (obs, _, _, windows, env_scaling) in enumerate(traces):
+        full_ad_src = None
+        trace_misfit = 0.0
+        window_misfit = []
+        for r in [_r for _r, _row in enumerate(rows) if _row[0] == i]:
+            _, win, win_slice, win_taper = rows[r]
+            if adjoint_src:
+                ad_src = window_array(
+                    result["adjoint_source"][r, : len(obs)],
+                    win_slice,
+                    win_taper,
+                )
+                if win == windows[0]:
+                    full_ad_src = ad_src
+                else:
+                    full_ad_src += ad_src
+            window_misfit.append((win[0], win[1], result["misfit"][r]))
+            trace_misfit += result["misfit"][r]
+
+        # adjoint source requires an additional factor due to chain rule
+        if full_ad_src is not None and env_scaling is not None:
+            full_ad_src *= env_scaling[0] * env_scaling[1]
+
+        adjoint_sources.append(
+            AdjointSource(
+                adj_src_type,
+                misfit=trace_misfit,
+                window_misfits=window_misfit,
+                adjoint_source=full_ad_src,
+                individual_ad_sources=Stream(),
+            )
+        )
+    return adjoint_sources
+
+
 def _sanity_checks(observed, synthetic):
     """
     Perform a number of basic sanity checks to assure the data is valid
@@ -312,14 +716,38 @@ def _sanity_checks(observed, synthetic):
         else:
             raise LASIFError("Synthetic data must be an ObsPy Trace object.")
 
-    if observed.stats.npts != synthetic.stats.npts:
+    _check_headers(observed.stats, synthetic.stats, observed.data, synthetic.data)
+
+    observed = observed.copy()
+    synthetic = synthetic.copy()
+    observed.data = np.require(
+        observed.data, dtype=np.float64, requirements=["C"]
+    )
+    synthetic.data = np.require(
+        synthetic.data, dtype=np.float64, requirements=["C"]
+    )
+
+    return observed, synthetic
+
+
+def _check_headers(observed_stats, synthetic_stats, observed, synthetic):
+    """
+    Sanity checks of :func:`_sanity_checks` on the headers and data arrays.
+
+    :raises: :class:`~lasif.LASIFError`
+    """
+    if (
+        observed_stats.npts != synthetic_stats.npts
+        or len(observed) != observed_stats.npts
+        or len(synthetic) != synthetic_stats.npts
+    ):
         raise LASIFError(
             "Observed and synthetic data must have the "
             "same number of samples."
         )
 
-    sr1 = observed.stats.sampling_rate
-    sr2 = synthetic.stats.sampling_rate
+    sr1 = observed_stats.sampling_rate
+    sr2 = synthetic_stats.sampling_rate
 
     if abs(sr1 - sr2) / sr1 >= 1e-5:
         raise LASIFError(
@@ -328,14 +756,14 @@ def _sanity_checks(observed, synthetic):
 
     # Make sure data and synthetics start within half a sample interval.
     if (
-        abs(observed.stats.starttime - synthetic.stats.starttime)
-        > observed.stats.delta * 0.5
+        abs(observed_stats.starttime - synthetic_stats.starttime)
+        > observed_stats.delta * 0.5
     ):
         raise LASIFError(
             "Observed and synthetic data must have the " "same starttime."
         )
 
-    ptp = sorted([observed.data.ptp(), synthetic.data.ptp()])
+    ptp = sorted([observed.ptp(), synthetic.ptp()])
     if ptp[1] / ptp[0] >= 5:
         warnings.warn(
             "The amplitude difference between data and "
@@ -349,8 +777,8 @@ def _sanity_checks(observed, synthetic):
         len(
             set(
                 [
-                    observed.stats.channel[-1].upper(),
-                    synthetic.stats.channel[-1].upper(),
+                    observed_stats.channel[-1].upper(),
+                    synthetic_stats.channel[-1].upper(),
                 ]
             )
         )
@@ -361,17 +789,6 @@ def _sanity_checks(observed, synthetic):
             "data is not equal."
         )
 
-    observed = observed.copy()
-    synthetic = synthetic.copy()
-    observed.data = np.require(
-        observed.data, dtype=np.float64, requirements=["C"]
-    )
-    synthetic.data = np.require(
-        synthetic.data, dtype=np.float64, requirements=["C"]
-    )
-
-    return observed, synthetic
-
 
 def _discover_adjoint_sources():
     """
@@ -387,6 +804,8 @@ def _discover_adjoint_sources():
     NAME_ATTR = "VERBOSE_NAME"
     DESC_ATTR = "DESCRIPTION"
     ADD_ATTR = "ADDITIONAL_PARAMETERS"
+    ARRAY_FCT_NAME = "calculate_adjoint_source_array"
+    BATCH_FCT_NAME = "calculate_adjoint_source_batch"
 
     path = os.path.join(
         os.path.dirname(inspect.getfile(inspect.currentframe())),
@@ -416,12 +835,16 @@ def _discover_adjoint_sources():
                 % (name, DESC_ATTR)
             )
 
-        # Add tuple of name, verbose name, and description.
+        # Add tuple of name, verbose name, description, additional
+        # parameters, and the optional array and batch versions of the
+        # function.
         AdjointSource._ad_srcs[name] = (
             fct,
             getattr(m, NAME_ATTR),
             getattr(m, DESC_ATTR),
             getattr(m, ADD_ATTR) if hasattr(m, ADD_ATTR) else None,
+            getattr(m, ARRAY_FCT_NAME, None),
+            getattr(m, BATCH_FCT_NAME, None),
         )
 
 
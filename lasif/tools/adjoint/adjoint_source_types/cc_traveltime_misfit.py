@@ -15,10 +15,13 @@ from __future__ import (
 
 import numpy as np
 from obspy import Trace
+from scipy.fft import next_fast_len
 from scipy.integrate import simps
 import obspy.signal.cross_correlation as crosscorr
 import warnings
 
+from lasif.tools.adjoint.utils import group_rows
+
 VERBOSE_NAME = "Cross Correlation Traveltime Misfit"
 
 DESCRIPTION = r"""
@@ -77,17 +80,22 @@ ADDITIONAL_PARAMETERS = r"""
 """
 
 
-def xcorr_shift(s, d, min_period):
+def xcorr_shift(s, d, min_period, dt=None):
     """
     Calculate the correlation time shift around the maximum amplitude of the
     synthetic trace with subsample accuracy.
+
+    ``s`` and ``d`` can also be numpy arrays in which case the sampling
+    interval ``dt`` has to be given.
     """
+    if dt is None:
+        dt = s.stats.delta
     # Estimate shift and use it as a guideline for the subsample accuracy
     # shift.
     # the dt works if these are obspy traces, currently not sure
-    shift = int(np.ceil(min_period / s.stats.delta))
+    shift = int(np.ceil(min_period / dt))
     cc = crosscorr.correlate(s, d, shift=shift)
-    time_shift = (cc.argmax() - shift) * s.stats.delta
+    time_shift = (cc.argmax() - shift) * dt
     return time_shift
 
 
@@ -153,3 +161,218 @@ def calculate_adjoint_source(
         ret_val["adjoint_source"] = adj_src
 
     return ret_val
+
+
+def calculate_adjoint_source_array(
+    observed,
+    synthetic,
+    stats,
+    window,
+    window_slice,
+    min_period,
+    max_period,
+    adjoint_src,
+    **kwargs,
+):
+    """
+    Array version of :func:`calculate_adjoint_source` with the same results.
+
+    :param stats: Header shared by the observed and synthetic data.
+    :param window_slice: Start and end index of the window.
+    """
+    ret_val = {}
+    if len(window) == 2:
+        weight = 1.0
+    else:
+        weight = window[2]
+
+    # Subsample accuracy time shift
+    time_shift = xcorr_shift(synthetic, observed, min_period, dt=stats.delta)
+    ret_val["misfit"] = 0.5 * time_shift ** 2 * weight
+
+    if time_shift >= min_period / 2.0:
+        ret_val["adjoint_source"] = np.zeros_like(observed)
+        station_name = stats.network + "." + stats.station
+        warnings.warn(
+            f"Window {window} at Station {station_name} has a "
+            f"misfit "
+            f"larger than half a period. This could result in a "
+            f"nonphysical misfit measurement and adjoint source "
+            f"will "
+            f"not be computed. Misfit will be included though for "
+            f"future comparisons but it's value might not be "
+            f"trustworthy."
+        )
+        return ret_val
+
+    if adjoint_src:
+        s_vel = np.gradient(synthetic, stats.delta)
+
+        normalize = simps(y=np.square(s_vel), dx=stats.delta)
+        # Calculate actual adjoint source. Not time reversed
+        ret_val["adjoint_source"] = (
+            weight * (time_shift / normalize * s_vel) * stats.delta
+        )
+
+    return ret_val
+
+
+def xcorr_shift_batch(s, d, lengths, min_period, deltas, window_slices):
+    """
+    Batched version of :func:`xcorr_shift` for windowed traces, one per
+    row of ``s`` and ``d``. Rows of shorter traces are padded with zeros.
+
+    Outside of its window, a windowed trace is zero. Only the samples
+    within the windows are correlated, stacked into a 2D array padded to
+    the longest window and masked. The mean removal of
+    :func:`obspy.signal.cross_correlation.correlate`, which acts on the
+    whole trace, is added analytically with cumulative sums.
+    """
+    window_slices = np.asarray(window_slices, dtype=np.int64).reshape(-1, 2)
+    time_shifts = np.empty(len(s))
+    for rows, npts, dt in group_rows(lengths, deltas):
+        shift = int(np.ceil(min_period / dt))
+        start = window_slices[rows, 0]
+        win_npts = window_slices[rows, 1] - start
+        max_npts = max(int(win_npts.max()), 1)
+
+        # The windows, padded to the same length.
+        offsets = np.arange(max_npts)
+        mask = offsets < win_npts[:, np.newaxis]
+        index = np.minimum(start[:, np.newaxis] + offsets, s.shape[1] - 1)
+        a = np.where(mask, s[rows[:, np.newaxis], index], 0.0)
+        b = np.where(mask, d[rows[:, np.newaxis], index], 0.0)
+
+        # Correlation of the windows, for all lags within +-shift.
+        lags = np.arange(-shift, shift + 1)
+        nfft = next_fast_len(2 * max_npts - 1)
+        cc = np.fft.irfft(
+            np.fft.rfft(a, nfft) * np.conj(np.fft.rfft(b, nfft)), nfft
+        )
+        cc = np.where(np.abs(lags) < max_npts, cc[:, lags % nfft], 0.0)
+
+        # Mean removal: sum((a[i + k] - ma) * (b[i] - mb)) over the overlap
+        # of both traces at lag k.
+        mean_a = a.sum(axis=-1) / npts
+        mean_b = b.sum(axis=-1) / npts
+        cum_a = np.concatenate(
+            [np.zeros((len(rows), 1)), np.cumsum(a, axis=-1)], axis=-1
+        )
+        cum_b = np.concatenate(
+            [np.zeros((len(rows), 1)), np.cumsum(b, axis=-1)], axis=-1
+        )
+
+        def _overlap_sum(cum, lo, hi):
+            # Sum of the trace from sample lo to hi, relative to the window.
+            lo = np.clip(lo[np.newaxis, :] - start[:, np.newaxis], 0, None)
+            hi = np.clip(hi[np.newaxis, :] - start[:, np.newaxis], 0, None)
+            lo = np.minimum(lo, win_npts[:, np.newaxis])
+            hi = np.minimum(hi, win_npts[:, np.newaxis])
+            return np.take_along_axis(cum, hi, -1) - np.take_along_axis(
+                cum, lo, -1
+            )
+
+        sum_a = _overlap_sum(
+            cum_a, np.maximum(lags, 0), npts + np.minimum(lags, 0)
+        )
+        sum_b = _overlap_sum(
+            cum_b, np.maximum(-lags, 0), npts - np.maximum(lags, 0)
+        )
+        overlap = np.maximum(npts - np.abs(lags), 0)
+        cc = (
+            cc
+            - mean_b[:, np.newaxis] * sum_a
+            - mean_a[:, np.newaxis] * sum_b
+            + overlap * (mean_a * mean_b)[:, np.newaxis]
+        )
+        cc[:, np.abs(lags) >= npts] = 0.0
+
+        # Traces without any energy have a correlation of zero.
+        norm = (
+            (
+                np.sum(mask * (a - mean_a[:, np.newaxis]) ** 2, axis=-1)
+                + (npts - win_npts) * mean_a ** 2
+            )
+            * (
+                np.sum(mask * (b - mean_b[:, np.newaxis]) ** 2, axis=-1)
+                + (npts - win_npts) * mean_b ** 2
+            )
+        ) ** 0.5
+        cc[norm <= np.finfo(float).eps] = 0.0
+        time_shifts[rows] = (cc.argmax(axis=-1) - shift) * dt
+    return time_shifts
+
+
+def calculate_adjoint_source_batch(
+    observed,
+    synthetic,
+    lengths,
+    deltas,
+    windows,
+    window_slices,
+    station_names,
+    min_period,
+    max_period,
+    adjoint_src,
+    **kwargs,
+):
+    """
+    Batched version of :func:`calculate_adjoint_source_array` for many
+    windows at once, with the same results. Only if the correlation of a
+    window has several maxima of exactly the same value, which happens for
+    windows much shorter than the minimum period, another one of them
+    might be chosen.
+
+    :param observed: Windowed observed data, one window per row. Rows of
+        shorter traces are padded with zeros.
+    :type observed: 2D :class:`numpy.ndarray`
+    :param synthetic: Windowed synthetic data, laid out as ``observed``.
+    :type synthetic: 2D :class:`numpy.ndarray`
+    :param lengths: Number of valid samples of every row.
+    :param deltas: Sampling interval of every row.
+    :param windows: The window of every row.
+    :param window_slices: Start and end index of the window of every row.
+    :param station_names: The station of every row, used in warnings.
+    :return: Dictionary with the ``misfit`` of every row and, if
+        requested, the ``adjoint_source`` rows, not yet windowed again.
+    """
+    weights = np.array([1.0 if len(_w) == 2 else _w[2] for _w in windows])
+    deltas = np.asarray(deltas, dtype=np.float64)
+
+    # Subsample accuracy time shift
+    time_shifts = xcorr_shift_batch(
+        synthetic, observed, lengths, min_period, deltas, window_slices
+    )
+    ret_val = {"misfit": 0.5 * time_shifts ** 2 * weights}
+
+    rejected = time_shifts >= min_period / 2.0
+    for i in np.nonzero(rejected)[0]:
+        warnings.warn(
+            f"Window {windows[i]} at Station {station_names[i]} has a "
+            f"misfit "
+            f"larger than half a period. This could result in a "
+            f"nonphysical misfit measurement and adjoint source "
+            f"will "
+            f"not be computed. Misfit will be included though for "
+            f"future comparisons but it's value might not be "
+            f"trustworthy."
+        )
+
+    if adjoint_src:
+        # Rejected windows get an adjoint source of zeros.
+        adjoint_source = np.zeros_like(observed)
+        for rows, npts, dt in group_rows(lengths, deltas):
+            rows = rows[~rejected[rows]]
+            if not len(rows):
+                continue
+            s_vel = np.gradient(synthetic[rows, :npts], dt, axis=-1)
+            normalize = simps(y=np.square(s_vel), dx=dt, axis=-1)
+            # Calculate actual adjoint source. Not time reversed
+            adjoint_source[rows, :npts] = (
+                weights[rows, np.newaxis]
+                * ((time_shifts[rows] / normalize)[:, np.newaxis] * s_vel)
+                * dt
+            )
+        ret_val["adjoint_source"] = adjoint_source
+
+    return ret_val
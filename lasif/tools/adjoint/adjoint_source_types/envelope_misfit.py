@@ -20,9 +20,10 @@ from __future__ import (
 
 from obspy import Trace
 from scipy.integrate import simps
-from scipy.signal import hilbert as _analytic
 import numpy as np
 
+from lasif.tools.adjoint.utils import group_rows, hilbert_transform
+
 
 # This is the verbose and pretty name of the adjoint source defined in this
 # function.
@@ -125,8 +126,9 @@ def calculate_adjoint_source(
     else:
         weight = window[2] * scaling
 
-    esyn = abs(_analytic(synthetic.data))
-    eobs = abs(_analytic(observed.data))
+    hilbert_syn = hilbert_transform(synthetic.data)
+    esyn = np.hypot(synthetic.data, hilbert_syn)
+    eobs = np.hypot(observed.data, hilbert_transform(observed.data))
     ersd = eobs - esyn
 
     ret_val["misfit"] = 0.5 * simps(y=ersd * ersd * weight,
@@ -135,7 +137,7 @@ def calculate_adjoint_source(
 
     adjoint_source = \
         etmp * synthetic.data - \
-        np.imag(_analytic(etmp * np.imag(_analytic(synthetic.data))))
+        hilbert_transform(etmp * hilbert_syn)
 
     if adjoint_src is True:
         adj_src = Trace(
@@ -146,3 +148,91 @@ def calculate_adjoint_source(
         ret_val["adjoint_source"] = adj_src
 
     return ret_val
+
+
+def calculate_adjoint_source_array(
+    observed, synthetic, stats, window, window_slice, adjoint_src, **kwargs
+):  # NOQA
+    """
+    Array version of :func:`calculate_adjoint_source` with the same results.
+
+    :param stats: Header shared by the observed and synthetic data.
+    :param window_slice: Start and end index of the window.
+    """
+    ret_val = {}
+    scaling = 1.0
+    if len(window) == 2:
+        weight = 1.0 * scaling
+    else:
+        weight = window[2] * scaling
+
+    hilbert_syn = hilbert_transform(synthetic)
+    esyn = np.hypot(synthetic, hilbert_syn)
+    eobs = np.hypot(observed, hilbert_transform(observed))
+    ersd = eobs - esyn
+
+    ret_val["misfit"] = 0.5 * simps(y=ersd * ersd * weight, dx=stats.delta)
+
+    if adjoint_src is True:
+        etmp = (eobs - esyn) / esyn
+        adjoint_source = etmp * synthetic - hilbert_transform(
+            etmp * hilbert_syn
+        )
+        ret_val["adjoint_source"] = adjoint_source * weight * stats.delta
+
+    return ret_val
+
+
+def calculate_adjoint_source_batch(
+    observed, synthetic, lengths, deltas, windows, adjoint_src, **kwargs
+):  # NOQA
+    """
+    Batched version of :func:`calculate_adjoint_source_array` for many
+    windows at once, with the same results.
+
+    The Hilbert transforms of the observed and synthetic data of all
+    windows with the same number of samples are computed with one FFT
+    call, and the one of the synthetics is reused for the adjoint source.
+
+    :param observed: Windowed observed data, one window per row. Rows of
+        shorter traces are padded with zeros.
+    :type observed: 2D :class:`numpy.ndarray`
+    :param synthetic: Windowed synthetic data, laid out as ``observed``.
+    :type synthetic: 2D :class:`numpy.ndarray`
+    :param lengths: Number of valid samples of every row.
+    :param deltas: Sampling interval of every row.
+    :param windows: The window of every row.
+    :return: Dictionary with the ``misfit`` of every row and, if
+        requested, the ``adjoint_source`` rows, not yet windowed again.
+    """
+    weights = np.array([1.0 if len(_w) == 2 else _w[2] for _w in windows])
+
+    misfits = np.empty(len(observed))
+    if adjoint_src is True:
+        adjoint_sources = np.zeros_like(observed)
+    for rows, npts, delta in group_rows(lengths, deltas):
+        obs = observed[rows, :npts]
+        syn = synthetic[rows, :npts]
+        hilbert = hilbert_transform(np.concatenate([obs, syn]))
+        hilbert_syn = hilbert[len(rows) :]
+        esyn = np.hypot(syn, hilbert_syn)
+        eobs = np.hypot(obs, hilbert[: len(rows)])
+        ersd = eobs - esyn
+
+        misfits[rows] = 0.5 * simps(
+            y=ersd * ersd * weights[rows, np.newaxis], dx=delta, axis=-1
+        )
+
+        if adjoint_src is True:
+            etmp = ersd / esyn
+            adjoint_source = etmp * syn - hilbert_transform(
+                etmp * hilbert_syn
+            )
+            adjoint_sources[rows, :npts] = (
+                adjoint_source * weights[rows, np.newaxis] * delta
+            )
+
+    ret_val = {"misfit": misfits}
+    if adjoint_src is True:
+        ret_val["adjoint_source"] = adjoint_sources
+    return ret_val
@@ -13,7 +13,6 @@ import warnings
 import numexpr as ne
 import numpy as np
 import obspy
-from obspy.signal.interpolation import lanczos_interpolation
 from lasif.tools.adjoint import utils
 from lasif.tools.adjoint import time_frequency
 from lasif.exceptions import LASIFAdjointSourceCalculationError
@@ -64,6 +63,18 @@ ADDITIONAL_PARAMETERS = r"""
 **taper_type** (:class:`float`)
     The taper type, supports anything :meth:`obspy.core.trace.Trace.taper`
     can use. Defaults to ``"cosine"``.
+
+**frequency_cutoff** (:class:`float`)
+    Only compute the time frequency representations up to a frequency of
+    ``frequency_cutoff / min_period``. Higher frequencies are suppressed
+    exponentially by the weighting anyway, at ``2.0`` the weight has dropped
+    to ``exp(-10)``. Memory then scales with the number of retained
+    frequencies instead of the square of the number of samples. Defaults to
+    ``None``, which computes all frequencies.
+
+**single_precision** (:class:`bool`)
+    Compute the time frequency representations in single precision
+    (``complex64``). Defaults to ``False``.
 """
 
 
@@ -79,6 +90,8 @@ def calculate_adjoint_source(
     taper=True,
     taper_ratio=0.15,
     taper_type="cosine",
+    frequency_cutoff=None,
+    single_precision=False,
     **kwargs
 ):
     """
@@ -94,8 +107,6 @@ def calculate_adjoint_source(
     t = observed.times(type="relative")
     assert t[0] == 0
 
-    ret_dict = {}
-
     if window:
         if len(window) == 2:
             window_weight = 1.0
@@ -126,6 +137,133 @@ def calculate_adjoint_source(
             **kwargs
         )
 
+    phase_jump, ret_dict = _calculate_adjoint_source(
+        observed_data=observed.data,
+        synthetic_data=synthetic.data,
+        t=t,
+        window_weight=window_weight,
+        min_period=min_period,
+        max_period=max_period,
+        adjoint_src=adjoint_src,
+        max_criterion=max_criterion,
+        frequency_cutoff=frequency_cutoff,
+        single_precision=single_precision,
+    )
+
+    if ret_dict["adjoint_source"] is not None:
+        adj_src = obspy.Trace(
+            data=ret_dict["adjoint_source"], header=observed.stats
+        )
+        # No further windowing of the empty adjoint source of a phase jump.
+        if window and not phase_jump:
+            adj_src = utils.window_trace(
+                trace=adj_src,
+                window=window,
+                taper=taper,
+                taper_ratio=taper_ratio,
+                taper_type=taper_type,
+                **kwargs
+            )
+        ret_dict["adjoint_source"] = adj_src
+
+    return ret_dict
+
+
+def calculate_adjoint_source_array(
+    observed,
+    synthetic,
+    stats,
+    window,
+    window_slice,
+    min_period,
+    max_period,
+    adjoint_src,
+    plot=False,
+    max_criterion=7.0,
+    taper=True,
+    taper_ratio=0.15,
+    taper_type="cosine",
+    frequency_cutoff=None,
+    single_precision=False,
+    **kwargs
+):
+    """
+    Array version of :func:`calculate_adjoint_source` with the same results.
+
+    The ``observed`` and ``synthetic`` arrays are windowed in place.
+
+    :param stats: Header shared by the observed and synthetic data.
+    :param window_slice: Start and end index of the window as returned by
+        :func:`lasif.tools.adjoint.utils.window_slice`.
+    :rtype: dictionary
+    :returns: The dictionary of :func:`calculate_adjoint_source` with the
+        adjoint source as a numpy array.
+    """
+    # Same as Trace.times(type="relative").
+    t = np.arange(stats.npts) / stats.sampling_rate
+
+    if window:
+        if len(window) == 2:
+            window_weight = 1.0
+        else:
+            window_weight = window[2]
+    else:
+        window_weight = 1.0
+
+    win_taper = None
+    if window:
+        if taper:
+            win_taper = utils.get_taper(
+                window_slice[1] - window_slice[0], taper_ratio, taper_type
+            )
+        utils.window_array(observed, window_slice, win_taper, out=observed)
+        utils.window_array(synthetic, window_slice, win_taper, out=synthetic)
+
+    phase_jump, ret_dict = _calculate_adjoint_source(
+        observed_data=observed,
+        synthetic_data=synthetic,
+        t=t,
+        window_weight=window_weight,
+        min_period=min_period,
+        max_period=max_period,
+        adjoint_src=adjoint_src,
+        max_criterion=max_criterion,
+        frequency_cutoff=frequency_cutoff,
+        single_precision=single_precision,
+    )
+
+    if ret_dict["adjoint_source"] is not None and window and not phase_jump:
+        utils.window_array(
+            ret_dict["adjoint_source"],
+            window_slice,
+            win_taper,
+            out=ret_dict["adjoint_source"],
+        )
+
+    return ret_dict
+
+
+def _calculate_adjoint_source(
+    observed_data,
+    synthetic_data,
+    t,
+    window_weight,
+    min_period,
+    max_period,
+    adjoint_src,
+    max_criterion,
+    frequency_cutoff,
+    single_precision,
+):
+    """
+    Misfit and adjoint source of already windowed data arrays.
+
+    :param t: Time of the samples relative to the first one.
+    :rtype: tuple
+    :returns: Whether a phase jump has been detected and the dictionary of
+        :func:`calculate_adjoint_source` with the adjoint source as a not yet
+        windowed numpy array. It is ``None`` if not requested.
+    """
     messages = []
 
     # Internal sampling interval. Some explanations for this "magic" number.
@@ -156,30 +294,38 @@ def calculate_adjoint_source(
     # Interpolate both signals to the new time axis - this massively speeds
     # up the whole procedure as most signals are highly oversampled. The
     # adjoint source at the end is re-interpolated to the original sampling
-    # points.
-    data = lanczos_interpolation(
-        data=observed.data,
+    # points. The resampling operators are cached, all traces of an event
+    # usually share them.
+    data = utils.lanczos_resample(
+        data=observed_data,
         old_start=t[0],
         old_dt=t[1] - t[0],
         new_start=t[0],
         new_dt=dt_new,
         new_npts=len(ti),
         a=8,
-        window="blackmann",
     )
-    synthetic = lanczos_interpolation(
-        data=synthetic.data,
+    synthetic = utils.lanczos_resample(
+        data=synthetic_data,
         old_start=t[0],
         old_dt=t[1] - t[0],
         new_start=t[0],
         new_dt=dt_new,
         new_npts=len(ti),
         a=8,
-        window="blackmann",
     )
     original_time = t
     t = ti
 
+    # Only compute frequencies up to the cutoff, the transforms' frequency k
+    # is k / (len(t) * dt_new).
+    if frequency_cutoff:
+        n_freqs = int(frequency_cutoff / min_period * len(t) * dt_new) + 1
+        n_freqs = max(n_freqs, 2)
+    else:
+        n_freqs = None
+    tf_dtype = "complex64" if single_precision else "complex128"
+
     # -------------------------------------------------------------------------
     # Compute time-frequency representations
 
@@ -188,11 +334,11 @@ def calculate_adjoint_source(
 
     # Compute time-frequency representation of the cross-correlation
     _, _, tf_cc = time_frequency.time_frequency_cc_difference(
-        t, data, synthetic, width
+        t, data, synthetic, width, n_freqs=n_freqs, dtype=tf_dtype
     )
     # Compute the time-frequency representation of the synthetic
     tau, nu, tf_synth = time_frequency.time_frequency_transform(
-        t, synthetic, width
+        t, synthetic, width, n_freqs=n_freqs, dtype=tf_dtype
     )
 
     # -------------------------------------------------------------------------
@@ -262,25 +408,27 @@ def calculate_adjoint_source(
         messages.append(warning)
 
         ret_dict = {
-            "adjoint_source": obspy.Trace(
-                data=np.zeros_like(observed.data), header=observed.stats
-            ),
+            "adjoint_source": np.zeros_like(observed_data),
             "misfit": phase_misfit * 2.0,
             "details": {"messages": messages},
         }
 
-        return ret_dict
+        return True, ret_dict
+
+    adj_src = None
     if adjoint_src:
         # Make kernel for the inverse tf transform
         idp = ne.evaluate(
             "weight ** 2 * DP * tf_synth / (m + abs(tf_synth) ** 2)"
-        )
+        ).astype(tf_dtype, copy=False)
 
         # Invert tf transform and make adjoint source
-        ad_src, it, I = time_frequency.itfa(tau, idp, width)
+        ad_src, it, _ = time_frequency.itfa(
+            tau, idp, width, return_inverse=False
+        )
 
         # Interpolate both signals to the new time axis
-        ad_src = lanczos_interpolation(
+        ad_src = utils.lanczos_resample(
             # Pad with a couple of zeros in case some where lost in all
             # these resampling operations. The first sample should not
             # change the time.
@@ -291,8 +439,7 @@ def calculate_adjoint_source(
             new_dt=original_time[1] - original_time[0],
             new_npts=len(original_time),
             a=8,
-            window="blackmann",
-        )
+            )
 
         # Divide by the misfit and change sign.
         ad_src /= phase_misfit + eps
@@ -303,18 +450,7 @@ def calculate_adjoint_source(
         # ad_src = ad_src[::-1]
 
         # Calculate actual adjoint source. Not time reversed
-        adj_src = obspy.Trace(
-            data=ad_src * window_weight, header=observed.stats
-        )
-        if window:
-            adj_src = utils.window_trace(
-                trace=adj_src,
-                window=window,
-                taper=taper,
-                taper_ratio=taper_ratio,
-                taper_type=taper_type,
-                **kwargs
-            )
+        adj_src = ad_src * window_weight
 
     ret_dict = {
         "adjoint_source": adj_src,
@@ -322,4 +458,4 @@ def calculate_adjoint_source(
         "details": {"messages": messages},
     }
 
-    return ret_dict
+    return False, ret_dict
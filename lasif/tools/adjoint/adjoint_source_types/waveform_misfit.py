@@ -18,9 +18,12 @@ from __future__ import (
     unicode_literals,
 )
 
+import numpy as np
 from obspy import Trace
 from scipy.integrate import simps
 
+from lasif.tools.adjoint.utils import group_rows
+
 
 # This is the verbose and pretty name of the adjoint source defined in this
 # function.
@@ -121,3 +124,68 @@ def calculate_adjoint_source(
         ret_val["adjoint_source"] = adj_src
 
     return ret_val
+
+
+def calculate_adjoint_source_array(
+    observed, synthetic, stats, window, window_slice, adjoint_src, **kwargs
+):  # NOQA
+    """
+    Array version of :func:`calculate_adjoint_source` with the same results.
+
+    :param stats: Header shared by the observed and synthetic data.
+    :param window_slice: Start and end index of the window.
+    """
+    ret_val = {}
+    scaling = 1.0
+    if len(window) == 2:
+        weight = 1.0 * scaling
+    else:
+        weight = window[2] * scaling
+
+    diff = observed - synthetic
+    # Integrate with the composite Simpson's rule.
+    ret_val["misfit"] = 0.5 * simps(y=diff ** 2, dx=stats.delta)
+
+    if adjoint_src is True:
+        diff *= weight
+        diff *= stats.delta
+        ret_val["adjoint_source"] = diff
+
+    return ret_val
+
+
+def calculate_adjoint_source_batch(
+    observed, synthetic, lengths, deltas, windows, adjoint_src, **kwargs
+):  # NOQA
+    """
+    Batched version of :func:`calculate_adjoint_source_array` for many
+    windows at once, with the same results.
+
+    :param observed: Windowed observed data, one window per row. Rows of
+        shorter traces are padded with zeros.
+    :type observed: 2D :class:`numpy.ndarray`
+    :param synthetic: Windowed synthetic data, laid out as ``observed``.
+    :type synthetic: 2D :class:`numpy.ndarray`
+    :param lengths: Number of valid samples of every row.
+    :param deltas: Sampling interval of every row.
+    :param windows: The window of every row.
+    :return: Dictionary with the ``misfit`` of every row and, if
+        requested, the ``adjoint_source`` rows, not yet windowed again.
+    """
+    weights = np.array([1.0 if len(_w) == 2 else _w[2] for _w in windows])
+
+    diff = observed - synthetic
+    misfits = np.empty(len(diff))
+    for rows, npts, delta in group_rows(lengths, deltas):
+        # Integrate with the composite Simpson's rule.
+        misfits[rows] = 0.5 * simps(
+            y=diff[rows, :npts] ** 2, dx=delta, axis=-1
+        )
+    ret_val = {"misfit": misfits}
+
+    if adjoint_src is True:
+        diff *= weights[:, np.newaxis]
+        diff *= np.asarray(deltas)[:, np.newaxis]
+        ret_val["adjoint_source"] = diff
+
+    return ret_val
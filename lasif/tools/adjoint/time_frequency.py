@@ -1,16 +1,105 @@
 import numpy as np
+import scipy.fft
 import scipy.fftpack
 import scipy.interpolate
 
 from lasif.tools.adjoint import utils
 
 
-def time_frequency_transform(t, s, width, threshold=1e-2):
+def gaussian_window_rows(t, width):
+    """
+    Gaussian windows centred on every sample of a regularly sampled time
+    axis.
+
+    Row ``k`` of the returned array is ``gaussian_window(t - t[k], width)``.
+    As all rows are shifted copies of each other, the array is a read-only
+    strided view on a single vector of length ``2 * len(t) - 1`` and does
+    not allocate an N x N array by itself.
+
+    :param t: discrete, regularly sampled time.
+    :param width: width of the Gaussian window
+    """
+    N = len(t)
+    lags = np.concatenate([t[0] - t[:0:-1], t - t[0]])
+    g = utils.gaussian_window(lags, width)
+    return np.lib.stride_tricks.sliding_window_view(g, N)[::-1]
+
+
+def time_frequency_transform(
+    t,
+    s,
+    width,
+    threshold=1e-2,
+    workers=None,
+    block_size=256,
+    n_freqs=None,
+    dtype="complex128",
+):
     """
     Gabor transform (time frequency transform with Gaussian windows).
 
     Data will be resampled before it is transformed.
 
+    The windowed signals are formed for blocks of time shifts at once and
+    each block is transformed with a single batched FFT call. Produces the
+    same output as :func:`_time_frequency_transform_loop`.
+
+    :param t: discrete time.
+    :param s: discrete signal.
+    :param width: width of the Gaussian window
+    :param threshold: fraction of the absolute signal below which the Fourier
+        transform is set to zero in order to reduce computation time
+    :param workers: Number of threads used by :func:`scipy.fft.fft`. ``-1``
+        uses all cores. Leave at the default within multiprocessing pools.
+    :param block_size: Number of time shifts transformed per FFT call. Bounds
+        the size of the temporary arrays.
+    :param n_freqs: Only return the first ``n_freqs`` frequencies. The
+        returned arrays then have ``n_freqs`` instead of ``len(t)`` columns.
+    :param dtype: ``"complex128"`` or ``"complex64"``. The latter computes
+        the transform in single precision.
+    """
+    N = len(t)
+    dt = t[1] - t[0]
+    K = N if n_freqs is None else min(int(n_freqs), N)
+    real_dtype = np.finfo(dtype).dtype
+
+    nu = np.linspace(0, float(N - 1) / (N * dt), N)[:K]
+
+    # Row k holds the window centred around t[k].
+    windows = gaussian_window_rows(t, width)
+    threshold = np.abs(s).max() * threshold
+
+    # Compute the time frequency representation
+    tfs = np.zeros((N, K), dtype=dtype)
+
+    for start in range(0, N, block_size):
+        # Window the signals
+        f = np.multiply(
+            windows[start : start + block_size], s, dtype=real_dtype
+        )
+
+        # No need to transform if nothing is there. Great speedup as lots of
+        # windowed functions have 0 everywhere.
+        active = np.abs(f).max(axis=1) >= threshold
+        if active.all():
+            tfs[start : start + block_size] = scipy.fft.fft(
+                f, axis=1, workers=workers
+            )[:, :K]
+        elif active.any():
+            tfs[start : start + block_size][active] = scipy.fft.fft(
+                f[active], axis=1, workers=workers
+            )[:, :K]
+
+    tfs *= dt / np.sqrt(2.0 * np.pi)
+
+    return t, nu, tfs
+
+
+def _time_frequency_transform_loop(t, s, width, threshold=1e-2):
+    """
+    Reference implementation of :func:`time_frequency_transform` looping
+    over all time shifts. Kept for testing and benchmarking.
+
     :param t: discrete time.
     :param s: discrete signal.
     :param width: width of the Gaussian window
@@ -43,10 +132,126 @@ def time_frequency_transform(t, s, width, threshold=1e-2):
     return t, nu, tfs
 
 
-def time_frequency_cc_difference(t, s1, s2, width, threshold=1e-2):
+def _linear_interpolation_weights(x, x_new):
+    """
+    Indices and weights to linearly interpolate values sampled at ``x`` onto
+    ``x_new``, the same way :class:`scipy.interpolate.interp1d` does.
+
+    Returns ``(lo, hi, weight)`` so that the interpolated values of ``y``
+    are ``y[..., lo] + weight * (y[..., hi] - y[..., lo])``.
+
+    :param x: Sample points. Need not be sorted.
+    :param x_new: Points to interpolate at.
+    """
+    order = np.argsort(x, kind="mergesort")
+    x_sorted = x[order]
+    if x_new.min() < x_sorted[0] or x_new.max() > x_sorted[-1]:
+        raise ValueError(
+            "A value in x_new is outside the interpolation range."
+        )
+
+    idx = np.clip(np.searchsorted(x_sorted, x_new), 1, len(x) - 1)
+    weight = (x_new - x_sorted[idx - 1]) / (x_sorted[idx] - x_sorted[idx - 1])
+    return order[idx - 1], order[idx], weight
+
+
+def time_frequency_cc_difference(
+    t,
+    s1,
+    s2,
+    width,
+    threshold=1e-2,
+    workers=None,
+    block_size=256,
+    n_freqs=None,
+    dtype="complex128",
+):
+    """
+    Time frequency representation of the cross correlation of two signals.
+    Port of tfa_cc_new.m.
+
+    The Fourier transform of the (zero padded, circular) cross correlation
+    of two windowed signals is the product of their spectra, so no
+    correlation is computed explicitly. Blocks of time shifts are
+    transformed with one batched FFT call each and all rows are
+    interpolated onto the output frequencies at once. Produces the same
+    output as :func:`_time_frequency_cc_difference_loop`.
+
+    :param t: discrete time
+    :param s1: discrete signal 1
+    :param s2: discrete signal 2
+    :param width: width of the Gaussian window
+    :param threshold: fraction of the absolute signal below which the Fourier
+        transform is set to zero in order to reduce computation time
+    :param workers: Number of threads used by :func:`scipy.fft.fft`. ``-1``
+        uses all cores. Leave at the default within multiprocessing pools.
+    :param block_size: Number of time shifts transformed per FFT call. Bounds
+        the size of the temporary arrays.
+    :param n_freqs: Only return the first ``n_freqs`` frequencies. The
+        returned time frequency representation then has ``n_freqs`` instead
+        of ``len(t)`` columns.
+    :param dtype: ``"complex128"`` or ``"complex64"``. The latter computes
+        the transform in single precision.
+    """
+    dt = t[1] - t[0]
+
+    # Extend the time axis, required for the correlation
+    N = len(t)
+    K = N if n_freqs is None else min(int(n_freqs), N)
+    real_dtype = np.finfo(dtype).dtype
+    t_cc = np.linspace(t[0], t[0] + (2 * N - 2) * dt, (2 * N - 1))
+
+    N_cc = len(t_cc)
+    dnu = 1.0 / (N_cc * dt)
+
+    nu = np.linspace(0, (N_cc - 1) * dnu, N_cc)
+    tau = t_cc
+
+    cc_freqs = scipy.fftpack.fftfreq(N_cc, d=dt)
+    freqs = scipy.fftpack.fftfreq(N, d=dt)[:K]
+    lo, hi, weight = _linear_interpolation_weights(cc_freqs, freqs)
+
+    # Row k holds the window centred around tau[k] = t[k].
+    windows = gaussian_window_rows(t, width)
+    threshold = np.abs(s1).max() * threshold
+
+    # Compute the time frequency representation
+    tfs = np.zeros((N, K), dtype=dtype)
+
+    for start in range(0, N, block_size):
+        # Window the signals
+        w = windows[start : start + block_size]
+        f1 = np.multiply(w, s1, dtype=real_dtype)
+        f2 = np.multiply(w, s2, dtype=real_dtype)
+
+        active = (
+            np.minimum(np.abs(f1).max(axis=1), np.abs(f2).max(axis=1))
+            >= threshold
+        )
+        if not active.any():
+            continue
+        if not active.all():
+            f1 = f1[active]
+            f2 = f2[active]
+
+        cc_spec = scipy.fft.fft(f2, n=N_cc, axis=1, workers=workers)
+        cc_spec *= scipy.fft.fft(f1, n=N_cc, axis=1, workers=workers).conj()
+
+        tfs[start : start + block_size][active] = cc_spec[:, lo] + weight * (
+            cc_spec[:, hi] - cc_spec[:, lo]
+        )
+    tfs *= dt / np.sqrt(2.0 * np.pi)
+
+    return tau, nu, tfs
+
+
+def _time_frequency_cc_difference_loop(t, s1, s2, width, threshold=1e-2):
     """
     Straight port of tfa_cc_new.m
 
+    Reference implementation of :func:`time_frequency_cc_difference`
+    looping over all time shifts. Kept for testing and benchmarking.
+
     :param t: discrete time
     :param s1: discrete signal 1
     :param s2: discrete signal 2
@@ -92,7 +297,83 @@ def time_frequency_cc_difference(t, s1, s2, width, threshold=1e-2):
     return tau, nu, tfs
 
 
-def itfa(tau, tfs, width, threshold=1e-2):
+def itfa(
+    tau,
+    tfs,
+    width,
+    threshold=1e-2,
+    workers=None,
+    block_size=256,
+    return_inverse=True,
+):
+    """
+    Inverse time frequency transform.
+
+    Blocks of rows above the threshold are inverse transformed with batched
+    IFFT calls. The Gaussian is symmetric, so the time integration
+    ``s[k] = sum_j g(tau[k] - tau[j]) I[j, k]`` is accumulated block by
+    block as the column sums of the shifted Gaussian windows times the
+    inverse transformed rows. Produces the same output as :func:`_itfa_loop`
+    up to rounding.
+
+    :param tau: discrete time
+    :param tfs: time frequency representation. Can have fewer columns than
+        samples in which case the missing frequencies are assumed to be zero.
+    :param width: width of the Gaussian window
+    :param threshold: fraction of the absolute maximum below which rows of
+        the time frequency representation are not transformed
+    :param workers: Number of threads used by :func:`scipy.fft.ifft`. ``-1``
+        uses all cores. Leave at the default within multiprocessing pools.
+    :param block_size: Number of rows handled per batch. Bounds the size of
+        the temporary arrays.
+    :param return_inverse: Also assemble and return the full N x N inverse
+        transform. If ``False``, ``None`` is returned in its place and the
+        memory use only scales with the size of ``tfs``.
+    """
+    N = len(tau)
+    dt = tau[1] - tau[0]
+    dtype = np.result_type(tfs.dtype, np.complex64)
+
+    threshold = np.abs(tfs).max() * threshold
+
+    windows = gaussian_window_rows(tau, width)
+
+    # inverse fft
+    I = np.zeros((N, N), dtype=dtype) if return_inverse else None
+    s = np.zeros(N, dtype="complex128")
+
+    for start in range(0, N, block_size):
+        block = tfs[start : start + block_size]
+        active = np.abs(block).max(axis=1) >= threshold
+        if not active.any():
+            continue
+
+        # IFFT and scaling.
+        if active.all():
+            inverse = scipy.fft.ifft(block, n=N, axis=1, workers=workers)
+        else:
+            inverse = np.zeros((len(block), N), dtype=dtype)
+            inverse[active] = scipy.fft.ifft(
+                block[active], n=N, axis=1, workers=workers
+            )
+        inverse *= 2.0 * np.pi / dt
+        if I is not None:
+            I[start : start + block_size] = inverse
+
+        # time integration
+        s += (windows[start : start + block_size] * inverse).sum(axis=0)
+
+    s *= dt
+    s *= dt / np.sqrt(2.0 * np.pi)
+
+    return s, tau, I
+
+
+def _itfa_loop(tau, tfs, width, threshold=1e-2):
+    """
+    Reference implementation of :func:`itfa` looping over all time shifts.
+    Kept for testing and benchmarking.
+    """
     N = len(tau)
     dt = tau[1] - tau[0]
 
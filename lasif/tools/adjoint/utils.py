@@ -1,9 +1,14 @@
+import functools
 import inspect
 import matplotlib.pyplot as plt
 import os
 import numpy as np
 
 import obspy
+from obspy.core import compatibility
+from obspy.signal.interpolation import lanczos_interpolation
+from scipy.fft import irfft, rfft
+import scipy.sparse
 
 
 EXAMPLE_DATA_PDIFF = (800, 900)
@@ -42,6 +47,238 @@ def window_trace(trace, window, taper, taper_ratio, taper_type, **kwargs):
     return trace
 
 
+def window_slice(stats, window):
+    """
+    Index range of the samples :func:`window_trace` keeps for a window.
+
+    Follows the nearest sample logic of :meth:`obspy.core.trace.Trace.trim`
+    so that ``data[start:end]`` are exactly the samples of the trimmed trace.
+
+    :param stats: Header of the data to be windowed.
+    :type stats: :class:`obspy.core.trace.Stats`
+    :param window: Tuple with UTCDateTime objects for start and end time and
+        potentially a weight as well.
+    :type window: tuple
+    :return: Tuple of start and end index.
+    """
+    npts = stats.npts
+    # Left trim, never moves to the left of the first sample.
+    start = compatibility.round_away(
+        (window[0] - stats.starttime) * stats.sampling_rate
+    )
+    start = min(max(int(start), 0), npts)
+    starttime = stats.starttime + start * stats.delta
+
+    # Right trim, relative to the new starttime.
+    length = npts - start
+    delta = int(
+        compatibility.round_away(
+            (window[1] - starttime) * stats.sampling_rate
+        )
+        - length
+        + 1
+    )
+    if delta < 0:
+        length = max(length + delta, 0)
+    return start, start + length
+
+
+@functools.lru_cache(maxsize=256)
+def get_taper(npts, taper_ratio, taper_type):
+    """
+    Taper of the given length as applied by
+    :meth:`obspy.core.trace.Trace.taper`.
+
+    The tapers are cached and returned as read-only arrays.
+
+    :param npts: Number of samples.
+    :type npts: int
+    :param taper_ratio: Decimal percentage of taper at one end.
+    :type taper_ratio: float
+    :param taper_type: The taper type, supports anything
+        :meth:`obspy.core.trace.Trace.taper` can use.
+    :type taper_type: str
+    """
+    taper = obspy.Trace(data=np.ones(npts)).taper(
+        max_percentage=taper_ratio, type=taper_type
+    )
+    taper = taper.data
+    taper.flags.writeable = False
+    return taper
+
+
+def window_array(data, window_slice, taper=None, out=None):
+    """
+    Array version of :func:`window_trace`.
+
+    Zeros everything outside of the window and tapers the inside. Gives the
+    same result as :func:`window_trace` for the slice computed with
+    :func:`window_slice` and the taper from :func:`get_taper`.
+
+    :param data: The data to be windowed.
+    :type data: numpy.ndarray
+    :param window_slice: Start and end index of the window.
+    :type window_slice: tuple
+    :param taper: Taper with ``end - start`` samples or ``None`` to not
+        taper.
+    :type taper: numpy.ndarray
+    :param out: Array to write the result to. Can be ``data`` itself to
+        window in place. A new array is allocated if not given.
+    :type out: numpy.ndarray
+    """
+    start, end = window_slice
+    if out is None:
+        out = np.empty_like(data)
+    if taper is None:
+        out[start:end] = data[start:end]
+    else:
+        np.multiply(data[start:end], taper, out=out[start:end])
+    out[:start] = 0.0
+    out[end:] = 0.0
+    return out
+
+
+@functools.lru_cache(maxsize=64)
+def _hilbert_multiplier(npts):
+    """
+    Spectral multiplier of the Hilbert transform of ``npts`` samples.
+
+    The multiplier is ``-1j`` for the positive frequencies and zero at zero
+    and the Nyquist frequency, as in :func:`scipy.signal.hilbert`.
+    """
+    multiplier = np.full(npts // 2 + 1, -1j)
+    multiplier[0] = 0.0
+    if npts % 2 == 0:
+        multiplier[-1] = 0.0
+    multiplier.flags.writeable = False
+    return multiplier
+
+
+def hilbert_transform(data):
+    """
+    Hilbert transform of real data along the last axis.
+
+    Same as ``scipy.signal.hilbert(data).imag``, the transform is circular
+    over the ``npts`` samples of the data. Only real FFTs are used, the
+    multipliers are cached per number of samples, and 2D arrays are
+    transformed row by row in a single call.
+
+    The envelope of the data is ``numpy.hypot(data, hilbert_transform(
+    data))``.
+
+    :param data: The real data, a single trace or one trace per row.
+    :type data: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    npts = data.shape[-1]
+    spectrum = rfft(data, axis=-1)
+    spectrum *= _hilbert_multiplier(npts)
+    return irfft(spectrum, npts, axis=-1)
+
+
+@functools.lru_cache(maxsize=32)
+def get_lanczos_operator(npts, dt, dt_new, new_npts, a, start_offset=0.0):
+    """
+    Sparse matrix performing the Lanczos resampling of
+    :func:`obspy.signal.interpolation.lanczos_interpolation`.
+
+    Building the kernel is the expensive part of the resampling and only
+    depends on the sampling of the data, not on the data itself. The
+    operators are cached, so all traces sampled the same way, e.g. all
+    components and stations of an event, share one.
+
+    :param npts: Number of samples of the data.
+    :type npts: int
+    :param dt: Sampling interval of the data.
+    :type dt: float
+    :param dt_new: Sampling interval after resampling.
+    :type dt_new: float
+    :param new_npts: Number of samples after resampling.
+    :type new_npts: int
+    :param a: Width of the Lanczos kernel in samples.
+    :type a: int
+    :param start_offset: Time of the first new sample relative to the first
+        sample of the data.
+    :type start_offset: float
+    :rtype: :class:`scipy.sparse.csr_matrix` of shape ``(new_npts, npts)``
+    """
+    # Every new sample depends on at most 2 * a + 2 consecutive samples of
+    # the data. Resampling combs of unit impulses that far apart thus yields
+    # every coefficient of the kernel exactly once.
+    spacing = 2 * a + 2
+    positions = start_offset / dt + np.arange(new_npts) * (dt_new / dt)
+    first = np.floor(positions).astype(np.int64) - a
+    rows, cols, values = [], [], []
+    for k in range(min(spacing, npts)):
+        comb = np.zeros(npts)
+        comb[k::spacing] = 1.0
+        response = lanczos_interpolation(
+            data=comb,
+            old_start=0.0,
+            old_dt=dt,
+            new_start=start_offset,
+            new_dt=dt_new,
+            new_npts=new_npts,
+            a=a,
+        )
+        # The impulse within the support of every new sample.
+        col = first + (k - first) % spacing
+        (row,) = np.nonzero(response)
+        rows.append(row)
+        cols.append(col[row])
+        values.append(response[row])
+    operator = scipy.sparse.csr_matrix(
+        (
+            np.concatenate(values),
+            (np.concatenate(rows), np.concatenate(cols)),
+        ),
+        shape=(new_npts, npts),
+    )
+    operator.sort_indices()
+    return operator
+
+
+def lanczos_resample(data, old_start, old_dt, new_start, new_dt, new_npts, a):
+    """
+    Same as :func:`obspy.signal.interpolation.lanczos_interpolation` with
+    the default Lanczos window, using a cached operator from
+    :func:`get_lanczos_operator`.
+
+    :param data: The data to resample, one trace or one trace per column.
+    :type data: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    operator = get_lanczos_operator(
+        len(data), old_dt, new_dt, new_npts, a, new_start - old_start
+    )
+    return operator @ np.require(data, dtype=np.float64)
+
+
+def group_rows(lengths, deltas):
+    """
+    Group the rows of a batch of traces by their number of samples and
+    sampling interval.
+
+    Batched kernels evaluate each group with one vectorized call on
+    ``data[rows, :npts]``, which gives the same results as evaluating the
+    traces one by one.
+
+    :param lengths: Number of valid samples of every row.
+    :type lengths: numpy.ndarray
+    :param deltas: Sampling interval of every row.
+    :type deltas: numpy.ndarray
+    :return: Generator of tuples of the row indices, the number of samples
+        and the sampling interval of every group.
+    """
+    lengths = np.asarray(lengths)
+    deltas = np.asarray(deltas, dtype=np.float64)
+    keys = np.stack([lengths.astype(np.float64), deltas], axis=-1)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    for i, (npts, delta) in enumerate(unique):
+        yield np.nonzero(inverse == i)[0], int(npts), float(delta)
+
+
 def get_example_data():
     """
     Helper function returning example data for SalvusMisft.
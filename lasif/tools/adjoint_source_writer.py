@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming writer for the adjoint sources of an event.
+
+The results of the stations are written to the auxiliary ASDF file of the
+event while the workers are still busy, in small batches, instead of being
+collected in memory until the last station is done. After every batch, the
+completed stations are appended to a ledger next to the auxiliary file. An
+interrupted run can thus resume where it stopped, see :func:`read_ledger`.
+
+The ledger has one JSON object per line::
+
+    {"station": "NET.STA", "misfit": 1.23}
+    ...
+    {"complete": true}
+
+``misfit`` is the unweighted misfit of the station, or null if none of its
+components had an adjoint source. The last line is only written once the
+event has been written and finalized completely.
+
+Usage::
+
+    feed = BackPressure(tasks, max_pending=64)
+    with AdjointSourceWriter(filename, ledger) as writer, feed:
+        for station, value in pool.imap_unordered(fct, feed):
+            writer.add(station, value)
+            feed.done()
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import json
+import os
+import threading
+
+import h5py
+import pyasdf
+
+from lasif.exceptions import LASIFError
+from lasif.tools.stage_timing import stage
+
+
+def read_ledger(filename):
+    """
+    Read the ledger of an event.
+
+    :param filename: The ledger file
+    :type filename: str
+    :return: Tuple of a dictionary with the unweighted misfit of every
+        completed station and whether the event is complete. Lines cut off
+        by an interruption are ignored.
+    """
+    stations = {}
+    complete = False
+    if not os.path.exists(filename):
+        return stations, complete
+    with open(filename, "r") as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("complete"):
+                complete = True
+            elif "station" in entry:
+                stations[entry["station"]] = entry["misfit"]
+    return stations, complete
+
+
+def mark_ledger_complete(filename):
+    """
+    Mark the event of a ledger as completely written and finalized.
+
+    :param filename: The ledger file
+    :type filename: str
+    """
+    with open(filename, "a") as fh:
+        fh.write(json.dumps({"complete": True}) + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+class AdjointSourceWriter(object):
+    """
+    Writes the adjoint sources of the stations of an event to its auxiliary
+    ASDF file as they arrive.
+
+    The auxiliary file is opened for every batch and closed again, so it
+    is complete and readable between batches.
+
+    :param filename: The auxiliary file of the event
+    :type filename: str
+    :param ledger_filename: The ledger of the event. It is started anew and
+        lists the kept stations first.
+    :type ledger_filename: str
+    :param reused: Unweighted misfits of the stations whose adjoint sources
+        are already in the auxiliary file and are kept. The adjoint sources
+        of all other stations are removed from the file first. Without it,
+        the adjoint sources are added to the file, defaults to None
+    :type reused: dict, optional
+    :param buffer_size: Number of stations buffered before they are
+        written, defaults to 32
+    :type buffer_size: int, optional
+    """
+
+    def __init__(
+        self,
+        filename,
+        ledger_filename,
+        reused: dict = None,
+        buffer_size: int = 32,
+    ):
+        self.filename = filename
+        self.ledger_filename = ledger_filename
+        self.buffer_size = buffer_size
+        self.station_misfits = dict(reused or {})
+        self.adjoint_sources_written = 0
+        self._buffer = []
+        self._closed = False
+
+        if reused is not None and os.path.exists(filename):
+            keep = {_s.replace(".", "_") for _s in reused}
+            with h5py.File(filename, "a") as f:
+                group = f.get("AuxiliaryData/AdjointSources")
+                for name in list(group or []):
+                    if name not in keep:
+                        del group[name]
+
+        tmp_filename = f"{ledger_filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, "w") as fh:
+            for station, misfit in self.station_misfits.items():
+                fh.write(json.dumps({"station": station, "misfit": misfit}))
+                fh.write("\n")
+        os.replace(tmp_filename, ledger_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Keep what has been written so far in case of an error, so the
+        # run can be resumed.
+        self.close()
+
+    @property
+    def total_misfit(self):
+        """
+        Unweighted misfit of all stations written or kept so far.
+        """
+        return float(
+            sum(_m for _m in self.station_misfits.values() if _m is not None)
+        )
+
+    def add(self, station: str, value: dict):
+        """
+        Queue the results of a station for writing. The buffer is written
+        once it holds ``buffer_size`` stations.
+
+        :param station: Name of station
+        :type station: str
+        :param value: The misfit and adjoint source of every channel of the
+            station, by channel id. Empty if the station has no adjoint
+            sources.
+        :type value: dict
+        """
+        if self._closed:
+            raise LASIFError(f"Writer of {self.filename} is already closed.")
+        self._buffer.append((station, value))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered stations to the auxiliary file, then record them
+        in the ledger.
+        """
+        if not self._buffer:
+            return
+        misfits = []
+        with stage("write_adjoint_sources"), pyasdf.ASDFDataSet(
+            filename=self.filename, mpi=False, mode="a"
+        ) as ds:
+            for station, value in self._buffer:
+                station_misfit = None
+                for c_id, adj_source in value.items():
+                    net, sta, loc, cha = c_id.split(".")
+                    ds.add_auxiliary_data(
+                        data=adj_source["adj_source"],
+                        data_type="AdjointSources",
+                        path="%s_%s/Channel_%s_%s" % (net, sta, loc, cha),
+                        parameters={"misfit": adj_source["misfit"]},
+                    )
+                    station_misfit = (station_misfit or 0.0) + adj_source[
+                        "misfit"
+                    ]
+                    self.adjoint_sources_written += 1
+                if station_misfit is not None:
+                    station_misfit = float(station_misfit)
+                misfits.append((station, station_misfit))
+
+        with open(self.ledger_filename, "a") as fh:
+            for station, misfit in misfits:
+                fh.write(json.dumps({"station": station, "misfit": misfit}))
+                fh.write("\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.station_misfits.update(misfits)
+        self._buffer = []
+
+    def close(self):
+        """
+        Write the remaining stations.
+        """
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+
+
+class BackPressure(object):
+    """
+    Feeds tasks to :meth:`multiprocessing.pool.Pool.imap_unordered` while
+    limiting the number of tasks that are being computed or whose results
+    wait to be consumed.
+
+    The pool takes tasks from the feed in a background thread, which blocks
+    once ``max_pending`` tasks are pending. Every consumed result has to be
+    acknowledged with :meth:`done`. The results of fast workers thus cannot
+    pile up in memory while they are being written.
+
+    :param tasks: The tasks
+    :type tasks: iterable
+    :param max_pending: Maximum number of pending tasks
+    :type max_pending: int
+    """
+
+    def __init__(self, tasks, max_pending: int):
+        self._tasks = tasks
+        self._slots = threading.Semaphore(max_pending)
+        self._stopped = threading.Event()
+
+    def __iter__(self):
+        for task in self._tasks:
+            self._slots.acquire()
+            if self._stopped.is_set():
+                return
+            yield task
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def done(self):
+        """
+        Acknowledge a consumed result.
+        """
+        self._slots.release()
+
+    def stop(self):
+        """
+        Stop feeding tasks. Unblocks the feeding thread, so the pool can be
+        shut down.
+        """
+        self._stopped.set()
+        self._slots.release()
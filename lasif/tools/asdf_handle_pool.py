@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent per-worker ASDF file handles for multiprocessing pools.
+
+Opening an ASDF file and parsing its metadata is expensive. The station
+tasks of the multiprocessing pipelines all read from the same few files, so
+each worker process opens every file once and reuses the handle for all
+the tasks it is given. With an active
+:class:`~lasif.tools.stage_timing.StageTimer`, every reused handle is
+counted as a call of the ``reuse_open_file`` stage.
+
+Usage::
+
+    opens_saved = multiprocessing.Value("i", 0)
+    with multiprocessing.Pool(
+        4,
+        initializer=init_worker_datasets,
+        initargs=({"processed": filename}, opens_saved),
+    ) as pool:
+        ...
+        pool.close()
+        pool.join()
+
+Within a task, call ``get_worker_dataset("processed")`` instead of opening
+the file. The handles are closed when the worker shuts down, so make sure
+to ``close()`` and ``join()`` the pool instead of terminating it.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+from multiprocessing.util import Finalize
+
+import pyasdf
+
+from lasif.exceptions import LASIFError
+from lasif.tools.stage_timing import count
+
+# State of the current worker process.
+_filenames = {}
+_datasets = {}
+_opens_saved = None
+_max_open = None
+
+
+def init_worker_datasets(
+    filenames: dict, opens_saved=None, max_open: int = None
+):
+    """
+    Pool initializer registering the files a worker will read from.
+
+    Files are opened lazily on first use so idle workers never touch them.
+
+    :param filenames: Dictionary mapping a key to an ASDF filename. Entries
+        with a filename of ``None`` are ignored. Instead of a filename, an
+        object with an ``open()`` method can be given, e.g. a
+        :class:`~lasif.tools.processed_synthetics_cache.ProcessedSyntheticsCache`.
+        Its ``open()`` is used to get the handle.
+    :type filenames: dict
+    :param opens_saved: Shared counter, incremented every time an already
+        open handle is reused instead of opening the file again.
+    :type opens_saved: :class:`multiprocessing.Value`, optional
+    :param max_open: Maximum number of files a worker keeps open. The least
+        recently used file is closed when another one has to be opened.
+        Useful if many files are registered, defaults to no limit.
+    :type max_open: int, optional
+    """
+    global _opens_saved, _max_open
+
+    close_worker_datasets()
+    _filenames.update(
+        {key: value for key, value in filenames.items() if value is not None}
+    )
+    _opens_saved = opens_saved
+    _max_open = max_open
+
+    # Runs when the worker exits after the pool has been closed and joined.
+    Finalize(None, close_worker_datasets, exitpriority=10)
+
+
+def get_worker_dataset(key: str):
+    """
+    Returns the open ASDF data set, or other handle, registered under the
+    given key.
+
+    :param key: The key used in :func:`init_worker_datasets`.
+    :type key: str
+    """
+    if key in _datasets:
+        # Shows up in the timing summary of the pipelines.
+        count("reuse_open_file")
+        if _opens_saved is not None:
+            with _opens_saved.get_lock():
+                _opens_saved.value += 1
+        # Move to the end, the first entry is the least recently used one.
+        _datasets[key] = _datasets.pop(key)
+        return _datasets[key]
+
+    if key not in _filenames:
+        raise LASIFError(
+            f"No ASDF file registered for '{key}' in this worker. Available: "
+            f"{', '.join(sorted(_filenames.keys()))}"
+        )
+    if _max_open is not None:
+        while len(_datasets) >= max(_max_open, 1):
+            ds = _datasets.pop(next(iter(_datasets)))
+            ds.__exit__(None, None, None)
+    if hasattr(_filenames[key], "open"):
+        _datasets[key] = _filenames[key].open()
+    else:
+        _datasets[key] = pyasdf.ASDFDataSet(
+            _filenames[key], mode="r", mpi=False
+        )
+    return _datasets[key]
+
+
+def close_worker_datasets():
+    """
+    Closes all data sets opened by the current worker.
+    """
+    while _datasets:
+        _, ds = _datasets.popitem()
+        ds.__exit__(None, None, None)
+    _filenames.clear()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batched writer for HDF5 files consisting of many small datasets that all
+share the same attributes, e.g. the source time function files of the
+adjoint sources with one dataset per receiver.
+
+Creating such datasets one by one through the high level h5py interface is
+dominated by the per dataset and per attribute overhead. The writer here
+buffers the datasets and writes them in chunks through the low level
+interface, reusing the data types, data spaces and attribute values. The
+resulting files are identical to the ones written with ``create_dataset``
+and ``attrs``.
+
+The datasets are not merged into a single 2-D dataset, as the layout of
+the files is fixed by their consumers. Salvus reads the source time
+function of every adjoint source from its own dataset, see
+``stf.Custom(filename, dataset_name)`` in :mod:`lasif.salvus_utils`,
+which also lists the receivers from the dataset names, and expects the
+attributes on every dataset.
+
+Usage::
+
+    with BatchH5Writer(filename, attributes={"dt": 0.1}) as writer:
+        for name, data in sources:
+            writer.add(name, data)
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import h5py
+import numpy as np
+from h5py import h5a, h5d, h5s, h5t
+
+from lasif.exceptions import LASIFError
+
+
+class BatchH5Writer(object):
+    """
+    Writes datasets with a common set of attributes to a new HDF5 file.
+
+    :param filename: The file to write. An existing file is overwritten.
+    :type filename: str
+    :param attributes: Attributes attached to every dataset.
+    :type attributes: dict, optional
+    :param chunk_size: Number of datasets buffered before they are written
+        to the file, defaults to 512
+    :type chunk_size: int, optional
+    """
+
+    def __init__(
+        self, filename, attributes: dict = None, chunk_size: int = 512
+    ):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.datasets_written = 0
+        self._buffer = []
+        self._types = {}
+        self._spaces = {}
+
+        # Values are converted the same way h5py does for ``attrs[k] = v``.
+        self._attributes = []
+        scalar = h5s.create(h5s.SCALAR)
+        for key, value in (attributes or {}).items():
+            value = np.asarray(value, order="C")
+            if value.shape != ():
+                raise LASIFError(f"Attribute '{key}' has to be a scalar.")
+            self._attributes.append(
+                (
+                    key.encode(),
+                    h5t.py_create(value.dtype, logical=True),
+                    scalar,
+                    value,
+                )
+            )
+
+        self._file = h5py.File(filename, "w")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, name: str, data: np.ndarray):
+        """
+        Queue a dataset for writing. The buffer is written to the file once
+        it holds ``chunk_size`` datasets.
+
+        :param name: Name of the dataset, relative to the file root.
+        :type name: str
+        :param data: Data of the dataset.
+        :type data: numpy.ndarray
+        """
+        if self._file is None:
+            raise LASIFError(f"File {self.filename} is already closed.")
+        self._buffer.append((name, np.ascontiguousarray(data)))
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered datasets to the file.
+        """
+        file_id = self._file.id
+        for name, data in self._buffer:
+            dataset = h5d.create(
+                file_id,
+                name.encode(),
+                self._get_type(data.dtype),
+                self._get_space(data.shape),
+            )
+            dataset.write(h5s.ALL, h5s.ALL, data)
+            for key, type_id, space_id, value in self._attributes:
+                attribute = h5a.create(dataset, key, type_id, space_id)
+                attribute.write(value)
+        self.datasets_written += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        """
+        Write the remaining datasets and close the file.
+        """
+        if self._file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+            self._file = None
+
+    def _get_type(self, dtype):
+        if dtype not in self._types:
+            self._types[dtype] = h5t.py_create(dtype, logical=True)
+        return self._types[dtype]
+
+    def _get_space(self, shape):
+        if shape not in self._spaces:
+            self._spaces[shape] = h5s.create_simple(shape)
+        return self._spaces[shape]
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content hashes of the inputs of the adjoint sources of every station.
+
+Incremental adjoint source runs store, per event and iteration, a hash of
+everything the adjoint sources of a station depend on: its processed data,
+its processed synthetics, its windows and the misfit configuration. A rerun
+only recomputes the stations whose hash changed and reuses the stored
+adjoint sources and misfits of all others.
+
+The hashes are stored in a small JSON file next to the adjoint sources::
+
+    {"version": 1,
+     "stations": {"NET.STA": {"hash": "...", "misfit": 1.23}, ...}}
+
+``misfit`` is the unweighted misfit of the station, or null if none of its
+components had an adjoint source.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import hashlib
+import json
+import os
+
+import h5py
+import numpy as np
+
+# Increase whenever the content of the hashes changes.
+HASH_VERSION = 1
+
+
+def _update_with_group(h, group):
+    """
+    Feed all datasets and attributes of an HDF5 group, in a fixed order, to
+    a hash.
+    """
+    for key in sorted(group.attrs):
+        h.update(key.encode())
+        h.update(np.asarray(group.attrs[key]).tobytes())
+    for name in sorted(group):
+        item = group[name]
+        h.update(name.encode())
+        if isinstance(item, h5py.Group):
+            _update_with_group(h, item)
+            continue
+        h.update(f"{item.dtype}{item.shape}".encode())
+        h.update(np.ascontiguousarray(item[()]).tobytes())
+        for key in sorted(item.attrs):
+            h.update(key.encode())
+            h.update(np.asarray(item.attrs[key]).tobytes())
+
+
+def compute_station_hashes(
+    processed_filename: str,
+    synthetics_filename: str,
+    stations: list,
+    windows: dict,
+    config: dict,
+):
+    """
+    Hash the inputs of the adjoint sources of stations.
+
+    :param processed_filename: The ASDF file with the processed data
+    :type processed_filename: str
+    :param synthetics_filename: The file of the processed synthetics cache,
+        see :class:`lasif.tools.processed_synthetics_cache.
+        ProcessedSyntheticsCache`
+    :type synthetics_filename: str
+    :param stations: The stations, in the form ``NET.STA``
+    :type stations: list
+    :param windows: The windows of the event, by station and channel
+    :type windows: dict
+    :param config: Everything else the misfit depends on, e.g. the misfit
+        type and the periods. Must be serializable to JSON.
+    :type config: dict
+    :return: Dictionary with the hash of every station
+    """
+    config_hash = hashlib.sha256(
+        json.dumps(
+            [HASH_VERSION, config], sort_keys=True, default=str
+        ).encode()
+    ).digest()
+
+    hashes = {}
+    with h5py.File(processed_filename, "r") as processed, h5py.File(
+        synthetics_filename, "r"
+    ) as synthetics:
+        for station in stations:
+            h = hashlib.sha256(config_hash)
+            for f in (processed["Waveforms"], synthetics):
+                if station in f:
+                    h.update(b"station")
+                    _update_with_group(h, f[station])
+                else:
+                    h.update(b"no station")
+            h.update(
+                json.dumps(
+                    windows.get(station), sort_keys=True, default=str
+                ).encode()
+            )
+            hashes[station] = h.hexdigest()
+    return hashes
+
+
+def read_station_hashes(filename):
+    """
+    Read the stored hashes and misfits of the stations of an event.
+
+    :param filename: The JSON file
+    :type filename: str
+    :return: Dictionary with the ``hash`` and ``misfit`` of every station.
+        Empty if the file does not exist or has been written by another
+        version.
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r") as fh:
+        try:
+            content = json.load(fh)
+        except ValueError:
+            return {}
+    if content.get("version") != HASH_VERSION:
+        return {}
+    return content["stations"]
+
+
+def write_station_hashes(filename, stations: dict):
+    """
+    Write the hashes and misfits of the stations of an event. The file is
+    replaced once it is complete.
+
+    :param filename: The JSON file
+    :type filename: str
+    :param stations: Dictionary with the ``hash`` and ``misfit`` of every
+        station
+    :type stations: dict
+    """
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w") as fh:
+        json.dump(
+            {"version": HASH_VERSION, "stations": stations},
+            fh,
+            sort_keys=True,
+        )
+    os.replace(tmp_filename, filename)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of processed synthetics.
+
+Window selection, adjoint sources, validation misfits and the misfit GUI
+all apply the project's ``process_synthetics`` function to the same raw
+synthetics. The cache stores the processed traces of one event and
+iteration in a single HDF5 file, so the processing only runs once::
+
+    /                   attrs: cache_key, skipped_stations
+    /NET.STA/           one group per station
+    /NET.STA/NET.STA.LOC.CHA
+                        data of one trace, attrs: starttime_ns, delta
+
+The cache key is a hash of everything the processed traces depend on: the
+source of ``process_synthetics.py``, the simulation settings passed to it,
+the event and the size and modification time of the raw synthetics. A
+cache with a different key is stale and gets rebuilt.
+
+A cache only holds the stations that have been needed so far. Stations
+whose raw synthetics can not be cached, e.g. because they do not have a
+single waveform tag, are listed in ``skipped_stations``.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import h5py
+import numpy as np
+import obspy
+
+from lasif.exceptions import LASIFError
+
+# Increase whenever the layout of the cache files changes.
+CACHE_VERSION = 1
+
+
+def compute_cache_key(
+    function_source: bytes, settings: dict, event: dict, raw_filename: str
+):
+    """
+    Hash everything the processed synthetics depend on.
+
+    :param function_source: Source of the ``process_synthetics.py`` file
+    :type function_source: bytes
+    :param settings: The simulation settings passed to the function
+    :type settings: dict
+    :param event: The event passed to the function
+    :type event: dict
+    :param raw_filename: The file with the raw synthetics
+    :type raw_filename: str
+    """
+    stat = os.stat(raw_filename)
+    h = hashlib.sha256()
+    h.update(str(CACHE_VERSION).encode())
+    h.update(function_source)
+    for value in (settings, event, [stat.st_size, stat.st_mtime_ns]):
+        h.update(json.dumps(value, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class ProcessedSyntheticsCache(object):
+    """
+    The cached processed synthetics of one event and iteration.
+
+    Objects are cheap and can be passed to worker processes. They only
+    open the file in :meth:`open` and :meth:`writer`.
+
+    :param filename: The HDF5 file of the cache
+    :type filename: str
+    :param key: The cache key, see :func:`compute_cache_key`
+    :type key: str
+    """
+
+    def __init__(self, filename, key: str):
+        self.filename = str(filename)
+        self.key = key
+
+    def is_valid(self):
+        """
+        Check if the cache file exists and has been written with the same
+        cache key.
+        """
+        if not os.path.exists(self.filename):
+            return False
+        try:
+            with h5py.File(self.filename, "r") as f:
+                key = f.attrs.get("cache_key")
+        except OSError:
+            return False
+        if isinstance(key, bytes):
+            key = key.decode()
+        return key == self.key
+
+    def open(self):
+        """
+        Open the cache for reading.
+
+        :rtype: :class:`ProcessedSyntheticsReader`
+        """
+        return ProcessedSyntheticsReader(self.filename)
+
+    def writer(self, extend: bool = False):
+        """
+        Write a new cache, replacing the current file once it is complete.
+
+        :param extend: Keep the stations of the current cache file, which
+            has to be valid, and add more, defaults to False
+        :type extend: bool, optional
+        :rtype: :class:`ProcessedSyntheticsWriter`
+        """
+        return ProcessedSyntheticsWriter(self.filename, self.key, extend)
+
+
+class ProcessedSyntheticsReader(object):
+    """
+    Read access to a cache file.
+
+    Also used as a worker handle, see
+    :func:`lasif.tools.asdf_handle_pool.init_worker_datasets`.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = h5py.File(filename, "r")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def list(self):
+        """
+        The stations in the cache.
+        """
+        return list(self._file.keys())
+
+    def list_skipped(self):
+        """
+        The stations that could not be cached.
+        """
+        return json.loads(self._file.attrs.get("skipped_stations", "[]"))
+
+    def get_station(self, station: str):
+        """
+        The processed synthetics of a station.
+
+        :param station: The station id in the form ``NET.STA``
+        :type station: str
+        :return: The processed stream, or None if the station is not in the
+            cache, e.g. because its raw synthetics are not a single tag.
+        :rtype: :class:`obspy.core.stream.Stream`
+        """
+        if self._file is None:
+            raise LASIFError(f"File {self.filename} is already closed.")
+        if station not in self._file:
+            return None
+        st = obspy.Stream()
+        for trace_id, dataset in self._file[station].items():
+            network, sta, location, channel = trace_id.split(".")
+            header = {
+                "network": network,
+                "station": sta,
+                "location": location,
+                "channel": channel,
+                "starttime": obspy.UTCDateTime(
+                    ns=int(dataset.attrs["starttime_ns"])
+                ),
+                "delta": float(dataset.attrs["delta"]),
+            }
+            st.append(obspy.Trace(data=dataset[()], header=header))
+        return st
+
+
+class ProcessedSyntheticsWriter(object):
+    """
+    Writes a cache file. The traces go to a temporary file, which replaces
+    the cache file on :meth:`close`. If anything fails before, the previous
+    cache file is left as it is.
+
+    :param filename: The HDF5 file of the cache
+    :type filename: str
+    :param key: The cache key, see :func:`compute_cache_key`
+    :type key: str
+    :param extend: Start from the stations of the current cache file,
+        defaults to False
+    :type extend: bool, optional
+    """
+
+    def __init__(self, filename, key: str, extend: bool = False):
+        self.filename = filename
+        self.key = key
+        self.stations_written = 0
+        self._tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        if extend:
+            shutil.copyfile(filename, self._tmp_filename)
+            self._file = h5py.File(self._tmp_filename, "a")
+            self._skipped = json.loads(
+                self._file.attrs.get("skipped_stations", "[]")
+            )
+        else:
+            self._file = h5py.File(self._tmp_filename, "w")
+            self._skipped = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self._file.close()
+            os.remove(self._tmp_filename)
+            return
+        self.close()
+
+    def add(self, station: str, st: obspy.Stream):
+        """
+        Add the processed synthetics of a station.
+
+        :param station: The station id in the form ``NET.STA``
+        :type station: str
+        :param st: The processed stream
+        :type st: :class:`obspy.core.stream.Stream`
+        """
+        group = self._file.create_group(station, track_order=True)
+        for tr in st:
+            dataset = group.create_dataset(tr.id, data=tr.data)
+            dataset.attrs["starttime_ns"] = np.int64(tr.stats.starttime.ns)
+            dataset.attrs["delta"] = np.float64(tr.stats.delta)
+        self.stations_written += 1
+
+    def skip(self, station: str):
+        """
+        Mark a station whose synthetics can not be cached.
+
+        :param station: The station id in the form ``NET.STA``
+        :type station: str
+        """
+        self._skipped.append(station)
+
+    def close(self):
+        """
+        Complete the cache and move it in place.
+        """
+        if self._file is None:
+            return
+        self._file.attrs["cache_key"] = self.key
+        self._file.attrs["skipped_stations"] = json.dumps(self._skipped)
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_filename, self.filename)
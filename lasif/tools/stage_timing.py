@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing of the stages of the waveform pipelines.
+
+The adjoint source, window selection and validation pipelines mark their
+stages, e.g. reading the observed data, processing the synthetics or the
+misfit kernel, with :func:`stage`. As long as no :class:`StageTimer` is
+active the marks do nothing.
+
+The stages mostly run in pool workers. Functions wrapped with :func:`timed`
+send the stage timings of every task back with its result and
+:func:`collect` adds them to the timer of the main process::
+
+    with StageTimer() as timer:
+        with multiprocessing.Pool(4) as pool:
+            for r in collect(pool.imap_unordered(timed(fct), tasks)):
+                ...
+    timer.write_summary("timing.json")
+    print(timer.format_table())
+
+Without an active timer, :func:`timed` and :func:`collect` return their
+argument unchanged.
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import contextlib
+import json
+import time
+
+# The active timer of this process. Forked workers inherit it.
+_current = None
+
+_NO_STAGE = contextlib.nullcontext()
+
+# Number of slowest tasks listed in the summary.
+N_SLOWEST = 10
+
+
+class _Stage(object):
+    def __init__(self, timer, name):
+        self._timer = timer
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._timer.record(self._name, time.perf_counter() - self._start)
+
+
+def stage(name: str):
+    """
+    Context manager that times a stage, if a timer is active.
+
+    :param name: Name of the stage
+    :type name: str
+    """
+    if _current is None:
+        return _NO_STAGE
+    return _Stage(_current, name)
+
+
+def add_bytes_read(name: str, st):
+    """
+    Count the data of the traces of a stream as read in a stage, if a
+    timer is active.
+
+    :param name: Name of the stage
+    :type name: str
+    :param st: The traces that have been read
+    :type st: :class:`obspy.core.stream.Stream`
+    """
+    if _current is None or st is None:
+        return
+    _current.record(name, 0.0, sum(_tr.data.nbytes for _tr in st), calls=0)
+
+
+def count(name: str):
+    """
+    Count a call of a stage without timing it, if a timer is active.
+
+    :param name: Name of the stage
+    :type name: str
+    """
+    if _current is None:
+        return
+    _current.record(name, 0.0)
+
+
+class TimedTask(object):
+    """
+    Wraps the function of a pool worker. Returns the result of every task
+    together with the stages timed while computing it.
+
+    :param fct: The function of the worker. Must be picklable.
+    :type fct: callable
+    """
+
+    def __init__(self, fct):
+        self.fct = fct
+
+    def __call__(self, task):
+        global _current
+        if _current is None:
+            _current = StageTimer()
+        # Drop what has been recorded before the worker was started.
+        _current.pop()
+        start = time.perf_counter()
+        result = self.fct(task)
+        seconds = time.perf_counter() - start
+        if isinstance(task, tuple):
+            label = "/".join(str(_t) for _t in task)
+        else:
+            label = str(task)
+        return result, _current.pop(), label, seconds
+
+
+def timed(fct):
+    """
+    Wrap the function of a pool worker with :class:`TimedTask`, if a timer
+    is active.
+
+    :param fct: The function of the worker
+    :type fct: callable
+    """
+    if _current is None:
+        return fct
+    return TimedTask(fct)
+
+
+def collect(results):
+    """
+    Add the stage timings of the results of a :func:`timed` function to the
+    active timer and yield the results. Returns the results unchanged if no
+    timer is active.
+
+    :param results: Iterable of the results of the worker function
+    :type results: iterable
+    """
+    if _current is None:
+        return results
+    return _current.collect(results)
+
+
+class StageTimer(object):
+    """
+    Accumulates the wall time, the number of calls and the bytes read of
+    every stage, and the time of every worker task.
+
+    Stages timed in workers also count the tasks they ran in, their time per
+    task is the mean over these tasks.
+
+    Use it as a context manager to activate it.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.tasks = []
+        self.stage_tasks = {}
+        self.wall_time = 0.0
+        self._previous = None
+        self._start = None
+
+    def __enter__(self):
+        global _current
+        self._previous = _current
+        _current = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _current
+        self.wall_time += time.perf_counter() - self._start
+        _current = self._previous
+
+    def record(self, name: str, seconds: float, nbytes: int = 0, calls=1):
+        """
+        Add to the totals of a stage.
+
+        :param name: Name of the stage
+        :type name: str
+        :param seconds: Wall time
+        :type seconds: float
+        :param nbytes: Bytes read, defaults to 0
+        :type nbytes: int, optional
+        :param calls: Number of calls, defaults to 1
+        :type calls: int, optional
+        """
+        totals = self.stages.setdefault(name, [0.0, 0, 0])
+        totals[0] += seconds
+        totals[1] += calls
+        totals[2] += nbytes
+
+    def pop(self):
+        """
+        Return the totals of all stages and reset them.
+        """
+        stages = self.stages
+        self.stages = {}
+        return stages
+
+    def collect(self, results):
+        """
+        Generator behind :func:`collect`.
+        """
+        for result, stages, label, seconds in results:
+            for name, (stage_seconds, calls, nbytes) in stages.items():
+                self.record(name, stage_seconds, nbytes, calls)
+                self.stage_tasks[name] = self.stage_tasks.get(name, 0) + 1
+            self.tasks.append((label, seconds))
+            yield result
+
+    def summary(self):
+        """
+        Dictionary with the totals of all stages, the number of worker tasks
+        with the time they spent outside of the timed stages, the slowest
+        tasks and the wall time of the command.
+        """
+        n_tasks = len(self.tasks)
+        task_seconds = sum(_t[1] for _t in self.tasks)
+        stages = {}
+        for name, (seconds, calls, nbytes) in sorted(
+            self.stages.items(), key=lambda _i: -_i[1][0]
+        ):
+            stage_tasks = self.stage_tasks.get(name, 0)
+            stages[name] = {
+                "seconds": seconds,
+                "calls": calls,
+                "bytes_read": nbytes,
+                "tasks": stage_tasks,
+                "seconds_per_task": seconds / stage_tasks
+                if stage_tasks
+                else None,
+            }
+        untimed = task_seconds - sum(
+            _s["seconds"] for _s in stages.values() if _s["tasks"]
+        )
+        slowest = sorted(self.tasks, key=lambda _t: -_t[1])
+        return {
+            "wall_time": self.wall_time,
+            "tasks": n_tasks,
+            "task_seconds": task_seconds,
+            "untimed_task_seconds": max(untimed, 0.0),
+            "stages": stages,
+            "slowest_tasks": [
+                {"task": _label, "seconds": _seconds}
+                for _label, _seconds in slowest[:N_SLOWEST]
+            ],
+        }
+
+    def write_summary(self, filename):
+        """
+        Write the summary to a JSON file.
+
+        :param filename: The JSON file
+        :type filename: str
+        """
+        with open(filename, "w") as fh:
+            json.dump(self.summary(), fh, indent=2)
+
+    def format_table(self):
+        """
+        Human readable table of the summary. The times of the stages in the
+        workers are summed over all workers, so they can add up to more
+        than the wall time.
+        """
+        summary = self.summary()
+        lines = [
+            f"{'Stage':<28}{'Time [s]':>11}{'Share':>8}{'Calls':>9}"
+            f"{'Per task [ms]':>15}{'Read [MB]':>11}",
+            "-" * 82,
+        ]
+        total = sum(_s["seconds"] for _s in summary["stages"].values())
+        total += summary["untimed_task_seconds"]
+        rows = list(summary["stages"].items())
+        if summary["tasks"]:
+            rows.append(
+                (
+                    "other (workers)",
+                    {
+                        "seconds": summary["untimed_task_seconds"],
+                        "calls": summary["tasks"],
+                        "bytes_read": 0,
+                        "seconds_per_task": summary["untimed_task_seconds"]
+                        / summary["tasks"],
+                    },
+                )
+            )
+        for name, s in rows:
+            share = s["seconds"] / total if total else 0.0
+            per_task = (
+                f"{s['seconds_per_task'] * 1e3:>15.2f}"
+                if s["seconds_per_task"] is not None
+                else f"{'-':>15}"
+            )
+            lines.append(
+                f"{name:<28}{s['seconds']:>11.3f}{share:>8.1%}"
+                f"{s['calls']:>9}{per_task}"
+                f"{s['bytes_read'] / 1024 ** 2:>11.1f}"
+            )
+        lines.append("-" * 82)
+        lines.append(
+            f"{summary['tasks']} worker tasks, "
+            f"{summary['task_seconds']:.3f} s summed over all workers, "
+            f"wall time {summary['wall_time']:.3f} s"
+        )
+        if summary["slowest_tasks"]:
+            slowest = summary["slowest_tasks"][0]
+            lines.append(
+                f"Slowest task: {slowest['task']} "
+                f"({slowest['seconds']:.3f} s)"
+            )
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def report(filename, enabled: bool = True):
+    """
+    Time the stages of a command. Afterwards, the summary is written to a
+    JSON file and the table is printed.
+
+    :param filename: The JSON file, only used if ``enabled``
+    :type filename: str
+    :param enabled: Time the stages, otherwise this does nothing, defaults
+        to True
+    :type enabled: bool, optional
+    """
+    if not enabled:
+        yield None
+        return
+    with StageTimer() as timer:
+        yield timer
+    timer.write_summary(filename)
+    print(timer.format_table())
+    print(f"Timing summary written to {filename}")
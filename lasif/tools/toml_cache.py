@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memoized parsing of TOML metadata files.
+
+Files like ``forward.toml`` or ``events_used.toml`` are read in loops over
+stations and events, but only change when a user or LASIF rewrites them.
+The cache parses every file once and parses it again only when its
+modification time or size changes.
+
+Usage::
+
+    cache = TomlCache()
+    info = cache.load("forward.toml")
+    print(cache.info())
+
+:copyright:
+    Solvi Thrastarson (soelvi.thrastarson@erdw.ethz.ch), 2020
+:license:
+    GNU General Public License, Version 3
+    (http://www.gnu.org/copyleft/gpl.html)
+"""
+import copy
+import os
+
+import toml
+
+
+class TomlCache(object):
+    """
+    Cache of parsed TOML files, validated by modification time and size.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, filename):
+        """
+        Parse a TOML file, or return the cached content if the file did not
+        change since it was last parsed.
+
+        The content is returned as a copy, so callers can modify it without
+        affecting the cache.
+
+        :param filename: The TOML file
+        :type filename: Union[str, pathlib.Path]
+        """
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._entries.get(filename)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+        else:
+            self.misses += 1
+            with open(filename, "r") as fh:
+                entry = (signature, toml.load(fh))
+            self._entries[filename] = entry
+        return copy.deepcopy(entry[1])
+
+    def clear(self):
+        """
+        Remove all files from the cache and reset the counts.
+        """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """
+        Dictionary with the number of cache ``hits``, ``misses`` and
+        cached ``files``.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "files": len(self._entries),
+        }
@@ -1,9 +1,14 @@
+import bisect
+import os
 import sqlite3
 from contextlib import contextmanager
+from urllib.request import pathname2url
+
+import numpy as np
 from obspy import UTCDateTime
 
 # Register adapter and converter for obspy utc datetime objects
-from lasif.exceptions import LASIFNotFoundError
+from lasif.exceptions import LASIFError, LASIFNotFoundError
 
 
 def obspy_adapter(utcdt):
@@ -17,6 +22,88 @@ def obspy_converter(value):
 sqlite3.register_adapter(UTCDateTime, obspy_adapter)
 sqlite3.register_converter("utc_datetime", obspy_converter)
 
+# Version of the schema, stored as the user_version of the database.
+# Version 0 stored the times as date time strings, version 1 stores them as
+# seconds since epoch and the network and station of each trace. Older
+# window sets are migrated when they are opened.
+SCHEMA_VERSION = 1
+
+# Set on every connection. With WAL journaling readers do not block the
+# writer and vice versa, and synchronous = NORMAL is still safe.
+PRAGMAS = [
+    ("foreign_keys", 1),
+    ("synchronous", "NORMAL"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", -16000),
+]
+
+
+def _to_timestamp(time):
+    """
+    Seconds since epoch of a time, rounded to microseconds like the date
+    times of the first schema version.
+    """
+    if not isinstance(time, UTCDateTime):
+        time = UTCDateTime(time)
+    return round(time.ns, -3) // 1000 / 1e6
+
+
+def _to_timestamps(times):
+    """_to_timestamp of a list of UTCDateTime objects, as an array."""
+    us, ns = np.divmod(np.array([_t.ns for _t in times], dtype=np.int64), 1000)
+    # Round half to even, as round() does.
+    us += (ns > 500) | ((ns == 500) & (us % 2 == 1))
+    return us / 1e6
+
+
+def _from_timestamp(value):
+    """The time of seconds since epoch, to the microsecond."""
+    return UTCDateTime(ns=int(round(value * 1e6)) * 1000)
+
+
+def _split_id(channel_name):
+    """Network and station of a channel or station id."""
+    parts = channel_name.split(".", 2)
+    return parts[0], parts[1] if len(parts) > 1 else ""
+
+
+def _overlaps(starts, ends, start_time, end_time):
+    """
+    Whether a window overlaps or touches any of the sorted, disjoint
+    intervals given by their starts and ends.
+    """
+    return bisect.bisect_left(ends, start_time) < bisect.bisect_right(
+        starts, end_time
+    )
+
+
+def _resolve_overlaps(windows):
+    """
+    Resolves the overlaps of windows written one after the other, where
+    every window replaces all earlier windows it overlaps or touches.
+
+    :param windows: The windows in the order they are written, as tuples
+        of start and end time
+    :type windows: list
+    :return: The remaining windows sorted by start time, and the starts
+        and ends of the union of all windows as sorted, disjoint intervals.
+    """
+    starts = []
+    ends = []
+    remaining = []
+    # A window remains if none of the windows after it overlaps it.
+    for start_time, end_time in reversed(windows):
+        i = bisect.bisect_left(ends, start_time)
+        j = bisect.bisect_right(starts, end_time)
+        if i < j:
+            start_time = min(start_time, starts[i])
+            end_time = max(end_time, ends[j - 1])
+        else:
+            remaining.append((start_time, end_time))
+        starts[i:j] = [start_time]
+        ends[i:j] = [end_time]
+    return sorted(remaining), starts, ends
+
 
 class WindowGroupManager(object):
     """
@@ -24,29 +111,188 @@ class WindowGroupManager(object):
     iterations. This simplifies misfit comparisons. New window sets can still
     be selected after performing a number of iterations. This produces a
     new window set
+
+    The manager keeps a single connection to the database, opened on first
+    use. The schema is created or migrated when it is opened.
+
+    :param filename: The SQLite file of the window set.
+    :type filename: str
+    :param read_only: Open the window set read-only, e.g. to read the windows
+        for the adjoint sources. It has to exist, defaults to False
+    :type read_only: bool, optional
+    :param timeout: Seconds to wait for a concurrent writer before giving
+        up, defaults to 60
+    :type timeout: float, optional
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, read_only: bool = False, timeout=60.0):
         self.filename = filename
+        self.read_only = read_only
+        self.timeout = timeout
         self.windows = []
+        self._conn = None
+        self._pid = None
+        self._depth = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        state["_depth"] = 0
+        return state
+
+    def close(self):
+        """Close the connection, it is opened again when needed."""
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._pid = None
+        self._depth = 0
+
+    def _connection(self):
+        """
+        The connection of the manager. A connection inherited from a parent
+        process is not used, the child opens its own.
+        """
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        conn = self._connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if self.read_only and version < SCHEMA_VERSION:
+            # Readers can not migrate, a writing connection does it first.
+            conn.close()
+            with WindowGroupManager(self.filename, timeout=self.timeout) as w:
+                w._connection()
+            conn = self._connect()
+        elif not self.read_only:
+            try:
+                self._bootstrap(conn)
+            except BaseException:
+                conn.close()
+                raise
+
+        self._conn = conn
+        self._pid = os.getpid()
+        self._depth = 0
+        return conn
+
+    def _connect(self):
+        """Opens a connection with the pragmas set."""
+        if self.read_only:
+            if not os.path.exists(self.filename):
+                raise LASIFNotFoundError(
+                    f"Window set {self.filename} does not exist."
+                )
+            database = "file:%s?mode=ro" % pathname2url(
+                os.path.abspath(self.filename)
+            )
+        else:
+            database = str(self.filename)
+        conn = sqlite3.connect(
+            database,
+            uri=self.read_only,
+            timeout=self.timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,
+        )
+        if not self.read_only:
+            conn.execute("PRAGMA journal_mode = WAL")
+        for pragma, value in PRAGMAS:
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            conn.close()
+            raise LASIFError(
+                f"Window set {self.filename} has schema version {version}, "
+                f"this version of LASIF supports up to {SCHEMA_VERSION}."
+            )
+        return conn
 
-    @contextmanager
-    def sqlite_cursor(self):
+    @classmethod
+    def _bootstrap(cls, conn):
+        """
+        Creates the tables of a new window set or migrates the tables of
+        an older schema version, in one transaction.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                tables = [
+                    _i[0]
+                    for _i in conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type='table'"
+                    )
+                ]
+                if "windows" in tables:
+                    cls._migrate_tables(conn)
+                else:
+                    cls._create_tables(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @classmethod
+    def _migrate_tables(cls, c):
+        """
+        Migrates the tables of schema version 0, keeping all ids.
+        """
+        for table in ["windows", "traces", "events"]:
+            c.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+        cls._create_tables(c)
+        c.execute(
+            "INSERT INTO events (event_id, event_name) "
+            "SELECT event_id, event_name FROM legacy_events"
+        )
+        c.executemany(
+            "INSERT INTO traces VALUES (?, ?, ?, ?, ?)",
+            [
+                (trace_id, event_id, *_split_id(channel_name), channel_name)
+                for trace_id, event_id, channel_name in c.execute(
+                    "SELECT trace_id, event_id, channel_name "
+                    "FROM legacy_traces"
+                ).fetchall()
+            ],
+        )
+        c.executemany(
+            "INSERT INTO windows VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    window_id,
+                    trace_id,
+                    _to_timestamp(start_time),
+                    _to_timestamp(end_time),
+                    weight,
+                )
+                for window_id, trace_id, start_time, end_time, weight in (
+                    c.execute(
+                        "SELECT window_id, trace_id, start_time, end_time, "
+                        "weight FROM legacy_windows"
+                    ).fetchall()
+                )
+            ],
+        )
+        for table in ["windows", "traces", "events"]:
+            c.execute(f"DROP TABLE legacy_{table}")
+
+    @staticmethod
+    def _create_tables(c):
         """
         DB - Design Plan:
         events - event_id, event_name (possible more in the future)
-        traces - trace_id, channel_name, FK_event_id (possibly more in the
-         future, i.e. lat and lon)
+        traces - trace_id, FK_event_id, network, station, channel_name
+         (possibly more in the future, i.e. lat and lon)
         windows - window_id, FK_trace_id, start_time, end_time, weight
+         with the times in seconds since epoch
         """
-        # filename = Path.home() / Path(".salvus-flow-job-tracker.sqlite")
-        # This filename could be added as a class variable!
-        filename = self.filename
-        conn = sqlite3.connect(
-            str(filename), detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        c = conn.cursor()
-        c.execute("PRAGMA foreign_keys = 1")
         c.execute(
             """
             CREATE TABLE IF NOT EXISTS events (
@@ -60,34 +306,76 @@ class WindowGroupManager(object):
             CREATE TABLE IF NOT EXISTS traces (
                 trace_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 event_id INTEGER NOT NULL,
+                network TEXT NOT NULL,
+                station TEXT NOT NULL,
                 channel_name TEXT NOT NULL,
                 FOREIGN KEY (event_id) REFERENCES events(event_id),
                 UNIQUE (event_id, channel_name)
                 )
         """
         )
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS traces_station "
+            "ON traces (event_id, network, station)"
+        )
         c.execute(
             """
             CREATE TABLE IF NOT EXISTS windows (
                 window_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 trace_id INTEGER NOT NULL,
-                start_time utc_datetime NOT NULL,
-                end_time utc_datetime NOT NULL,
+                start_time REAL NOT NULL,
+                end_time REAL NOT NULL,
                 weight REAL NOT NULL,
                 FOREIGN KEY (trace_id) REFERENCES traces(trace_id)
                 )
         """
         )
-        yield c
-        conn.commit()
-        c.close()
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS windows_trace "
+            "ON windows (trace_id, start_time)"
+        )
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextmanager
+    def sqlite_cursor(self, write: bool = False):
+        """
+        Cursor within a single transaction, committed at the end or rolled
+        back on errors. Write transactions take the write lock right away,
+        so concurrent writers wait for each other instead of failing
+        halfway. Nested cursors share the outermost transaction.
+
+        :param write: The transaction writes, defaults to False
+        :type write: bool, optional
+        """
+        if write and self.read_only:
+            raise LASIFError(f"Window set {self.filename} is read-only.")
+        conn = self._connection()
+        c = conn.cursor()
+        outermost = self._depth == 0
+        try:
+            if outermost:
+                c.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            self._depth += 1
+            try:
+                yield c
+            finally:
+                self._depth -= 1
+            if outermost:
+                c.execute("COMMIT")
+        except BaseException:
+            if outermost and conn.in_transaction:
+                c.execute("ROLLBACK")
+            raise
+        finally:
+            c.close()
 
     def drop_all_tables(self):
         """Drop all tables from the DB"""
-        with self.sqlite_cursor() as c:
+        with self.sqlite_cursor(write=True) as c:
             c.execute("""DROP TABLE windows""")
             c.execute("""DROP TABLE traces""")
             c.execute("""DROP TABLE events""")
+            self._create_tables(c)
 
     def event_in_db(self, event_name):
         """Check if event is available in the database"""
@@ -117,7 +405,7 @@ class WindowGroupManager(object):
     def add_event(self, event_name):
         """Add event to databse if it does not exist"""
         if not self.event_in_db(event_name):
-            with self.sqlite_cursor() as c:
+            with self.sqlite_cursor(write=True) as c:
                 c.execute(
                     "INSERT INTO events VALUES (NULL, ? )", (event_name,)
                 )
@@ -128,7 +416,7 @@ class WindowGroupManager(object):
         """Remove event from db"""
         # for now just remove the event
         if self.event_in_db(event_name):
-            with self.sqlite_cursor() as c:
+            with self.sqlite_cursor(write=True) as c:
                 c.execute(
                     "DELETE FROM events WHERE event_name=?", (event_name,)
                 )
@@ -157,10 +445,10 @@ class WindowGroupManager(object):
         """
         event_id = self.get_event_id(event_name)
         if not self.trace_in_db(event_name, channel_name):
-            with self.sqlite_cursor() as c:
+            with self.sqlite_cursor(write=True) as c:
                 c.execute(
-                    " INSERT INTO traces VALUES (NULL, ?, ?)",
-                    (event_id, channel_name),
+                    " INSERT INTO traces VALUES (NULL, ?, ?, ?, ?)",
+                    (event_id, *_split_id(channel_name), channel_name),
                 )
         else:
             raise ValueError("Trace {} - {} ".format(event_name, channel_name))
@@ -181,7 +469,7 @@ class WindowGroupManager(object):
         """Remove trace, maybe check if window exist for this trace"""
         event_id = self.get_event_id(event_name)
         if self.trace_in_db(event_name, channel_name):
-            with self.sqlite_cursor() as c:
+            with self.sqlite_cursor(write=True) as c:
                 c.execute(
                     "DELETE FROM traces WHERE channel_name=? " "AND event_id",
                     (event_name, event_id),
@@ -198,10 +486,10 @@ class WindowGroupManager(object):
         start_time and end_time given as timestamps since epoch
 
         """
-        start_time = start_time.datetime
-        end_time = end_time.datetime
+        start_time = _to_timestamp(start_time)
+        end_time = _to_timestamp(end_time)
         assert end_time > start_time, "end_time must be larger than start_time"
-        with self.sqlite_cursor() as c:
+        with self.sqlite_cursor(write=True) as c:
             # delete overlapping windows if they exist
             c.execute(
                 """
@@ -240,10 +528,10 @@ class WindowGroupManager(object):
 
         """
         assert end_time > start_time, "end_time must be larger than start_time"
-        start_time = start_time.datetime
-        end_time = end_time.datetime
+        start_time = _to_timestamp(start_time)
+        end_time = _to_timestamp(end_time)
 
-        with self.sqlite_cursor() as c:
+        with self.sqlite_cursor(write=True) as c:
             # delete overlapping windows if they exist
             c.execute(
                 """
@@ -274,13 +562,17 @@ class WindowGroupManager(object):
         with self.sqlite_cursor() as c:
             c.execute(
                 "SELECT start_time, end_time, weight FROM windows "
-                "WHERE trace_id=?",
+                "WHERE trace_id=? ORDER BY start_time",
                 (trace_id,),
             )
-            return c.fetchall()
+            rows = c.fetchall()
+        return [
+            (_from_timestamp(start_time), _from_timestamp(end_time), weight)
+            for start_time, end_time, weight in rows
+        ]
 
     def delete_all_windows_for_trace(self, trace_id):
-        with self.sqlite_cursor() as c:
+        with self.sqlite_cursor(write=True) as c:
             c.execute("DELETE FROM windows WHERE trace_id=?", (trace_id,))
 
     def get_all_windows_for_station(self, station):
@@ -288,101 +580,137 @@ class WindowGroupManager(object):
             # get all trace_ids
             c.execute(
                 """SELECT * FROM windows WHERE windows.trace_id IN
-                    (SELECT trace_id FROM traces WHERE channel_name LIKE ?)""",
-                ("%" + station + "%",),
+                    (SELECT trace_id FROM traces
+                     WHERE network=? AND station=?)""",
+                _split_id(station),
+            )
+            rows = c.fetchall()
+        return [
+            (
+                window_id,
+                trace_id,
+                _from_timestamp(start_time),
+                _from_timestamp(end_time),
+                weight,
             )
-            return c.fetchall()
+            for window_id, trace_id, start_time, end_time, weight in rows
+        ]
 
     def write_windows_bulk(self, event_name, results):
         """
-        This function essentially performs the same tasks as
-        self.write_windows, the constant opening and closing of the database
-        in that function proved a significant bottleneck and this function
-        overcomes that.
+        Writes the windows of an event in a single transaction. As with
+        add_window, every window replaces the windows of its channel it
+        overlaps, including the windows written before it. The overlaps are
+        resolved in memory so that all traces and windows are written at
+        once, windows that are already in the window set are kept.
+
+        :param event_name: The name of the event
+        :type event_name: str
+        :param results: Dictionary(stations) of dictionaries(channels) of
+            lists of windows, tuples starting with start and end time
+        :type results: dict
+        :return: The number of windows written, without the ones that were
+            already in the window set
         """
-        with self.sqlite_cursor() as c:
-            # check if event exists
+        channels = {}
+        for station_channels in results.values():
+            if station_channels is None:
+                continue
+            for channel, windows in station_channels.items():
+                channels.setdefault(channel, []).extend(windows)
+        times = _to_timestamps(
+            [
+                _t
+                for windows in channels.values()
+                for window in windows
+                for _t in window[:2]
+            ]
+        ).reshape(-1, 2)
+        assert np.all(
+            times[:, 1] > times[:, 0]
+        ), "end_time must be larger than start_time"
+        times = times.tolist()
+
+        with self.sqlite_cursor(write=True) as c:
             c.execute(
-                "SELECT EXISTS(SELECT event_id FROM events "
-                "WHERE event_name = ?)",
+                "SELECT event_id FROM events WHERE event_name = ?",
                 (event_name,),
             )
-
-            # if event does not exist, insert into db
-            if not bool(c.fetchone()[0]):
+            row = c.fetchone()
+            if row is None:
                 c.execute(
                     "INSERT INTO events VALUES (NULL, ? )", (event_name,)
                 )
+                event_id = c.lastrowid
+            else:
+                event_id = row[0]
+
+            # Ignored inserts would still use up ids, only add new traces.
             c.execute(
-                "SELECT event_id FROM events " "WHERE event_name = ?",
-                (event_name,),
+                "SELECT channel_name FROM traces WHERE event_id=?",
+                (event_id,),
             )
-            event_id = c.fetchone()[0]
-
-            for station, channels in results.items():
-                if channels is not None:
-                    for channel, windows in channels.items():
-                        # check if trace exists
-                        c.execute(
-                            "SELECT EXISTS(SELECT 1 FROM traces "
-                            "WHERE channel_name=? AND event_id=? LIMIT 1)",
-                            (channel, event_id),
-                        )
-                        # if trace not there, insert into db
-                        if not bool(c.fetchone()[0]):
-                            c.execute(
-                                " INSERT INTO traces VALUES (NULL, ?, ?)",
-                                (event_id, channel),
-                            )
-                        c.execute(
-                            "SELECT trace_id FROM traces "
-                            "WHERE channel_name=? AND event_id=?",
-                            (channel, event_id),
-                        )
-                        trace_id = c.fetchone()[0]
-                        for window in windows:
-                            start_time = window[0].datetime
-                            end_time = window[1].datetime
-                            weight = 1.0
-                            assert (
-                                end_time > start_time
-                            ), "end_time must be larger than start_time"
-                            # delete overlapping windows if they exist
-                            c.execute(
-                                """
-                                DELETE FROM windows WHERE trace_id=?
-                                AND ((start_time BETWEEN ? AND ?)
-                                OR (end_time BETWEEN ? AND ?)
-                                OR (start_time >= ? AND end_time <= ?)
-                                OR (start_time <= ? AND end_time >= ?))
-                                """,
-                                (
-                                    "{}".format(trace_id),
-                                    start_time,
-                                    end_time,
-                                    start_time,
-                                    end_time,
-                                    start_time,
-                                    end_time,
-                                    start_time,
-                                    end_time,
-                                ),
-                            )
-
-                            # insert window
-                            c.execute(
-                                """
-                                INSERT INTO windows VALUES (
-                                    NULL, ?, ?, ?, ?
-                                )
-                            """,
-                                (
-                                    "{}".format(trace_id),
-                                    start_time,
-                                    end_time,
-                                    weight,
-                                ),
-                            )
+            existing = {_r[0] for _r in c.fetchall()}
+            c.executemany(
+                " INSERT INTO traces VALUES (NULL, ?, ?, ?, ?)",
+                [
+                    (event_id, *_split_id(channel), channel)
+                    for channel in channels
+                    if channel not in existing
+                ],
+            )
+            c.execute(
+                """SELECT traces.channel_name, traces.trace_id,
+                        windows.window_id, windows.start_time,
+                        windows.end_time, windows.weight
+                        FROM traces LEFT JOIN windows
+                        ON traces.trace_id = windows.trace_id
+                        WHERE traces.event_id=?""",
+                (event_id,),
+            )
+            rows = c.fetchall()
+            trace_ids = {_r[0]: _r[1] for _r in rows}
+
+            remaining = {}
+            unions = {}
+            offset = 0
+            for channel, windows in channels.items():
+                channel_windows, starts, ends = _resolve_overlaps(
+                    times[offset : offset + len(windows)]
+                )
+                offset += len(windows)
+                remaining[channel] = set(channel_windows)
+                unions[channel] = (starts, ends)
+
+            # Windows already in the database are replaced as well. The
+            # ones that would be written again are kept as they are.
+            old_windows = []
+            for channel, _, window_id, start_time, end_time, weight in rows:
+                if (
+                    window_id is None
+                    or channel not in unions
+                    or not _overlaps(*unions[channel], start_time, end_time)
+                ):
+                    continue
+                if weight == 1.0 and (start_time, end_time) in (
+                    remaining[channel]
+                ):
+                    remaining[channel].remove((start_time, end_time))
+                else:
+                    old_windows.append((window_id,))
+            new_windows = [
+                (trace_ids[channel], start_time, end_time, 1.0)
+                for channel, windows in remaining.items()
+                for start_time, end_time in sorted(windows)
+            ]
+
+            c.executemany(
+                "DELETE FROM windows WHERE window_id=?", old_windows
+            )
+            c.executemany(
+                "INSERT INTO windows VALUES (NULL, ?, ?, ?, ?)", new_windows
+            )
+        return len(new_windows)
 
     def write_windows_old(self, event_name, results):
         if not self.event_in_db(event_name):
@@ -419,17 +747,20 @@ class WindowGroupManager(object):
         """
         if self.event_in_db(event_name):
             event_id = self.get_event_id(event_name)
+        elif self.read_only:
+            return {}
         else:
             self.add_event(event_name)
             event_id = self.get_event_id(event_name)
 
         with self.sqlite_cursor() as c:
             c.execute(
-                """SELECT event_traces.channel_name, windows.start_time,
+                """SELECT traces.channel_name, windows.start_time,
                         windows.end_time, windows.weight
-                        FROM (SELECT * FROM traces
-                        WHERE event_id=?) event_traces, windows
-                        WHERE event_traces.trace_id = windows.trace_id""",
+                        FROM traces JOIN windows
+                        ON traces.trace_id = windows.trace_id
+                        WHERE traces.event_id=?
+                        ORDER BY traces.channel_name, windows.start_time""",
                 (event_id,),
             )
             rows = c.fetchall()
@@ -449,7 +780,11 @@ class WindowGroupManager(object):
             if channel_name not in results[station].keys():
                 results[station][channel_name] = []
 
-            start_end = (start_time, end_time, weight)
+            start_end = (
+                _from_timestamp(start_time),
+                _from_timestamp(end_time),
+                weight,
+            )
             results[station][channel_name].append(start_end)
         return results
 
@@ -461,14 +796,14 @@ class WindowGroupManager(object):
         event_id = self.get_event_id(event_name)
         with self.sqlite_cursor() as c:
             c.execute(
-                """SELECT * FROM
-                        (SELECT event_traces.channel_name, windows.start_time,
-                         windows.end_time, windows.weight
-                        FROM (SELECT * FROM traces
-                        WHERE event_id=?) event_traces, windows
-                        WHERE event_traces.trace_id = windows.trace_id)
-                        WHERE channel_name LIKE ?""",
-                (event_id, "%" + station + "%"),
+                """SELECT traces.channel_name, windows.start_time,
+                        windows.end_time, windows.weight
+                        FROM traces JOIN windows
+                        ON traces.trace_id = windows.trace_id
+                        WHERE traces.event_id=? AND traces.network=?
+                        AND traces.station=?
+                        ORDER BY traces.channel_name, windows.start_time""",
+                (event_id, *_split_id(station)),
             )
             rows = c.fetchall()
 
@@ -480,34 +815,72 @@ class WindowGroupManager(object):
             if channel_name not in results.keys():
                 results[channel_name] = []
 
-            start_end = (start_time, end_time, weight)
+            start_end = (
+                _from_timestamp(start_time),
+                _from_timestamp(end_time),
+                weight,
+            )
             results[channel_name].append(start_end)
         return results
 
+    def get_all_windows_for_event_array(self, event_name):
+        """
+        Returns all windows of an event as one numpy structured array,
+        sorted by channel and start time. The fields are network, station,
+        channel, start_time and end_time in seconds since epoch and weight.
+        The array is empty for events without windows.
+
+        :param event_name: Name of the event
+        :type event_name: str
+        """
+        with self.sqlite_cursor() as c:
+            c.execute(
+                """SELECT traces.network, traces.station,
+                        traces.channel_name, windows.start_time,
+                        windows.end_time, windows.weight
+                        FROM events JOIN traces
+                        ON events.event_id = traces.event_id
+                        JOIN windows ON traces.trace_id = windows.trace_id
+                        WHERE events.event_name=?
+                        ORDER BY traces.channel_name, windows.start_time""",
+                (event_name,),
+            )
+            rows = c.fetchall()
+
+        dtype = [
+            (name, "U%i" % max([1] + [len(_r[_i]) for _r in rows]))
+            for _i, name in enumerate(["network", "station", "channel"])
+        ]
+        dtype += [("start_time", "f8"), ("end_time", "f8"), ("weight", "f8")]
+        return np.array(rows, dtype=dtype)
+
     def add_window_to_event_channel(
         self, event_name, channel_name, start_time, end_time, weight=1.0
     ):
-        if not self.event_in_db(event_name):
-            self.add_event(event_name)
-        if not self.trace_in_db(event_name, channel_name):
-            self.add_trace(event_name, channel_name)
-        trace_id = self.get_trace_id(event_name, channel_name)
-        self.add_window(trace_id, start_time, end_time, weight)
+        with self.sqlite_cursor(write=True):
+            if not self.event_in_db(event_name):
+                self.add_event(event_name)
+            if not self.trace_in_db(event_name, channel_name):
+                self.add_trace(event_name, channel_name)
+            trace_id = self.get_trace_id(event_name, channel_name)
+            self.add_window(trace_id, start_time, end_time, weight)
 
     def del_all_windows_from_event_channel(self, event_name, channel_name):
-        if not self.event_in_db(event_name):
-            self.add_event(event_name)
-        if not self.trace_in_db(event_name, channel_name):
-            self.add_trace(event_name, channel_name)
-        trace_id = self.get_trace_id(event_name, channel_name)
-        self.delete_all_windows_for_trace(trace_id)
+        with self.sqlite_cursor(write=True):
+            if not self.event_in_db(event_name):
+                self.add_event(event_name)
+            if not self.trace_in_db(event_name, channel_name):
+                self.add_trace(event_name, channel_name)
+            trace_id = self.get_trace_id(event_name, channel_name)
+            self.delete_all_windows_for_trace(trace_id)
 
     def del_window_from_event_channel(
         self, event_name, channel_name, start_time, end_time
     ):
-        if not self.event_in_db(event_name):
-            self.add_event(event_name)
-        if not self.trace_in_db(event_name, channel_name):
-            self.add_trace(event_name, channel_name)
-        trace_id = self.get_trace_id(event_name, channel_name)
-        self.delete_window(trace_id, start_time, end_time)
+        with self.sqlite_cursor(write=True):
+            if not self.event_in_db(event_name):
+                self.add_event(event_name)
+            if not self.trace_in_db(event_name, channel_name):
+                self.add_trace(event_name, channel_name)
+            trace_id = self.get_trace_id(event_name, channel_name)
+            self.delete_window(trace_id, start_time, end_time)
@@ -10,6 +10,8 @@ The main function is the select_windows() function. The selection process is a
 multi-stage process. Initially all time steps are considered to be valid in
 the sense as being suitable for window selection. Then a number of selectors
 is applied, progressively excluding more and more time steps.
+select_windows_batch() picks the same windows for many traces with identical
+sampling at once.
 
 :copyright:
     Lion Krischer (krischer@geophysik.uni-muenchen.de), 2013
@@ -18,7 +20,6 @@ is applied, progressively excluding more and more time steps.
     GNU General Public License, Version 3
     (http://www.gnu.org/copyleft/gpl.html)
 """
-import itertools
 import math
 
 import numpy as np
@@ -46,59 +47,34 @@ def find_local_extrema(data):
     e.g. a flat top or bottom. In that case the first index of all flat
     values will be returned.
 
-    Returns a tuple of maxima and minima indices.
+    Returns a tuple of maxima and minima indices, both are empty for
+    constant data.
     """
     length = len(data) - 1
     diff = np.diff(data)
-    flats = np.argwhere(diff == 0)
 
-    # Discard neighbouring flat points.
-    new_flats = list(flats[0:1])
-    for i, j in zip(flats[:-1], flats[1:]):
-        if j - i == 1:
-            continue
-        new_flats.append(j)
-    flats = new_flats
-
-    maxima = []
-    minima = []
-
-    # Go over each flats position and check if its a maxima/minima.
-    for idx in flats:
-        l_type = "left"
-        r_type = "right"
-        for i in itertools.count():
-            this_idx = idx - i - 1
-            if diff[this_idx] < 0:
-                l_type = "minima"
-                break
-            elif diff[this_idx] > 0:
-                l_type = "maxima"
-                break
-        for i in itertools.count():
-            this_idx = idx + i + 1
-            if this_idx >= len(diff):
-                break
-            if diff[this_idx] < 0:
-                r_type = "maxima"
-                break
-            elif diff[this_idx] > 0:
-                r_type = "minima"
-                break
-        if r_type != l_type:
-            continue
-        if r_type == "maxima":
-            maxima.append(int(idx))
-        else:
-            minima.append(int(idx))
-
-    maxs = set(list(argrelextrema(data, np.greater)[0]))
-    mins = set(list(argrelextrema(data, np.less)[0]))
-
-    peaks, troughs = (
-        sorted(list(maxs.union(set(maxima)))),
-        sorted(list(mins.union(set(minima)))),
-    )
+    # The first index of every run of flat values.
+    flats = np.flatnonzero(diff == 0)
+    flats = flats[np.diff(flats, prepend=-2) != 1]
+
+    maxima = minima = flats[:0]
+    if len(flats):
+        # A flat run is an extremum if the slopes before and after it have
+        # opposite signs. Before the first slope, the search continues at
+        # the end of the data, as negative indices wrap around.
+        # Constant data has no slopes and no extrema.
+        slopes = np.flatnonzero((diff < 0) | (diff > 0))
+        if len(slopes):
+            left = diff[slopes[np.searchsorted(slopes, flats) - 1]]
+            right_idx = np.searchsorted(slopes, flats, side="right")
+            has_right = right_idx < len(slopes)
+            right = np.zeros(len(flats), dtype=diff.dtype)
+            right[has_right] = diff[slopes[right_idx[has_right]]]
+            maxima = flats[(left > 0) & (right < 0)]
+            minima = flats[(left < 0) & (right > 0)]
+
+    peaks = np.union1d(argrelextrema(data, np.greater)[0], maxima).tolist()
+    troughs = np.union1d(argrelextrema(data, np.less)[0], minima).tolist()
 
     # Special case handling for missing one or the other.
     if not peaks and not troughs:
@@ -165,6 +141,97 @@ def find_closest(ref_array, target):
     return idx
 
 
+def _fill_ranges(npts, starts, stops):
+    """
+    Boolean array of length npts that is True within every range
+    ``[start, stop)``. Empty ranges, i.e. ``start >= stop``, are ignored.
+
+    :param npts: Length of the array.
+    :type npts: int
+    :param starts: The start indices, between 0 and npts.
+    :type starts: :class:`numpy.ndarray`
+    :param stops: The stop indices, between 0 and npts.
+    :type stops: :class:`numpy.ndarray`
+    """
+    keep = starts < stops
+    counts = np.bincount(starts[keep], minlength=npts + 1) - np.bincount(
+        stops[keep], minlength=npts + 1
+    )
+    return np.cumsum(counts[:npts]) > 0
+
+
+def _unmasked_runs(mask):
+    """
+    Start and stop indices of all runs of unmasked samples.
+
+    :param mask: The mask.
+    :type mask: :class:`numpy.ndarray`
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate([[1], mask, [1]]) != 0))
+    return edges[::2], edges[1::2]
+
+
+def _mask_short_windows(time_windows, min_length):
+    """
+    Mask all windows shorter than min_length samples, in place.
+
+    :param time_windows: The time windows.
+    :type time_windows: :class:`numpy.ma.MaskedArray`
+    :param min_length: Minimum number of samples of a window.
+    :type min_length: float
+    """
+    starts, stops = _unmasked_runs(time_windows.mask)
+    short = (stops - starts) < min_length
+    time_windows.mask[
+        _fill_ranges(len(time_windows), starts[short], stops[short])
+    ] = True
+
+
+def _mask_around(time_windows, indices, sample_buffer):
+    """
+    Mask sample_buffer samples to either side of the given indices, in
+    place. Ranges starting before the first sample are handled like the
+    slice ``mask[index - sample_buffer : index + sample_buffer]``, i.e. a
+    negative start counts from the end.
+
+    :param time_windows: The time windows.
+    :type time_windows: :class:`numpy.ma.MaskedArray`
+    :param indices: The indices.
+    :type indices: :class:`numpy.ndarray`
+    :param sample_buffer: Number of samples to either side.
+    :type sample_buffer: int
+    """
+    npts = len(time_windows)
+    indices = np.asarray(indices, dtype=np.int64)
+    starts = indices - sample_buffer
+    starts = np.clip(np.where(starts < 0, starts + npts, starts), 0, npts)
+    stops = np.minimum(indices + sample_buffer, npts)
+    time_windows.mask[_fill_ranges(npts, starts, stops)] = True
+
+
+def _marching_ranges(closest, extrema, npts):
+    """
+    Samples kept by the peak and trough marching for one kind of extrema.
+    Wherever two neighbouring extrema of the synthetics are closest to two
+    neighbouring extrema of the data, everything from the extremum before
+    to the extremum after them is kept. At the ends of the window the
+    ranges start at the first and end before the last sample.
+
+    :param closest: Index of the closest extremum of the data for every
+        extremum of the synthetics.
+    :type closest: :class:`numpy.ndarray`
+    :param extrema: The extrema of the synthetics.
+    :type extrema: :class:`numpy.ndarray`
+    :param npts: Number of samples of the window.
+    :type npts: int
+    """
+    idx = np.flatnonzero(np.diff(closest) == 1)
+    last = len(extrema) - 1
+    starts = np.where(idx > 0, extrema[np.maximum(idx - 1, 0)], 0)
+    stops = np.where(idx < last, extrema[np.minimum(idx + 1, last)], npts - 1)
+    return _fill_ranges(npts, starts, stops)
+
+
 def _plot_mask(new_mask, old_mask, name=None):
     """
     Helper function plotting the remaining time segments after an elimination
@@ -238,6 +305,290 @@ def _window_generator(data_length, window_width, window_shift):
         window_start += window_shift
 
 
+def _max_cross_correlation(data_windows, synthetic_windows, chunk_size=256):
+    """
+    Time shift and normalized maximum of the cross correlation of many
+    pairs of windows at once.
+
+    Same as computing ``cc = np.correlate(data_window, synthetic_window,
+    "full")`` for every row and taking ``cc.argmax() - width + 1`` and
+    ``cc.max()`` divided by the energies of the windows, but the cross
+    correlations are computed with FFTs in chunks of windows. The maximum
+    is evaluated again at the found lag with the same dot product
+    ``np.correlate`` uses, and windows without a unique maximum within the
+    round-off of the FFTs are correlated with ``np.correlate``. The results
+    are thus identical.
+
+    :param data_windows: Tapered data windows, one per row
+    :type data_windows: :class:`numpy.ndarray`
+    :param synthetic_windows: Tapered synthetic windows, one per row
+    :type synthetic_windows: :class:`numpy.ndarray`
+    :param chunk_size: Number of windows transformed at once, defaults to
+        256
+    :type chunk_size: int, optional
+    :return: The time shift in samples of the synthetics relative to the
+        data and the normalized maximum of the cross correlation of every
+        window
+    """
+    from scipy.fft import next_fast_len
+
+    n_windows, width = data_windows.shape
+    time_shifts = np.empty(n_windows, dtype=np.int64)
+    max_cc = np.empty(n_windows, dtype=np.float64)
+    if not n_windows:
+        return time_shifts, max_cc
+    energy_data = (data_windows ** 2).sum(axis=1)
+    energy_synthetic = (synthetic_windows ** 2).sum(axis=1)
+
+    nfft = next_fast_len(2 * width - 1, real=True)
+    for i in range(0, n_windows, chunk_size):
+        chunk = slice(i, i + chunk_size)
+        d = data_windows[chunk]
+        s = synthetic_windows[chunk]
+        cc = np.fft.irfft(
+            np.fft.rfft(d, nfft) * np.conj(np.fft.rfft(s, nfft)), nfft
+        )
+        # Same order of lags as np.correlate, from -(width - 1) to
+        # width - 1.
+        cc = np.concatenate([cc[:, nfft - width + 1:], cc[:, :width]], axis=1)
+        idx = cc.argmax(axis=1)
+        peak = cc[np.arange(len(cc)), idx]
+        # The round-off of the FFTs is far below this.
+        tolerance = 1e-10 * np.sqrt(
+            energy_data[chunk] * energy_synthetic[chunk]
+        )
+        ambiguous = ~np.isfinite(peak) | (
+            (cc >= (peak - tolerance)[:, np.newaxis]).sum(axis=1) > 1
+        )
+        for j in range(len(cc)):
+            if ambiguous[j]:
+                exact = np.correlate(d[j], s[j], mode="full")
+                idx[j] = exact.argmax()
+                peak[j] = exact.max()
+                continue
+            lag = idx[j] - width + 1
+            if lag >= 0:
+                peak[j] = np.dot(d[j, lag:], s[j, : width - lag])
+            else:
+                peak[j] = np.dot(d[j, : width + lag], s[j, -lag:])
+        time_shifts[chunk] = idx - width + 1
+        max_cc[chunk] = peak
+
+    max_cc /= np.sqrt(energy_synthetic * energy_data)
+    return time_shifts, max_cc
+
+
+def _distance_in_km(
+    event_latitude, event_longitude, station_latitude, station_longitude
+):
+    """
+    Source - receiver distance in km.
+    """
+    return (
+        geodetics.calc_vincenty_inverse(
+            station_latitude,
+            station_longitude,
+            event_latitude,
+            event_longitude,
+        )[0]
+        / 1000.0
+    )
+
+
+def _sliding_window_settings(minimum_period, dt):
+    """
+    Length and shift in samples and taper of the sliding windows.
+    """
+    # Number of samples in the sliding window. Currently, the length of the
+    # window is set to a multiple of the dominant period of the synthetics.
+    # Make sure it is an uneven number; just to have a trivial midpoint
+    # definition and one sample does not matter much in any case.
+    window_length = int(round(float(2 * minimum_period) / dt))
+    if not window_length % 2:
+        window_length += 1
+
+    # Compute the amount of indices by which to shift the sliding windows
+    # for long seismograms this otherwise gets unnecessarily expensive
+    window_shift = int(0.05 * window_length)
+    if not window_shift % 2:
+        window_shift += 1
+    window_shift = max(window_shift, 1)
+
+    # Use a Hanning window. No particular reason for it but its a well-behaved
+    # window and has nice spectral properties.
+    taper = np.hanning(window_length)
+    return window_length, window_shift, taper
+
+
+def _trace_statistics(data, synth):
+    """
+    Global statistics of stacked data and synthetics, one trace per row.
+
+    Returns a dictionary of arrays with one value per trace: whether the
+    traces contain NaNs, their overall correlation coefficient, the index of
+    the first arrival in the synthetics (-1 if there is none), whether
+    either trace is all zeros and the absolute and relative noise level of
+    the data before the first arrival.
+
+    :param data: The data, one trace per row.
+    :type data: :class:`numpy.ndarray`
+    :param synth: The synthetics, one trace per row.
+    :type synth: :class:`numpy.ndarray`
+    """
+    has_nan = np.isnan(data).any(axis=1) | np.isnan(synth).any(axis=1)
+
+    # Overall Correlation coefficient.
+    norm = np.sqrt(np.sum(data ** 2, axis=1)) * np.sqrt(
+        np.sum(synth ** 2, axis=1)
+    )
+    cc = np.sum(data * synth, axis=1) / norm
+
+    abs_synth = np.abs(synth)
+    max_synth = abs_synth.max(axis=1)
+    arrived = abs_synth > 5e-3 * max_synth[:, np.newaxis]
+    first_tt_arrival = np.where(
+        arrived.any(axis=1), arrived.argmax(axis=1), -1
+    )
+
+    # The noise is measured before the first arrival, ensure at least 1
+    # sample is available.
+    idx_end = np.maximum((0.9 * first_tt_arrival).astype(np.int64), 1)
+    abs_data = np.abs(data)
+    max_data = abs_data.max(axis=1)
+    noise_absolute = np.where(
+        np.arange(data.shape[1]) < idx_end[:, np.newaxis], abs_data, 0
+    ).max(axis=1)
+    no_data = (max_data == 0.0) | (max_synth == 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        noise_relative = noise_absolute / max_data
+
+    return {
+        "has_nan": has_nan,
+        "cc": cc,
+        "first_tt_arrival": first_tt_arrival,
+        "no_data": no_data,
+        "noise_absolute": noise_absolute,
+        "noise_relative": noise_relative,
+    }
+
+
+def _rejection_reasons(
+    cc,
+    noise_relative,
+    dist_in_km,
+    minimum_period,
+    min_cc,
+    max_noise,
+    min_velocity,
+):
+    """
+    Reasons to reject a pair of traces as a whole, empty if they are
+    accepted.
+    """
+    reasons = []
+    if (cc < min_cc) and (noise_relative > max_noise / 3.0):
+        reasons.append(
+            "Correlation %.4f is below threshold of %.4f" % (cc, min_cc)
+        )
+
+    if noise_relative > max_noise:
+        reasons.append(
+            "Noise level %.3f is above threshold of %.3f"
+            % (noise_relative, max_noise,)
+        )
+
+    minimum_distance = 2 * minimum_period * min_velocity
+    if dist_in_km < minimum_distance:
+        reasons.append(
+            "Source - Receiver distance %.3f is below threshold of %.3f"
+            % (dist_in_km, minimum_distance,)
+        )
+    return reasons
+
+
+def _stf_delay(stf_trace):
+    """
+    Delay of the source time function in samples: from its start to where
+    its envelope falls below half its maximum after the maximum.
+    """
+    stf_env = obspy.signal.filter.envelope(stf_trace)
+    max_env_amplitude_idx = np.argmax(stf_env.data)
+    threshold = 0.5 * np.max(stf_env.data)
+    return int(
+        np.argmax(stf_env[max_env_amplitude_idx:] < threshold)
+        + np.argmax(stf_env.data)
+    )
+
+
+def _traveltime_limits(
+    first_tt_arrival,
+    dist_in_km,
+    stf_delay,
+    dt,
+    npts,
+    minimum_period,
+    min_velocity,
+):
+    """
+    Indices of the earliest and latest sample that can be windowed: a
+    minimum period before the first arrival and half a minimum period after
+    the arrival with the minimum velocity, delayed by the source time
+    function. Without a delay, i.e. for global inversions, everything up to
+    the end of the trace can be windowed.
+    """
+    min_idx = first_tt_arrival - int(minimum_period / dt)
+    min_idx = max(0, min_idx)
+
+    if stf_delay is None:
+        max_idx = npts
+    else:
+        max_idx = int(
+            math.ceil((dist_in_km / min_velocity + minimum_period / 2.0) / dt)
+        )
+        max_idx += stf_delay
+    return min_idx, max_idx
+
+
+def _sliding_windows(
+    data, synth, window_length, window_shift, taper, min_idx, max_idx
+):
+    """
+    The sliding windows whose midpoints lie between min_idx and max_idx.
+
+    Returns their positions, see :func:`_window_generator`, the tapered data
+    and synthetics of all windows with energy, one window per row, and
+    which windows have no energy.
+    """
+    window_positions = [
+        _p
+        for _p in _window_generator(len(data), window_length, window_shift)
+        if min_idx < _p[2] < max_idx
+    ]
+    if not window_positions:
+        return window_positions, None, None, None
+
+    # Tapered copies of all windows, one per row.
+    starts = np.array([_p[0] for _p in window_positions])
+    data_windows = (
+        np.lib.stride_tricks.sliding_window_view(data, window_length)[starts]
+        * taper
+    )
+    synthetic_windows = (
+        np.lib.stride_tricks.sliding_window_view(synth, window_length)[starts]
+        * taper
+    )
+
+    # Elimination Stage 2: Skip windows that have essentially no energy
+    # to avoid instabilities. No windows can be picked in these.
+    no_energy = synthetic_windows.ptp(axis=1) < synth.ptp() * 0.001
+    return (
+        window_positions,
+        data_windows[~no_energy],
+        synthetic_windows[~no_energy],
+        no_energy,
+    )
+
+
 def _log_window_selection(tr_id, msg):
     """
     Helper function for consistent output during the window selection.
@@ -273,13 +624,14 @@ def select_windows(
     window_everything=False,
     verbose=False,
     plot=False,
-
+    _precomputed=None,
 ):
     """
     Window selection algorithm for picking windows suitable for misfit
     calculation based on phase differences.
 
-    Returns a list of windows which might be empty due to various reasons.
+    Returns a list of windows which might be empty due to various reasons,
+    e.g. if the traces contain NaNs or the synthetics are all zeros.
 
     This function is really long and a lot of things. For a more detailed
     description, please see the LASIF paper.
@@ -348,6 +700,9 @@ def select_windows(
     :type verbose: bool
     :param plot: Create a plot of the algortihm while it does its work.
     :type plot: bool
+    :param _precomputed: Internal, the results of the stages that
+        :func:`select_windows_batch` runs for all traces at once.
+    :type _precomputed: dict
     """
     # Shortcuts to frequently accessed variables.
     data_starttime = data_trace.stats.starttime
@@ -358,37 +713,39 @@ def select_windows(
     data = data_trace.data
     times = data_trace.times()
 
+    if _precomputed is None:
+        statistics = {
+            _k: _v[0]
+            for _k, _v in _trace_statistics(
+                data[np.newaxis], synth[np.newaxis]
+            ).items()
+        }
+    else:
+        statistics = _precomputed["statistics"]
+
     # Don't return any windows if there is a NaN
-    if np.sum(np.isnan(data)) > 0 or np.sum(np.isnan(synth)) > 0:
+    if statistics["has_nan"]:
         return []
 
     # -------------------------------------------------------------------------
     # Geographical calculations and the time of the first arrival.
     # -------------------------------------------------------------------------
-    dist_in_km = (
-        geodetics.calc_vincenty_inverse(
-            station_latitude,
-            station_longitude,
+    if _precomputed is None:
+        dist_in_km = _distance_in_km(
             event_latitude,
             event_longitude,
-        )[0]
-        / 1000.0
-    )
+            station_latitude,
+            station_longitude,
+        )
+    else:
+        dist_in_km = _precomputed["dist_in_km"]
 
     # -------------------------------------------------------------------------
     # Window settings
     # -------------------------------------------------------------------------
-    # Number of samples in the sliding window. Currently, the length of the
-    # window is set to a multiple of the dominant period of the synthetics.
-    # Make sure it is an uneven number; just to have a trivial midpoint
-    # definition and one sample does not matter much in any case.
-    window_length = int(round(float(2 * minimum_period) / dt))
-    if not window_length % 2:
-        window_length += 1
-
-    # Use a Hanning window. No particular reason for it but its a well-behaved
-    # window and has nice spectral properties.
-    taper = np.hanning(window_length)
+    window_length, window_shift, taper = _sliding_window_settings(
+        minimum_period, dt
+    )
 
     # =========================================================================
     # check if whole seismograms are sufficiently correlated and estimate
@@ -396,29 +753,28 @@ def select_windows(
     # =========================================================================
 
     # Overall Correlation coefficient.
-    norm = np.sqrt(np.sum(data ** 2)) * np.sqrt(np.sum(synth ** 2))
-    cc = np.sum(data * synth) / norm
+    cc = statistics["cc"]
     if verbose:
         _log_window_selection(
             data_trace.id, "Correlation Coefficient: %.4f" % cc
         )
 
-    first_tt_arrival = np.where(np.abs(synth) > 5e-3 * np.max(np.abs(synth)))[0][0]
-    idx_end = int(0.9 * first_tt_arrival)
-    idx_end = max(idx_end, 1)  # ensure at least 1 sample is available
-    idx_start = 0
-
-    if idx_start >= idx_end:
-        idx_start = max(0, idx_end - 10)
-
-    abs_data = np.abs(data)
+    # Don't return any windows if the synthetics have no arrival, i.e. they
+    # are all zeros.
+    first_tt_arrival = statistics["first_tt_arrival"]
+    if first_tt_arrival < 0:
+        if verbose:
+            _log_window_selection(
+                data_trace.id, "Rejecting, the synthetics have no arrival"
+            )
+        return []
 
     # Return empty window when no data is available
-    if np.max(abs_data) == 0.0 or np.max(np.abs(synth)) == 0.0:
+    if statistics["no_data"]:
         return []
 
-    noise_absolute = abs_data[idx_start:idx_end].max()
-    noise_relative = noise_absolute / abs_data.max()
+    noise_absolute = statistics["noise_absolute"]
+    noise_relative = statistics["noise_relative"]
 
     if verbose:
         _log_window_selection(
@@ -430,27 +786,15 @@ def select_windows(
 
     # Basic global rejection criteria.
     accept_traces = True
-    if (cc < min_cc) and (noise_relative > max_noise / 3.0):
-        msg = "Correlation %.4f is below threshold of %.4f" % (cc, min_cc)
-        if verbose:
-            _log_window_selection(data_trace.id, msg)
-        accept_traces = msg
-
-    if noise_relative > max_noise:
-        msg = "Noise level %.3f is above threshold of %.3f" % (
-            noise_relative,
-            max_noise,
-        )
-        if verbose:
-            _log_window_selection(data_trace.id, msg)
-        accept_traces = msg
-
-    minimum_distance = 2 * minimum_period * min_velocity
-    if dist_in_km < minimum_distance:
-        msg = "Source - Receiver distance %.3f is below threshold of %.3f" % (
-            dist_in_km,
-            minimum_distance,
-        )
+    for msg in _rejection_reasons(
+        cc,
+        noise_relative,
+        dist_in_km,
+        minimum_period,
+        min_cc,
+        max_noise,
+        min_velocity,
+    ):
         if verbose:
             _log_window_selection(data_trace.id, msg)
         accept_traces = msg
@@ -664,22 +1008,21 @@ def select_windows(
     # after the minimum and maximum travel times, respectively.
     # theoretical arrival as positive.
     # Account for delays in the source time functions as well
-    min_idx = first_tt_arrival - int(minimum_period / dt)
-    min_idx = max(0, min_idx)
-
     if global_inversion:
-        max_idx = len(synth)
+        stf_delay = None
+    elif _precomputed is None:
+        stf_delay = _stf_delay(stf_trace)
     else:
-        stf_env = obspy.signal.filter.envelope(stf_trace)
-        max_env_amplitude_idx = np.argmax(stf_env.data)
-        threshold = 0.5 * np.max(stf_env.data)
-        max_idx = int(
-            math.ceil((dist_in_km / min_velocity + minimum_period / 2.0) / dt)
-        )
-        max_idx += int(
-            np.argmax(stf_env[max_env_amplitude_idx:] < threshold)
-            + np.argmax(stf_env.data)
-        )
+        stf_delay = _precomputed["stf_delay"]
+    min_idx, max_idx = _traveltime_limits(
+        first_tt_arrival,
+        dist_in_km,
+        stf_delay,
+        dt,
+        npts,
+        minimum_period,
+        min_velocity,
+    )
 
     if window_everything and accept_traces is True:
         windows = [(data_starttime + dt * min_idx,
@@ -706,49 +1049,48 @@ def select_windows(
     max_cc_coeff = np.ma.zeros(npts, dtype="float32")
     max_cc_coeff.mask = True
 
-    # Compute the amount of indices by which to shift the sliding windows
-    # for long seismograms this otherwise gets unnecessarily expensive
-    window_shift = int(0.05 * window_length)
-    if not window_shift % 2:
-        window_shift += 1
-    window_shift = max(window_shift, 1)
-
-    for start_idx, end_idx, midpoint_idx in _window_generator(
-        npts, window_length, window_shift
-    ):
-        if not min_idx < midpoint_idx < max_idx:
-            continue
-
-        # Slice windows. Create a copy to be able to taper without affecting
-        # the original time series.
-        data_window = data[start_idx:end_idx].copy() * taper
-        synthetic_window = synth[start_idx:end_idx].copy() * taper
-
-        # Elimination Stage 2: Skip windows that have essentially no energy
-        # to avoid instabilities. No windows can be picked in these.
-        sw_start_idx = int(midpoint_idx - ((window_shift - 1) / 2))
-        sw_end_idx = int(midpoint_idx + ((window_shift - 1) / 2) + 1)
-
-        if synthetic_window.ptp() < synth.ptp() * 0.001:
-            time_windows.mask[sw_start_idx:sw_end_idx] = True
-            continue
-
+    if _precomputed is None:
+        window_positions, data_windows, synthetic_windows, no_energy = (
+            _sliding_windows(
+                data,
+                synth,
+                window_length,
+                window_shift,
+                taper,
+                min_idx,
+                max_idx,
+            )
+        )
         # Calculate the time shift. Here this is defined as the shift of the
-        # synthetics relative to the data. So a value of 2, for instance, means
-        # that the synthetics are 2 timesteps later then the data.
-        cc = np.correlate(data_window, synthetic_window, mode="full")
+        # synthetics relative to the data. So a value of 2, for instance,
+        # means that the synthetics are 2 timesteps later then the data.
+        if window_positions:
+            time_shifts, max_cc_values = _max_cross_correlation(
+                data_windows, synthetic_windows
+            )
+    else:
+        window_positions, no_energy, time_shifts, max_cc_values = (
+            _precomputed["sliding_windows"]
+        )
+    if window_positions:
+        # Every sliding window sets the values of the window_shift samples
+        # around its midpoint. Their ranges do not overlap as window_shift
+        # is uneven.
+        half_shift = (window_shift - 1) // 2
+        midpoints = np.array([_p[2] for _p in window_positions])
+        samples = midpoints[:, np.newaxis] + np.arange(
+            -half_shift, half_shift + 1
+        )
+        time_windows.mask[samples[no_energy].ravel()] = True
 
-        time_shift = cc.argmax() - window_length + 1
+        samples = samples[~no_energy].ravel()
         # Express the time shift in fraction of the minimum period.
-        sliding_time_shift[sw_start_idx:sw_end_idx] = (
-            time_shift * dt
-        ) / minimum_period
+        sliding_time_shift[samples] = np.repeat(
+            (time_shifts * dt) / minimum_period, window_shift
+        )
 
         # Normalized cross correlation.
-        max_cc_value = cc.max() / np.sqrt(
-            (synthetic_window ** 2).sum() * (data_window ** 2).sum()
-        )
-        max_cc_coeff[sw_start_idx:sw_end_idx] = max_cc_value
+        max_cc_coeff[samples] = np.repeat(max_cc_values, window_shift)
 
     if plot:
         plt.subplot2grid(grid, (9, 0), rowspan=1)
@@ -865,8 +1207,7 @@ def select_windows(
         old_time_windows = time_windows.copy()
     sample_buffer = int(np.ceil(minimum_period / dt * 0.1))
     indices = np.ma.where(np.ma.abs(np.ma.diff(sliding_time_shift)) > 0.1)[0]
-    for index in indices:
-        time_windows.mask[index - sample_buffer : index + sample_buffer] = True
+    _mask_around(time_windows, indices, sample_buffer)
     if plot:
         plt.subplot2grid(grid, (20, 0), rowspan=1)
         _plot_mask(
@@ -948,11 +1289,9 @@ def select_windows(
     min_length = min(
         minimum_period / dt * min_length_period, maximum_period / dt
     )
-    for i in flatnotmasked_contiguous(time_windows):
-        # Step 7: Throw away all windows with a length of less then
-        # min_length_period the dominant period.
-        if (i.stop - i.start) < min_length:
-            time_windows.mask[i.start : i.stop] = True
+    # Step 7: Throw away all windows with a length of less then
+    # min_length_period the dominant period.
+    _mask_short_windows(time_windows, min_length)
     if plot:
         plt.subplot2grid(grid, (26, 0), rowspan=1)
         _plot_mask(
@@ -981,32 +1320,14 @@ def select_windows(
         # in that case dont crash, but return the windows that did not fail.
         try:
             closest_peaks = find_closest(data_p, synth_p)
-            diffs = np.diff(closest_peaks)
-
-            for idx in np.where(diffs == 1)[0]:
-                if idx > 0:
-                    start = synth_p[idx - 1]
-                else:
-                    start = 0
-                if idx < (len(synth_p) - 1):
-                    end = synth_p[idx + 1]
-                else:
-                    end = -1
-                window_mask[start:end] = False
+            window_mask &= ~_marching_ranges(
+                closest_peaks, synth_p, window_npts
+            )
 
             closest_troughs = find_closest(data_t, synth_t)
-            diffs = np.diff(closest_troughs)
-
-            for idx in np.where(diffs == 1)[0]:
-                if idx > 0:
-                    start = synth_t[idx - 1]
-                else:
-                    start = 0
-                if idx < (len(synth_t) - 1):
-                    end = synth_t[idx + 1]
-                else:
-                    end = -1
-                window_mask[start:end] = False
+            window_mask &= ~_marching_ranges(
+                closest_troughs, synth_t, window_npts
+            )
         except Exception as e:
             print(e)
             continue
@@ -1060,11 +1381,9 @@ def select_windows(
     min_length = min(
         minimum_period / dt * min_length_period, maximum_period / dt
     )
-    for i in flatnotmasked_contiguous(time_windows):
-        # Step 7: Throw away all windows with a length of less then
-        # min_length_period the dominant period.
-        if (i.stop - i.start) < min_length:
-            time_windows.mask[i.start : i.stop] = True
+    # Step 7: Throw away all windows with a length of less then
+    # min_length_period the dominant period.
+    _mask_short_windows(time_windows, min_length)
     if plot:
         plt.subplot2grid(grid, (29, 0), rowspan=1)
         _plot_mask(
@@ -1151,6 +1470,227 @@ def select_windows(
     return windows
 
 
+def select_windows_batch(
+    data,
+    synthetics,
+    starttimes,
+    delta,
+    stf_trace,
+    event_latitude,
+    event_longitude,
+    event_depth_in_km,
+    station_latitudes,
+    station_longitudes,
+    minimum_period,
+    maximum_period,
+    min_cc=0.10,
+    max_noise=0.10,
+    max_noise_window=0.4,
+    min_velocity=2.4,
+    threshold_shift=0.30,
+    threshold_correlation=0.75,
+    min_length_period=1.5,
+    min_peaks_troughs=2,
+    max_energy_ratio=10.0,
+    min_envelope_similarity=0.2,
+    global_inversion=False,
+    window_everything=False,
+    verbose=False,
+    ids=None,
+    max_batch_windows=4096,
+):
+    """
+    Window selection for many pairs of traces with identical sampling at
+    once, e.g. all components of all stations of an event.
+
+    The global statistics and rejection criteria of all traces, the source -
+    receiver distance of every station, the delay of the source time
+    function and the sliding window cross correlations are computed for the
+    whole batch, the remaining stages run per trace. Every pair of traces
+    gets the same windows as with :func:`select_windows`.
+
+    :param data: The data, one trace per row.
+    :type data: :class:`numpy.ndarray`
+    :param synthetics: The synthetics, one trace per row, with the same
+        shape as the data.
+    :type synthetics: :class:`numpy.ndarray`
+    :param starttimes: The start time of every trace or a single start time
+        for all traces.
+    :type starttimes: list of :class:`obspy.core.utcdatetime.UTCDateTime`
+    :param delta: The sampling interval of all traces in seconds.
+    :type delta: float
+    :param stf_trace: The stf trace.
+    :type stf_trace: :class:`~obspy.core.trace.Trace`
+    :param event_latitude: The event latitude.
+    :type event_latitude: float
+    :param event_longitude: The event longitude.
+    :type event_longitude: float
+    :param event_depth_in_km: The event depth in km.
+    :type event_depth_in_km: float
+    :param station_latitudes: The station latitude of every trace.
+    :type station_latitudes: list of float
+    :param station_longitudes: The station longitude of every trace.
+    :type station_longitudes: list of float
+    :param minimum_period: The minimum period of the data in seconds.
+    :type minimum_period: float
+    :param maximum_period: The maximum period of the data in seconds.
+    :type maximum_period: float
+    :param ids: The ids of the traces in the form ``NET.STA.LOC.CHA``, only
+        used for the log messages, defaults to None
+    :type ids: list of str, optional
+    :param max_batch_windows: Number of sliding windows that are cross
+        correlated at once, defaults to 4096
+    :type max_batch_windows: int, optional
+
+    All other parameters are those of :func:`select_windows`.
+
+    :return: The windows of every pair of traces, see
+        :func:`select_windows`.
+    """
+    data = np.ascontiguousarray(data)
+    synthetics = np.ascontiguousarray(synthetics)
+    if data.ndim != 2 or data.shape != synthetics.shape:
+        raise ValueError(
+            "Data and synthetics must have the same shape with one trace "
+            "per row."
+        )
+    n_traces, npts = data.shape
+    if isinstance(starttimes, obspy.UTCDateTime):
+        starttimes = [starttimes] * n_traces
+
+    statistics = _trace_statistics(data, synthetics)
+    distances = {}
+    for latitude, longitude in zip(station_latitudes, station_longitudes):
+        if (latitude, longitude) not in distances:
+            distances[(latitude, longitude)] = _distance_in_km(
+                event_latitude, event_longitude, latitude, longitude
+            )
+    stf_delay = None if global_inversion else _stf_delay(stf_trace)
+    window_length, window_shift, taper = _sliding_window_settings(
+        minimum_period, delta
+    )
+
+    # The sliding windows of all traces that can have windows. Their cross
+    # correlations are computed for many traces at once.
+    precomputed = {}
+    pending = []
+
+    def _correlate_pending():
+        time_shifts, max_cc_values = _max_cross_correlation(
+            np.concatenate([_p[2] for _p in pending]),
+            np.concatenate([_p[3] for _p in pending]),
+        )
+        start = 0
+        for i, window_positions, data_windows, _, no_energy in pending:
+            stop = start + len(data_windows)
+            precomputed[i]["sliding_windows"] = (
+                window_positions,
+                no_energy,
+                time_shifts[start:stop],
+                max_cc_values[start:stop],
+            )
+            start = stop
+        del pending[:]
+
+    for i in range(n_traces):
+        if (
+            statistics["has_nan"][i]
+            or statistics["first_tt_arrival"][i] < 0
+            or statistics["no_data"][i]
+        ):
+            continue
+        dist_in_km = distances[(station_latitudes[i], station_longitudes[i])]
+        precomputed[i] = {
+            "statistics": {_k: _v[i] for _k, _v in statistics.items()},
+            "dist_in_km": dist_in_km,
+            "stf_delay": stf_delay,
+            "sliding_windows": ([], None, None, None),
+        }
+        if window_everything or _rejection_reasons(
+            statistics["cc"][i],
+            statistics["noise_relative"][i],
+            dist_in_km,
+            minimum_period,
+            min_cc,
+            max_noise,
+            min_velocity,
+        ):
+            continue
+        min_idx, max_idx = _traveltime_limits(
+            statistics["first_tt_arrival"][i],
+            dist_in_km,
+            stf_delay,
+            delta,
+            npts,
+            minimum_period,
+            min_velocity,
+        )
+        window_positions, data_windows, synthetic_windows, no_energy = (
+            _sliding_windows(
+                data[i],
+                synthetics[i],
+                window_length,
+                window_shift,
+                taper,
+                min_idx,
+                max_idx,
+            )
+        )
+        if not window_positions:
+            continue
+        pending.append(
+            (i, window_positions, data_windows, synthetic_windows, no_energy)
+        )
+        if sum(len(_p[2]) for _p in pending) >= max_batch_windows:
+            _correlate_pending()
+    if pending:
+        _correlate_pending()
+
+    windows = []
+    for i in range(n_traces):
+        if i not in precomputed:
+            windows.append([])
+            continue
+        header = {"delta": delta, "starttime": starttimes[i]}
+        if ids is not None:
+            for key, value in zip(
+                ["network", "station", "location", "channel"],
+                ids[i].split("."),
+            ):
+                header[key] = value
+        windows.append(
+            select_windows(
+                data_trace=obspy.Trace(data=data[i], header=header),
+                synthetic_trace=obspy.Trace(
+                    data=synthetics[i], header=header
+                ),
+                stf_trace=stf_trace,
+                event_latitude=event_latitude,
+                event_longitude=event_longitude,
+                event_depth_in_km=event_depth_in_km,
+                station_latitude=station_latitudes[i],
+                station_longitude=station_longitudes[i],
+                minimum_period=minimum_period,
+                maximum_period=maximum_period,
+                min_cc=min_cc,
+                max_noise=max_noise,
+                max_noise_window=max_noise_window,
+                min_velocity=min_velocity,
+                threshold_shift=threshold_shift,
+                threshold_correlation=threshold_correlation,
+                min_length_period=min_length_period,
+                min_peaks_troughs=min_peaks_troughs,
+                max_energy_ratio=max_energy_ratio,
+                min_envelope_similarity=min_envelope_similarity,
+                global_inversion=global_inversion,
+                window_everything=window_everything,
+                verbose=verbose,
+                _precomputed=precomputed[i],
+            )
+        )
+    return windows
+
+
 if __name__ == "__main__":
     import doctest
 